@@ -1,15 +1,29 @@
 @ECHO OFF
 TITLE "Preparing to update databases"
 
-start C:\Programs\shread_dash\batch_scripts\shread_snow_to_db.bat
-start C:\Programs\shread_dash\batch_scripts\shread_ndfd_to_db.bat
-start C:\Programs\shread_dash\batch_scripts\csas_to_db.bat
-start C:\Programs\shread_dash\batch_scripts\update_dust.bat
-start C:\Programs\shread_dash\batch_scripts\rfc_to_db.bat
-start C:\Programs\shread_dash\batch_scripts\usgs_to_db.bat
-start C:\Programs\shread_dash\batch_scripts\snotel_to_db.bat
-
 set start=%time%
 echo process began at %start%
 
+REM SHREAD dbs, each followed by its Parquet files when the dashboard reads them (SHREAD_SPATIAL_BACKEND=parquet,
+REM set in the environment or with "database_update_full.bat parquet"; requires pyarrow)
+set batch_dir=C:\Programs\shread_dash\batch_scripts
+if /i "%~1"=="parquet" set SHREAD_SPATIAL_BACKEND=parquet
+if /i "%SHREAD_SPATIAL_BACKEND%"=="parquet" (
+	start "SNODAS" cmd /c "start /wait %batch_dir%\shread_snow_to_db.bat & start /wait %batch_dir%\shread_to_parquet.bat -s swe sd"
+	start "NDFD" cmd /c "start /wait %batch_dir%\shread_ndfd_to_db.bat & start /wait %batch_dir%\shread_to_parquet.bat -s mint maxt rhm pop12 qpf snow sky"
+) else (
+	start "SNODAS" %batch_dir%\shread_snow_to_db.bat
+	start "NDFD" %batch_dir%\shread_ndfd_to_db.bat
+)
+start C:\Programs\shread_dash\batch_scripts\update_dust.bat
+
+REM Site dbs one after the other, then the consolidated db built from them
+start /wait C:\Programs\shread_dash\batch_scripts\csas_to_db.bat
+start /wait C:\Programs\shread_dash\batch_scripts\rfc_to_db.bat
+start /wait C:\Programs\shread_dash\batch_scripts\usgs_to_db.bat
+start /wait C:\Programs\shread_dash\batch_scripts\snotel_to_db.bat
+start /wait C:\Programs\shread_dash\batch_scripts\consolidated_to_db.bat
+
+echo site dbs complete at %time%
+
 pause
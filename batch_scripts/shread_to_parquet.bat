@@ -0,0 +1,30 @@
+@ECHO OFF
+TITLE "Refreshing SHREAD Parquet files"
+REM Only needed when the dashboard reads the Parquet files (SHREAD_SPATIAL_BACKEND=parquet); requires pyarrow
+if /i not "%SHREAD_SPATIAL_BACKEND%"=="parquet" (
+	echo SHREAD_SPATIAL_BACKEND is not parquet, skipping the Parquet files
+	exit /b 0
+)
+set root=C:\Users\%USERNAME%\AppData\Local\miniforge3
+call %root%\Scripts\activate.bat
+set env=C:\Users\%USERNAME%\AppData\Local\miniforge3\envs\shread_env
+call activate %env%
+call :GET_THIS_DIR
+call chdir %THIS_DIR%
+set start=%time%
+python C:\Programs\shread_dash\database\SHREAD\shread_to_parquet.py %*
+
+if %ERRORLEVEL%==0 GOTO success
+GOTO fail
+
+:fail
+	echo "Update error...please rerun"
+	pause
+:success
+	echo process began at %start%
+	echo process complete at %time%
+	exit
+
+:GET_THIS_DIR
+set THIS_DIR=%~dp0
+pushd %THIS_DIR%
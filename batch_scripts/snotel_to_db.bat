@@ -7,7 +7,7 @@ call activate %env%
 call :GET_THIS_DIR
 call chdir %THIS_DIR%
 set start=%time%
-python C:\Programs\shread_dash\database\SNOTEL\snotel_to_db.py
+python C:\Programs\shread_dash\database\SNOTEL\snotel_to_db.py -n
 
 if %ERRORLEVEL%==0 GOTO success
 GOTO fail
@@ -13,26 +13,32 @@ from pathlib import Path
 import pandas as pd
 import numpy as np
 import sqlite3
-import sqlalchemy as sql
 import zipfile
 from zipfile import ZipFile
 import datetime as dt
-from requests import get as r_get
 from io import StringIO
 
 # Load directories and defaults
 this_dir = Path(__file__).absolute().resolve().parent
 #this_dir = Path('C:/Programs/shread_dash/database/CSAS')
+sys.path.append(str(this_dir.parent))
+from fetch_utils import get_text, fetch_all
+from db_utils import open_build, savepoint, write_keyed
+
 ZIP_IT = False
 ZIP_FRMT = zipfile.ZIP_LZMA
 DEFAULT_DATE_FIELD = 'date'
 DEFAULT_ARCH_DIR = Path(this_dir,'csas_archive')
 DEFAULT_CSV_DIR = Path(this_dir,'data')
 DEFAULT_DB_DIR = this_dir
+CSAS_URL = "https://www.snowstudies.org"
 COL_TYPES = {
     'date': str,'site':str,'type':str,'albedo':float,'snwd':float,'temp':float,'flow':float
 }
 
+# Unique key of each site table (rows are upserted on it, see db_utils.write_keyed)
+KEY_COLS = ['date']
+
 # Define functions
 def compose_date(years, months=1, days=1, weeks=None, hours=None, minutes=None,
                  seconds=None, milliseconds=None, microseconds=None, nanoseconds=None):
@@ -132,148 +138,149 @@ def process_csas_archive(data_dir=DEFAULT_CSV_DIR,csas_archive=DEFAULT_ARCH_DIR,
 
         df_out.to_csv(Path(data_dir,file),index_label="date")
 
-def process_csas_live(data_dir=DEFAULT_CSV_DIR,verbose=False):
+def process_csas_site(site,dtype,data_dir=DEFAULT_CSV_DIR,verbose=False):
     """
-    process csas live data from https://snowstudies.org/current-conditions/
-    output: none in consul, formatted .csv files to DEFAULT_CSV_DIR
+    process csas live data for one site and dtype from https://snowstudies.org/current-conditions/
+    output: none in consul, formatted .csv file to DEFAULT_CSV_DIR
     """
-    # Check for output directory:
-    if os.path.isdir(data_dir) is False:
-        os.mkdir(data_dir)
+    if verbose:
+        print(f'Processing {dtype} data for {site}...')
 
-    csas_sites = ["SBSP","SASP","PTSP","SBSG"]
-    csas_dtypes = ["iv","dv"]
     # Set filepath extension for dtype
+    if dtype == "iv":
+        ext = "hourly-data"
+    if dtype == "dv":
+        ext = "daily-data"
+
+    # Convert site acronyms to names
+    if site == "SBSP":
+        site_str = "senator-beck-study-plot"
+    if site == "SASP":
+        site_str = "swamp-angel-study-plot"
+    if site == "PTSP":
+        site_str = "putney-study-plot"
+    if site == "SBSG":
+        site_str = "senator-beck-stream-gauge"
+
+    # Construct url
+    site_url = f"{CSAS_URL}/{site_str}-full-{ext}/"
+    print(site_url)
+
+    # Import
+    try:
+        f = pd.read_html(StringIO(get_text(site_url)))
+    except ImportError:
+        return
 
-    for dtype in csas_dtypes:
+    df_in = f[0]
+    #print(df_in)
+    if df_in.empty:
+        if verbose:
+            print("Data not available")
+            return
+    if df_in is None:
         if verbose:
-            print(f'Processing {dtype} data...')
+            print("Data not available")
+            return
+
+    # Parse datetime column
+    if dtype=="iv":
+        datcol = "Datetime"
+        dtformat = "%Y-%m-%d %H:%M"
+    if dtype=="dv":
+        datcol = "Date"
+        dtformat = "%Y-%m-%d"
+
+    # Drop 0000-00-00 rows
+    df_in = df_in.loc[df_in[datcol]!="0000-00-00",:]
+
+    # Convert dates
+    df_in.index = pd.to_datetime(df_in[datcol].values,format=dtformat)
+
+    # Check if datetimes were parsed
+    try:
+        df_in.index.year
+        print("Tim didn't goof this time!")
+    except AttributeError:
+        # if not...give error message and continue to next site
+        print(f"Date format is incorrect. Please check {site_url}")
+        return
 
-        for site in csas_sites:
-            if verbose:
-                print(f'for {site}...')
-
-            # Set filepath extension for dtype
-            if dtype == "iv":
-                ext = "hourly-data"
-            if dtype == "dv":
-                ext = "daily-data"
-
-            # Convert site acronyms to names
-            if site == "SBSP":
-                site_str = "senator-beck-study-plot"
-            if site == "SASP":
-                site_str = "swamp-angel-study-plot"
-            if site == "PTSP":
-                site_str = "putney-study-plot"
-            if site == "SBSG":
-                site_str = "senator-beck-stream-gauge"
-
-            # Construct url
-            site_url = f"https://www.snowstudies.org/{site_str}-full-{ext}/"
-            print(site_url)
-
-            # Import
-            failed = True
-            tries = 0
-            df_in = None
-            try:
-                f = pd.read_html(site_url)
-            except ImportError:
-                continue
+    # Get year and dayofyear out of dt column
+    if "Year" not in df_in.columns:
+        df_in["Year"] = df_in.index.year
 
-            df_in = f[0]
-            #print(df_in)
-            if df_in.empty:
-                if verbose:
-                    print("Data not available")
-                    return
-            if df_in is None:
-                if verbose:
-                    print("Data not available")
-                    return
-            
-            # Parse datetime column
-            if dtype=="iv":
-                datcol = "Datetime"
-                dtformat = "%Y-%m-%d %H:%M"
-            if dtype=="dv":
-                datcol = "Date"
-                dtformat = "%Y-%m-%d"
+    if "DOY" not in df_in.columns:
+        df_in["DOY"] = df_in.index.dayofyear
 
-            # Drop 0000-00-00 rows
-            df_in = df_in.loc[df_in[datcol]!="0000-00-00",:]
+    if "Hour" not in df_in.columns:
+        df_in["Hour"] = df_in.index.hour
 
-            # Convert dates
-            df_in.index = pd.to_datetime(df_in[datcol].values,format=dtformat)
+    if dtype == "dv":
+        dates = compose_date(years=df_in.Year,days=df_in.DOY)
+    if dtype == "iv":
+        dates = compose_date(years=df_in.Year, days=df_in.DOY,hours=df_in.Hour/100)
 
-            # Check if datetimes were parsed
-            try:
-                df_in.index.year
-                print("Tim didn't goof this time!")
-            except AttributeError:
-                # if not...give error message and continue to next site
-                print(f"Date format is incorrect. Please check {site_url}")
-                continue
-                                
-            # Get year and dayofyear out of dt column
-            if "Year" not in df_in.columns:
-                df_in["Year"] = df_in.index.year
-
-            if "DOY" not in df_in.columns:
-                df_in["DOY"] = df_in.index.dayofyear
-
-            if "Hour" not in df_in.columns:
-                df_in["Hour"] = df_in.index.hour
-
-            if dtype == "dv":
-                dates = compose_date(years=df_in.Year,days=df_in.DOY)
-            if dtype == "iv":
-                dates = compose_date(years=df_in.Year, days=df_in.DOY,hours=df_in.Hour/100)
-
-            df_out = pd.DataFrame(index=df_in.index,
-                                  columns=["site","type","albedo","snwd","temp","flow"])
-            df_out["site"] = site
-            df_out["type"] = dtype
-
-            for col in df_in.columns:
-                # Check for albedo and solar radiation
-                if "Albedo" in col:
-                    df_out["albedo"] = df_in[col]
-                if "Solar Radiation-Up" in col:
-                    df_out["radup"] = df_in[col]
-                if "Solar Radiation-Down" in col:
-                    df_out["raddn"] = df_in[col]
-
-                # Check for snow depth
-                if "Snow Depth" in col:
-                    df_out["snwd"] = df_in[col]*3.281*12
-                    df_out.loc[df_out["snwd"] > 109, 'snwd'] = np.nan  # 109 is common error value
-                    df_out["snwd"] = df_out["snwd"].interpolate(limit=3)
-
-                # Check for temp
-                if ("Air Temperature" in col) & ("(C" in col):
-                    df_out["temp"] = df_in[col]*9/5+32
-
-                # Check for flow
-                if "Discharge" in col:
-                    df_out["flow"] = df_in[col]
-
-            # Fix albedo
-            if (all(pd.isna(df_out["albedo"]))==True) and ("radup" in df_out.columns) and ("raddn" in df_out.columns):
-                df_out["albedo"] = df_out["raddn"] / df_out["radup"]
-                df_out.loc[df_out["albedo"]>=1,'albedo'] = np.nan
-                df_out.loc[df_out["albedo"]<=0,"albedo"] = np.nan
-            if ("radup" in df_out.columns):
-                df_out = df_out.drop(labels=["radup"],axis=1)
-            if ("raddn" in df_out.columns):
-                df_out = df_out.drop(labels=["raddn"], axis=1)
-
-            # Add date index
-            df_out.index=dates
-
-            file = f"{site}_{dtype}_live.csv"
-            df_out.to_csv(Path(data_dir,file),index_label="date")
+    df_out = pd.DataFrame(index=df_in.index,
+                          columns=["site","type","albedo","snwd","temp","flow"])
+    df_out["site"] = site
+    df_out["type"] = dtype
+
+    for col in df_in.columns:
+        # Check for albedo and solar radiation
+        if "Albedo" in col:
+            df_out["albedo"] = df_in[col]
+        if "Solar Radiation-Up" in col:
+            df_out["radup"] = df_in[col]
+        if "Solar Radiation-Down" in col:
+            df_out["raddn"] = df_in[col]
+
+        # Check for snow depth
+        if "Snow Depth" in col:
+            df_out["snwd"] = df_in[col]*3.281*12
+            df_out.loc[df_out["snwd"] > 109, 'snwd'] = np.nan  # 109 is common error value
+            df_out["snwd"] = df_out["snwd"].interpolate(limit=3)
+
+        # Check for temp
+        if ("Air Temperature" in col) & ("(C" in col):
+            df_out["temp"] = df_in[col]*9/5+32
+
+        # Check for flow
+        if "Discharge" in col:
+            df_out["flow"] = df_in[col]
+
+    # Fix albedo
+    if (all(pd.isna(df_out["albedo"]))==True) and ("radup" in df_out.columns) and ("raddn" in df_out.columns):
+        df_out["albedo"] = df_out["raddn"] / df_out["radup"]
+        df_out.loc[df_out["albedo"]>=1,'albedo'] = np.nan
+        df_out.loc[df_out["albedo"]<=0,"albedo"] = np.nan
+    if ("radup" in df_out.columns):
+        df_out = df_out.drop(labels=["radup"],axis=1)
+    if ("raddn" in df_out.columns):
+        df_out = df_out.drop(labels=["raddn"], axis=1)
+
+    # Add date index
+    df_out.index=dates
+
+    file = f"{site}_{dtype}_live.csv"
+    df_out.to_csv(Path(data_dir,file),index_label="date")
+
+def process_csas_live(data_dir=DEFAULT_CSV_DIR,verbose=False):
+    """
+    process csas live data from https://snowstudies.org/current-conditions/ (sites and dtypes downloaded concurrently)
+    output: none in consul, formatted .csv files to DEFAULT_CSV_DIR
+    """
+    # Check for output directory:
+    if os.path.isdir(data_dir) is False:
+        os.mkdir(data_dir)
+
+    csas_sites = ["SBSP","SASP","PTSP","SBSG"]
+    csas_dtypes = ["iv","dv"]
+
+    fetch_all(
+        lambda site_dtype: process_csas_site(site_dtype[0],site_dtype[1],data_dir,verbose),
+        [(site,dtype) for dtype in csas_dtypes for site in csas_sites]
+    )
 
 def get_dfs(data_dir=DEFAULT_CSV_DIR,verbose=False):
     """
@@ -306,75 +313,32 @@ def get_dfs(data_dir=DEFAULT_CSV_DIR,verbose=False):
     print('  Success!!!\n')
     return {'csas_iv':df_csas_iv,'csas_dv':df_csas_dv}
 
-# def get_unique_dates(tbl_name, db_path, date_field=DEFAULT_DATE_FIELD):
-#     """
-#     Get unique dates from shread data, to ensure no duplicates
-#     """
-#     if not db_path.is_file():
-#         return pd.DataFrame(columns=[DEFAULT_DATE_FIELD])
-#     db_con_str = f'sqlite:///{db_path.as_posix()}'
-#     eng = sql.create_engine(db_con_str)
-#     with eng.connect() as con:
-#         try:
-#             unique_dates = pd.read_sql(
-#                 f'select distinct {date_field} from {tbl_name}',
-#                 con
-#             ).dropna()
-#         except Exception:
-#             return pd.DataFrame(columns=[DEFAULT_DATE_FIELD])
-#     return pd.to_datetime(unique_dates[date_field])
-
-def write_db(df, db_path=DEFAULT_DB_DIR, if_exists='replace', check_dups=True,
+def write_db(df, db_path=DEFAULT_DB_DIR, if_exists='replace',
               zip_db=ZIP_IT, zip_frmt=ZIP_FRMT, verbose=False):
     """
     Write dataframe to database
     """
     sensor = df.name
     print(f'Creating sqlite db for {df.name}...\n')
-    print('  Getting unique site names...')
-    site_list = pd.unique(df['site'])
     db_name = f"{sensor}.db"
     db_path = Path(db_path, db_name)
     zip_name = f"{sensor}_db.zip"
     zip_path = Path(db_path, zip_name)
     print(f"  Writing {db_path}...")
-    df_site = None
-    con = None
-    for site in site_list:
-        if verbose:
-            print(f'    Getting data for {site}...')
-        df_site = df[df['site'] == site]
-        if df_site.empty:
+    with open_build(db_path) as con:
+        for site, df_site in df.groupby('site', sort=False):
             if verbose:
-                print(f'      No data for {site}...')
-            continue
-        
-        site_id = site
-        if if_exists == 'append' and check_dups:
+                print(f'    Getting data for {site}...')
+            site_id = site
             if verbose:
-                print(f'      Checking for duplicate data in {site}...')
-            #unique_dates = get_unique_dates(site_id, db_path)
-            initial_len = len(df_site.index)
-            df_site = df_site.drop_duplicates(subset=DEFAULT_DATE_FIELD,keep="last")
-            if verbose:
-                print(f'        Prevented {initial_len - len(df_site.index)} duplicates')
-        if verbose:
-            print(f'      Writing {site} to {db_name}...')
-        try:
-            con = sqlite3.connect(db_path)
-            df_site.to_sql(
-                site_id,
-                con, 
-                if_exists=if_exists,
-                chunksize=10000,
-                method='multi'
-            )
-        except sqlite3.Error as e:
-            print(f'      Error - did not write {site_id} table to {db_name} - {e}')
-        finally:
-            if con:
-                con.close()
-                con = None
+                print(f'      Writing {site} to {db_name}...')
+            try:
+                with savepoint(con):
+                    rows = write_keyed(con, site_id, df_site, KEY_COLS, if_exists)
+                if verbose:
+                    print(f'        Wrote {rows} rows')
+            except (sqlite3.Error, ValueError) as e:
+                print(f'      Error - did not write {site_id} table to {db_name} - {e}')
     if zip_db:
         if verbose:
             print('  When a problem comes along you must zip it! - ({zip_name})')
@@ -408,21 +372,20 @@ def parse_args():
     )
     parser.add_argument(
         "-e", "--exists", 
-        help="behavior if database table exists already",
-        choices=['replace','append','fail'],
+        help="behavior if database table exists already (append skips rows already in it, upsert updates them)",
+        choices=['replace','append','upsert','fail'],
         default='replace'
     )
-    parser.add_argument(
-        "-c", "--check_dups", 
-        help="only write non-duplicate dates (can slow process ALOT!)",
-        action='store_true',
-        default='true'
-    )
     parser.add_argument(
         "-z", "--zip", 
         help='zip database files after creation',
         action="store_true"
     )
+    parser.add_argument(
+        "-c", "--check_dups",
+        help="no longer used: the tables are keyed, so rows are never written twice",
+        action="store_true"
+    )
     parser.add_argument(
         "--verbose",
         help="print/log verbose",
@@ -449,6 +412,9 @@ if __name__ == '__main__':
 
     if args.version:
         print('csas_to_db.py v1.0')
+
+    if args.check_dups:
+        print('Warning: -c/--check_dups is no longer used (the tables are keyed), ignoring it')
     
     for arg_path in [args.input, args.output]:
         if not Path(arg_path).is_dir():
@@ -463,7 +429,6 @@ if __name__ == '__main__':
         write_db(
             df, 
             if_exists=args.exists, 
-            check_dups=args.check_dups,
             zip_db=args.zip, 
             verbose=args.verbose
         )
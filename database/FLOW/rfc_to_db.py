@@ -12,29 +12,69 @@ import os
 from pathlib import Path
 import pandas as pd
 import numpy as np
-import datetime as dt
 import sqlite3
-import sqlalchemy as sql
 import zipfile
 from zipfile import ZipFile
-from requests import get as r_get
 from io import StringIO
 import dataretrieval.nwis as nwis
 
 # Load directories and defaults
 this_dir = Path(__file__).absolute().resolve().parent
 #this_dir = Path('C:/Programs/shread_dash/database/FLOW')
+sys.path.append(str(this_dir.parent))
+from fetch_utils import get_text, fetch_all, FetchError
+from db_utils import open_build, savepoint, write_keyed
+
 ZIP_IT = False
 ZIP_FRMT = zipfile.ZIP_LZMA
 DEFAULT_DATE_FIELD = 'date'
 DEFAULT_CSV_DIR = Path(this_dir,'rfc_data')
 DEFAULT_DB_DIR = this_dir
+RFC_URL = "https://www.{rfc}.noaa.gov/product/hydrofcst/RVFCSV"
 
 # TODO check this!
 COL_TYPES = {
     'date': str,'flow':float,'site':str,'type':str,'fcst_dt':str
 }
 
+# Unique key of each site (forecast date and date) table (rows are upserted on it, see db_utils.write_keyed)
+KEY_COLS = ['fcst_dt', 'date']
+
+# Latest forecast date and row count of each site table (read by plot_lib.utils.screen_rfc)
+RFC_META_TABLE = 'rfc_meta'
+
+def parse_rfc_csv(csv_str, verbose=False):
+    """
+    Parse an RFC forecast csv (.fflw1.csv/.fflw24.csv): everything from the DATE,TIME,FLOW,... header line on is read
+    in one go, and returns a UTC indexed dataframe of flow (plus any other columns, as text)
+    """
+    lines = csv_str.splitlines()
+    for header, text in enumerate(lines):
+        if text.rstrip()[:4] == "DATE":
+            break
+    else:
+        raise ValueError("No DATE header found in RFC csv")
+    if verbose == True:
+        print(lines[header].rstrip().split(","))
+
+    rfc_dat = pd.read_csv(
+        StringIO("\n".join(text.rstrip() for text in lines[header:])),
+        dtype=str,
+        keep_default_na=False,
+        index_col=False
+    )
+    rfc_dat["flow"] = pd.to_numeric(rfc_dat["FLOW"])
+
+    # Date plus forecast hour (e.g. 12Z)
+    hours = rfc_dat["TIME"].str.strip("Z").astype(int)
+    rfc_dat.index = pd.to_datetime(rfc_dat["DATE"]) + pd.to_timedelta(hours, unit="h")
+    rfc_dat.index.name = "datetime"
+    rfc_dat = rfc_dat.drop(columns=["DATE","TIME","FLOW"])
+    rfc_dat = rfc_dat.tz_localize("UTC")
+    if verbose == True:
+        print(rfc_dat)
+    return rfc_dat
+
 def import_rfc(site,dtype,rfc = "cbrfc",data_dir=None,verbose=False):
     """Download NWS RFC flow data
 
@@ -57,47 +97,17 @@ def import_rfc(site,dtype,rfc = "cbrfc",data_dir=None,verbose=False):
     if dtype == "iv":
         ext = ".fflw1.csv"
 
-    site_url = "https://www."+rfc+".noaa.gov/product/hydrofcst/RVFCSV/"+site+ext
+    site_url = RFC_URL.format(rfc=rfc)+"/"+site+ext
 
     try:
-        csv_str = r_get(site_url, timeout=10).text
-    except TimeoutError:
-        raise Exception("Timeout; Data unavailable?")
+        csv_str = get_text(site_url, timeout=10)
+    except FetchError as error:
+        raise Exception(f"{error}; Data unavailable?")
     if "not found on this server" in csv_str:
         print("Site URL incorrect.")
         return None
 
-    csv_io = StringIO(csv_str)
-    rfc_in = csv_io.readlines()
-    rfc_dat = pd.DataFrame()
-    data=False
-    i = 0
-    for line in range(0, len(rfc_in)):
-        text = str(rfc_in[line])
-        text = text.rstrip()
-        if text[:4] == "DATE":
-            columns = text.split(",")
-            data=True
-            if verbose == True:
-                print(columns)
-            continue
-        if data==True:
-            vals = text.split(",")
-            if verbose == True:
-                print(vals)
-            for col in range(0, len(columns)):
-                rfc_dat.loc[i, columns[col]] = vals[col]
-            i = i + 1
-
-    rfc_dat["DATE"] = pd.to_datetime(rfc_dat["DATE"])
-    rfc_dat["flow"] = pd.to_numeric(rfc_dat["FLOW"])
-
-    for i in rfc_dat.index:
-        rfc_dat.loc[i,"datetime"] = rfc_dat.loc[i,"DATE"]+dt.timedelta(hours=int(rfc_dat.loc[i,"TIME"].strip("Z")))
-
-    rfc_dat.index = rfc_dat.datetime
-    rfc_dat = rfc_dat.drop(columns=["DATE","TIME","datetime","FLOW"])
-    rfc_dat = rfc_dat.tz_localize("UTC")
+    rfc_dat = parse_rfc_csv(csv_str, verbose)
     fcst_dt = rfc_dat.index.min().date().strftime("%Y-%m-%d")
 
     if data_dir is None:
@@ -146,76 +156,54 @@ def get_dfs(data_dir=DEFAULT_CSV_DIR,verbose=False):
     return {'rfc_dv':df_rfc_dv,
             'rfc_iv':df_rfc_iv}
 
-def get_unique_dates(tbl_name, db_path, date_field=DEFAULT_DATE_FIELD):
+def update_rfc_meta(con, site, dtype):
     """
-    Get unique dates from rfc data, to ensure no duplicates
+    Update the latest forecast date and row count of a site table in the rfc_meta table, and index the table on
+    fcst_dt for screen_rfc
     """
-    if not db_path.is_file():
-        return pd.DataFrame(columns=[DEFAULT_DATE_FIELD])
-    db_con_str = f'sqlite:///{db_path.as_posix()}'
-    eng = sql.create_engine(db_con_str)
-    with eng.connect() as con:
-        try:
-            unique_dates = pd.read_sql(
-                f'select distinct {date_field} from {tbl_name}',
-                con
-            ).dropna()
-        except Exception:
-            return pd.DataFrame(columns=[DEFAULT_DATE_FIELD])
-    return pd.to_datetime(unique_dates[date_field])
-
-
-def write_db(df, db_path=DEFAULT_DB_DIR, if_exists='replace', check_dups=False,
+    tbl_name = f"site_{site}"
+    con.execute(
+        f'create index if not exists "ix_{tbl_name}_fcst_dt" on "{tbl_name}" ("fcst_dt")'
+    )
+    con.execute(
+        f'create table if not exists {RFC_META_TABLE} ('
+        f'site text not null, dtype text not null, fcst_dt text, rows integer, '
+        f'primary key (site, dtype))'
+    )
+    con.execute(
+        f'insert or replace into {RFC_META_TABLE} (site, dtype, fcst_dt, rows) '
+        f'select ?, ?, max(fcst_dt), count(*) from "{tbl_name}"',
+        (site, dtype)
+    )
+
+def write_db(df, db_path=DEFAULT_DB_DIR, if_exists='replace',
              zip_db=ZIP_IT, zip_frmt=ZIP_FRMT, verbose=True):
     """
     Write dataframe to database
     """
     sensor = df.name
+    dtype = sensor.split('_')[-1]
     print(f'Creating sqlite db for {df.name}...\n')
-    print('  Getting unique site names...')
-    site_list = pd.unique(df['site'])
     db_name = f"{sensor}.db"
     db_path = Path(db_path, db_name)
     zip_name = f"{sensor}_db.zip"
     zip_path = Path(db_path, zip_name)
     print(f"  Writing {db_path}...")
-    df_site = None
-    con = None
-    for site in site_list:
-        if verbose:
-            print(f'    Getting data for {site}...')
-        df_site = df[df['site'] == site]
-        if df_site.empty:
-            if verbose:
-                print(f'      No data for {site}...')
-            continue
-
-        site_id = site
-        if if_exists == 'append' and check_dups:
+    with open_build(db_path) as con:
+        for site, df_site in df.groupby('site', sort=False):
             if verbose:
-                print(f'      Checking for duplicate data in {site}...')
-            unique_dates = get_unique_dates(site_id, db_path)
-            initial_len = len(df_site.index)
-            df_site = df_site[~df_site[DEFAULT_DATE_FIELD].isin(unique_dates)]
+                print(f'    Getting data for {site}...')
+            site_id = site
             if verbose:
-                print(f'        Prevented {initial_len - len(df_site.index)} duplicates')
-        if verbose:
-            print(f'      Writing site_{site_id} to {db_name}...')
-        try:
-            con = sqlite3.connect(db_path)
-            df_site.to_sql(
-                f"site_{site}",
-                con,
-                if_exists=if_exists,
-                chunksize=10000,
-                method='multi'
-            )
-        except sqlite3.Error as e:
-            print(f'      Error - did not write {site_id} table to {db_name} - {e}')
-        finally:
-            if con:
-                con.close()
-                con = None
+                print(f'      Writing site_{site_id} to {db_name}...')
+            try:
+                with savepoint(con):
+                    rows = write_keyed(con, f"site_{site}", df_site, KEY_COLS, if_exists)
+                    update_rfc_meta(con, site, dtype)
+                if verbose:
+                    print(f'        Wrote {rows} rows')
+            except (sqlite3.Error, ValueError) as e:
+                print(f'      Error - did not write {site_id} table to {db_name} - {e}')
     if zip_db:
         if verbose:
             print('  When a problem comes along you must zip it! - ({zip_name})')
@@ -250,21 +238,20 @@ def parse_args():
     )
     parser.add_argument(
         "-e", "--exists",
-        help="behavior if database table exists already",
-        choices=['replace', 'append', 'fail'],
+        help="behavior if database table exists already (append skips rows already in it, upsert updates them)",
+        choices=['replace', 'append', 'upsert', 'fail'],
         default='replace'
     )
-    parser.add_argument(
-        "-c", "--check_dups",
-        help="only write non-duplicate dates (can slow process ALOT!)",
-        action='store_true',
-        default='true'
-    )
     parser.add_argument(
         "-z", "--zip",
         help='zip database files after creation',
         action="store_true"
     )
+    parser.add_argument(
+        "-c", "--check_dups",
+        help="no longer used: the tables are keyed, so rows are never written twice",
+        action="store_true"
+    )
     parser.add_argument(
         "--verbose",
         help="print/log verbose",
@@ -283,13 +270,16 @@ if __name__ == '__main__':
     # Identify SNOTEL sites:
     usgs_sites = pd.read_csv(os.path.join(this_dir, "usgs_gages.csv"),index_col=0)
 
-    for site_no in usgs_sites.index:
-        if str(usgs_sites.loc[site_no,"rfc"])!="nan":
-            for dtype in ["dv", "iv"]:
-                print(f'Downloading data for {usgs_sites.loc[site_no,"rfc"]}')
-                fcst_dt = import_rfc(usgs_sites.loc[site_no,"rfc"],dtype,"cbrfc",DEFAULT_CSV_DIR)
-
-    # TODO: fix duplicate issues
+    rfc_sites = [
+        (usgs_sites.loc[site_no,"rfc"], dtype)
+        for site_no in usgs_sites.index if str(usgs_sites.loc[site_no,"rfc"])!="nan"
+        for dtype in ["dv", "iv"]
+    ]
+    print(f'Downloading data for {len(rfc_sites)} forecasts')
+    fetch_all(
+        lambda rfc_site: import_rfc(rfc_site[0],rfc_site[1],"cbrfc",DEFAULT_CSV_DIR),
+        rfc_sites
+    )
 
     # Arguments for db build
     args = parse_args()
@@ -298,6 +288,9 @@ if __name__ == '__main__':
     if args.version:
         print('rfc_to_db.py v1.0')
 
+    if args.check_dups:
+        print('Warning: -c/--check_dups is no longer used (the tables are keyed), ignoring it')
+
     for arg_path in [args.input, args.output]:
         if not Path(arg_path).is_dir():
             print('Invalid arg filepath ({args_path}), please try again.')
@@ -311,7 +304,6 @@ if __name__ == '__main__':
         write_db(
             df,
             if_exists=args.exists,
-            check_dups=args.check_dups,
             zip_db=args.zip,
             verbose=args.verbose
         )
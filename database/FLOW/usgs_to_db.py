@@ -14,7 +14,6 @@ import pandas as pd
 import numpy as np
 import datetime as dt
 import sqlite3
-import sqlalchemy as sql
 import zipfile
 from zipfile import ZipFile
 from requests import get as r_get
@@ -24,26 +23,51 @@ import dataretrieval.nwis as nwis
 # Load directories and defaults
 #this_dir = Path(__file__).absolute().resolve().parent
 this_dir = Path('C:/Programs/shread_dash/database/FLOW')
+sys.path.append(str(Path(__file__).absolute().resolve().parent.parent))
+from fetch_utils import host_slot, fetch_all, retry_call
+from db_utils import open_build, savepoint, get_last_dates, write_keyed
+
 ZIP_IT = False
 ZIP_FRMT = zipfile.ZIP_LZMA
 DEFAULT_DATE_FIELD = 'date'
 DEFAULT_CSV_DIR = Path(this_dir,'usgs_data')
 DEFAULT_DB_DIR = this_dir
+# dataretrieval makes its own requests; host_slot(NWIS_URL) limits how many run at once. Errors other than
+# ValueError (bad request or no data) are retried.
+NWIS_URL = "https://waterservices.usgs.gov"
+# Days before the last stored date requested again by incremental updates (picks up revised provisional data)
+USGS_LOOKBACK = 2
+
+# Flow of the rows written for a gage without data (at the time of the request) and of missing or ice values
+NO_DATA_FLOW = -1
 
 # TODO check this!
 COL_TYPES = {
     'date': str,'flow':float,'site':str,'type':str
 }
 
+# Unique key of each site table (rows are upserted on it, see db_utils.write_keyed)
+KEY_COLS = ['date']
+
 # Define functions
-def import_nwis(site,start=None,end=None,dtype="dv",data_dir=None):
+def get_nwis_record(site,start,end,dtype):
+    """
+    Request flows for site from NWIS (dataretrieval), holding a slot for the NWIS host
+    """
+    with host_slot(NWIS_URL):
+        return nwis.get_record(sites=site, start=start, end=end, service=dtype, parameterCd="00060")
+
+def import_nwis(site,start=None,end=None,dtype="dv",data_dir=None,no_data_row=True):
     """
     Imports flows from NWIS site
     :param site: str, FLOW site number
     :param dtype: str, "dv" or "iv"
     :param start: str, start date (default is None)
     :param end: str, end date (default is None)
-    :return: dataframe with date index, dates, flows, month, year and water year
+    :param no_data_row: bool, if no data, return (or write) a row with flow -1 at the current time; if False, an
+        empty dataframe (incremental updates, see get_start_dates)
+    :return: dataframe with date index, dates, flows, month, year and water year, or the path of the .csv if saved
+        to data_dir
     """
     # Output directory
     if data_dir is not None:
@@ -79,24 +103,28 @@ def import_nwis(site,start=None,end=None,dtype="dv",data_dir=None):
 
     # Import data
     try:
-        data = nwis.get_record(sites=site, start=start, end=end, service=dtype, parameterCd="00060")
+        data = retry_call(get_nwis_record, site, start, end, dtype, desc=f"NWIS {dtype} {site}", retry_on=IOError)
     except ValueError:
         data = pd.DataFrame(columns=COL_TYPES.keys())
-        data.loc[0,:] = [nd_start,-1,site,f"usgs_{dtype}"]
+        if no_data_row:
+            data.loc[0,:] = [nd_start,NO_DATA_FLOW,site,f"usgs_{dtype}"]
         if data_dir is None:
             return(data)
         else:
-            data.to_csv(Path(data_dir,f"{site}_{dtype}.csv"),index=False)
-            return
+            csv_path = Path(data_dir,f"{site}_{dtype}.csv")
+            data.to_csv(csv_path,index=False)
+            return csv_path
 
     if data.empty:
         data = pd.DataFrame(columns=COL_TYPES.keys())
-        data.loc[0,:] = [nd_start,-1,site,f"usgs_{dtype}"]
+        if no_data_row:
+            data.loc[0,:] = [nd_start,NO_DATA_FLOW,site,f"usgs_{dtype}"]
         if data_dir is None:
             return(data)
         else:
-            data.to_csv(Path(data_dir,f"{site}_{dtype}.csv"),index=False)
-            return
+            csv_path = Path(data_dir,f"{site}_{dtype}.csv")
+            data.to_csv(csv_path,index=False)
+            return csv_path
 
     # Prepare output with standard index
     if dtype=="iv":
@@ -125,16 +153,21 @@ def import_nwis(site,start=None,end=None,dtype="dv",data_dir=None):
     else:
         out["site"] = site
         out["type"] = f"usgs_{dtype}"
-        out.to_csv(Path(data_dir,f"{site}_{dtype}.csv"), index_label="date")
+        csv_path = Path(data_dir,f"{site}_{dtype}.csv")
+        out.to_csv(csv_path, index_label="date")
+        return csv_path
 
-def get_dfs(data_dir=DEFAULT_CSV_DIR,verbose=False):
+def get_dfs(data_dir=DEFAULT_CSV_DIR,verbose=False,data_files=None):
     """
-    Get and merge dataframes imported using functions
+    Get and merge dataframes imported using functions (all .csv files in data_dir, or only data_files, e.g. the ones
+    written by this run)
     """
     usgs_df_dv_list = []
     usgs_df_iv_list = []
     print('Preparing .csv files for database creation...')
-    for data_file in data_dir.glob('*.csv'):
+    if data_files is None:
+        data_files = data_dir.glob('*.csv')
+    for data_file in data_files:
         if verbose:
             print(f'Adding {data_file.name} to dataframe...')
         df = pd.read_csv(
@@ -151,84 +184,56 @@ def get_dfs(data_dir=DEFAULT_CSV_DIR,verbose=False):
                 df[df['type'] == 'usgs_dv'].drop(columns='type').copy()
             )
 
-    df_usgs_dv = pd.concat(usgs_df_dv_list)
+    # No rows in any file (e.g. incremental windows without new data): empty frames
+    empty_df = pd.DataFrame(columns=list(COL_TYPES)).astype(COL_TYPES).drop(columns='type')
+    df_usgs_dv = pd.concat(usgs_df_dv_list) if usgs_df_dv_list else empty_df.copy()
     df_usgs_dv.name = 'usgs_dv'
-    df_usgs_iv = pd.concat(usgs_df_iv_list)
+    df_usgs_iv = pd.concat(usgs_df_iv_list) if usgs_df_iv_list else empty_df.copy()
     df_usgs_iv.name = 'usgs_iv'
     print('  Success!!!\n')
     return {'usgs_dv':df_usgs_dv,
             'usgs_iv':df_usgs_iv}
 
-def get_unique_dates(tbl_name, db_path, date_field=DEFAULT_DATE_FIELD):
+def get_start_dates(dtype, db_path=DEFAULT_DB_DIR, lookback=USGS_LOOKBACK):
     """
-    Get unique dates from usgs data, to ensure no duplicates
+    Start dates (str) for incremental updates of the sites in usgs_{dtype}.db: the last stored date with a flow, less
+    lookback days. The rows of a gage without data are written at the time of the request (import_nwis), so they
+    don't count (nor do missing or ice values at the end of a record, which are requested again).
     """
-    if not db_path.is_file():
-        return pd.DataFrame(columns=[DEFAULT_DATE_FIELD])
-    db_con_str = f'sqlite:///{db_path.as_posix()}'
-    eng = sql.create_engine(db_con_str)
-    with eng.connect() as con:
-        try:
-            unique_dates = pd.read_sql(
-                f'select distinct {date_field} from {tbl_name}',
-                con
-            ).dropna()
-        except Exception:
-            return pd.DataFrame(columns=[DEFAULT_DATE_FIELD])
-    return pd.to_datetime(unique_dates[date_field])
-
-
-def write_db(df, db_path=DEFAULT_DB_DIR, if_exists='replace', check_dups=False,
+    last_dates = get_last_dates(
+        Path(db_path, f"usgs_{dtype}.db"), "site_", DEFAULT_DATE_FIELD, f'"flow" <> {NO_DATA_FLOW}'
+    )
+    return {
+        site: (last_date - dt.timedelta(days=lookback)).strftime("%Y-%m-%d")
+        for site, last_date in last_dates.items()
+    }
+
+def write_db(df, db_path=DEFAULT_DB_DIR, if_exists='replace',
              zip_db=ZIP_IT, zip_frmt=ZIP_FRMT, verbose=True):
     """
     Write dataframe to database
     """
     sensor = df.name
     print(f'Creating sqlite db for {df.name}...\n')
-    print('  Getting unique site names...')
-    site_list = pd.unique(df['site'])
     db_name = f"{sensor}.db"
     db_path = Path(db_path, db_name)
     zip_name = f"{sensor}_db.zip"
     zip_path = Path(db_path, zip_name)
     print(f"  Writing {db_path}...")
-    df_site = None
-    con = None
-    for site in site_list:
-        if verbose:
-            print(f'    Getting data for {site}...')
-        df_site = df[df['site'] == site]
-        if df_site.empty:
+    with open_build(db_path) as con:
+        for site, df_site in df.groupby('site', sort=False):
             if verbose:
-                print(f'      No data for {site}...')
-            continue
-
-        site_id = site
-        if if_exists == 'append' and check_dups:
-            if verbose:
-                print(f'      Checking for duplicate data in {site}...')
-            unique_dates = get_unique_dates(site_id, db_path)
-            initial_len = len(df_site.index)
-            df_site = df_site[~df_site[DEFAULT_DATE_FIELD].isin(unique_dates)]
+                print(f'    Getting data for {site}...')
+            site_id = site
             if verbose:
-                print(f'        Prevented {initial_len - len(df_site.index)} duplicates')
-        if verbose:
-            print(f'      Writing site_{site_id} to {db_name}...')
-        try:
-            con = sqlite3.connect(db_path)
-            df_site.to_sql(
-                f"site_{site}",
-                con,
-                if_exists=if_exists,
-                chunksize=10000,
-                method='multi'
-            )
-        except sqlite3.Error as e:
-            print(f'      Error - did not write {site_id} table to {db_name} - {e}')
-        finally:
-            if con:
-                con.close()
-                con = None
+                print(f'      Writing site_{site_id} to {db_name}...')
+            try:
+                with savepoint(con):
+                    rows = write_keyed(con, f"site_{site}", df_site, KEY_COLS, if_exists)
+                if verbose:
+                    print(f'        Wrote {rows} rows')
+            except (sqlite3.Error, ValueError) as e:
+                print(f'      Error - did not write {site_id} table to {db_name} - {e}')
     if zip_db:
         if verbose:
             print('  When a problem comes along you must zip it! - ({zip_name})')
@@ -263,21 +268,25 @@ def parse_args():
     )
     parser.add_argument(
         "-e", "--exists",
-        help="behavior if database table exists already",
-        choices=['replace', 'append', 'fail'],
+        help="behavior if database table exists already (append skips rows already in it, upsert updates them)",
+        choices=['replace', 'append', 'upsert', 'fail'],
         default='replace'
     )
     parser.add_argument(
-        "-c", "--check_dups",
-        help="only write non-duplicate dates (can slow process ALOT!)",
-        action='store_true',
-        default='true'
+        "-n", "--incremental",
+        help=f"only download data since the last date in the db ({USGS_LOOKBACK} days overlap) and upsert it",
+        action='store_true'
     )
     parser.add_argument(
         "-z", "--zip",
         help='zip database files after creation',
         action="store_true"
     )
+    parser.add_argument(
+        "-c", "--check_dups",
+        help="no longer used: the tables are keyed, so rows are never written twice",
+        action="store_true"
+    )
     parser.add_argument(
         "--verbose",
         help="print/log verbose",
@@ -293,59 +302,71 @@ if __name__ == '__main__':
 
     import argparse
 
+    # Arguments for db build
+    args = parse_args()
+    print(args)
+
     # Identify SNOTEL sites:
     usgs_sites = pd.read_csv(os.path.join(this_dir, "usgs_gages.csv"),index_col=0)
 
+    # Incremental: sites already in the db are only requested from their last date (less the lookback)
+    start_dates = {"dv": dict(), "iv": dict()}
+    if args.incremental:
+        start_dates = {dtype: get_start_dates(dtype, Path(args.output)) for dtype in start_dates.keys()}
+        args.exists = 'upsert'
+        print(f'Updating {len(start_dates["dv"])} gages incrementally...')
+
+    nwis_sites = list()
     for site_no in usgs_sites.index:
         site = str(site_no)
         if len(site)<8:
             site = f"0{site}"
-        print(f"Downloading data for {site}")
-
-        # if "end" in str(usgs_sites.columns):
-        #     if usgs_sites.loc[site_no,"end"]==None:
-        #         start = None
-        #         usgs_sites.loc[site_no, "end"] = dt.datetime.now().strftime("%Y-%m-%d")
-        #     else:
-        #         start = usgs_sites.loc[site_no,"end"]
-        # else:
-        #     start = None
-        #     usgs_sites.loc[:,"end"] = None
-        #     usgs_sites.loc[site_no, "end"] = dt.datetime.now().strftime("%Y-%m-%d")
-        #
-        # end = dt.datetime.now().strftime("%Y-%m-%d")
-
         for dtype in ["dv", "iv"]:
-            #if (start!=end):
-            import_nwis(site,None,None,dtype,DEFAULT_CSV_DIR)
-
-    #usgs_sites.to_csv(os.path.join(this_dir, "usgs_gages.csv"),index_label="site_no")
-
-    #TODO: fix duplicate issues
-
-    # Arguments for db build
-    args = parse_args()
-    print(args)
+            nwis_sites.append((site, dtype))
+
+    print(f"Downloading data for {len(nwis_sites)} gages")
+    csv_paths = fetch_all(
+        lambda nwis_site: import_nwis(
+            nwis_site[0],start_dates[nwis_site[1]].get(nwis_site[0]),None,nwis_site[1],DEFAULT_CSV_DIR,
+            no_data_row=not args.incremental
+        ),
+        nwis_sites
+    )
 
     if args.version:
         print('usgs_to_db.py v1.0')
 
+    if args.check_dups:
+        print('Warning: -c/--check_dups is no longer used (the tables are keyed), ignoring it')
+
     for arg_path in [args.input, args.output]:
         if not Path(arg_path).is_dir():
             print('Invalid arg filepath ({args_path}), please try again.')
             sys.exit(1)
 
-    df_dict = get_dfs(Path(args.input), verbose=args.verbose)
+    # Incremental: only the files downloaded by this run are upserted (a gage that failed keeps the older csv of
+    # an earlier run, which would overwrite newer rows in the db)
+    data_files = None
+    if args.incremental:
+        data_files = list(csv_paths.values())
+        if not data_files:
+            print('No USGS data downloaded, nothing to update')
+            sys.exit(1)
+
+    df_dict = get_dfs(Path(args.input), verbose=args.verbose, data_files=data_files)
     df_usgs_dv = df_dict['usgs_dv']
     df_usgs_iv = df_dict['usgs_iv']
 
     for df in [df_usgs_dv,df_usgs_iv]:
+        if df.empty:
+            print(f'No {df.name} data to write, nothing to update')
+            continue
         df["date"] = pd.to_datetime(df["date"],utc=True)
 
         write_db(
             df,
+            db_path=Path(args.output),
             if_exists=args.exists,
-            check_dups=args.check_dups,
             zip_db=args.zip,
             verbose=args.verbose
         )
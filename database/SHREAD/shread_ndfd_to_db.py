@@ -10,171 +10,215 @@ Compiles NDFD data into SQLite DB
 import sys
 from pathlib import Path
 import pandas as pd
-import sqlalchemy as sql
 import sqlite3
 import zipfile
 from zipfile import ZipFile
+from contextlib import ExitStack
 
 # Load directories and defaults
 this_dir = Path(__file__).absolute().resolve().parent
+sys.path.append(str(this_dir.parent))
+from db_utils import open_build, savepoint, split_points, write_points, write_keyed, create_spatial_index
+from db_utils import migrate_db, get_part_mode, batch_parts, commit_build, write_cube
+from db_utils import get_date_stamps, get_changed_dates
+from db_utils import SPATIAL_INDEX_COLS, STREAM_PRAGMAS, INIT_FIELD
 #this_dir = Path('C:/Programs/shread_dash/database/SHREAD')
 ZIP_IT = False
 ZIP_FRMT = zipfile.ZIP_LZMA
 DEFAULT_DATE_FIELD = 'Date_Valid'
 DEFAULT_CSV_DIR = Path(this_dir, 'data')
 DEFAULT_DB_DIR = this_dir
+# Rows read from a file at a time, and rows read into memory (for all dbs) before they are written (see write_dbs)
+CHUNK_ROWS = 100000
+BATCH_ROWS = 250000
 COL_TYPES = {
-    'Date_Valid':str,'Date_Init':str,'Type':str,'Source':str,'OBJECTID':int,
+    'Date_Valid':str,'Date_Init':str,'Type':'category','Source':str,'OBJECTID':int,
     'Join_Count':int,'TARGET_FID':int,'pointid':int,"grid_code":int,
     'elev_ft': int, 'slope_d': int,'aspct': int, 'nlcd': int,
-    'LOCAL_ID': str,"POLY_SOURC":str,"TOTAL_ID":str,"TOTAL_NAME":str,
-    'LOCAL_NAME':str,'min':float,'max':float,'mean':float,'median':float
+    'LOCAL_ID': 'category',"POLY_SOURC":str,"TOTAL_ID":str,"TOTAL_NAME":str,
+    'LOCAL_NAME':'category','min':float,'max':float,'mean':float,'median':float
 }
 
+# Columns of the shread.py output that aren't stored (not read)
+DROP_COLS = ["Source","Join_Count","TARGET_FID","pointid","grid_code","POLY_SOURC","TOTAL_ID","TOTAL_NAME","min","max","median"]
+
+# NDFD types (each written to its own db)
+SENSORS = ['mint', 'maxt', 'rhm', 'pop12', 'qpf', 'snow', 'sky']
+
 # Define functions
-def get_dfs(data_dir=DEFAULT_CSV_DIR, verbose=False):
+def iter_dfs(data_dir=DEFAULT_CSV_DIR, chunk_rows=CHUNK_ROWS, verbose=False):
     """
-    Get and merge dataframes imported using shread.py
+    Read the shread.py output files chunk_rows rows at a time, yielding (sensor, dataframe) for each type in a chunk
+    (split with one groupby)
     """
-    mint_df_list = []
-    maxt_df_list = []
-    rhm_df_list = []
-    pop12_df_list = []
-    qpf_df_list = []
-    snow_df_list = []
-    sky_df_list = []
-
-    print('Preparing .csv files for database creation...')
     for data_file in data_dir.glob('ndfd*.csv'):
         if verbose:
-            print(f'Adding {data_file.name} to dataframe...')
-        df = pd.read_csv(
-            data_file, 
-            usecols=COL_TYPES.keys(),
+            print(f'Reading {data_file.name}...')
+        with pd.read_csv(
+            data_file,
+            usecols=[c for c in COL_TYPES.keys() if c not in DROP_COLS],
             parse_dates=[DEFAULT_DATE_FIELD],
-            dtype=COL_TYPES
-        )
-        if not df.empty:
+            dtype=COL_TYPES,
+            chunksize=chunk_rows
+        ) as reader:
+            for df in reader:
+                df = df.rename(columns={"Date_Valid":"Date"})
+                for sensor, df_type in df.groupby('Type', sort=False, observed=True):
+                    if sensor in SENSORS:
+                        yield sensor, df_type.drop(columns='Type')
 
-            df = df.drop(axis=1,columns=["Source","Join_Count","TARGET_FID","pointid","grid_code","POLY_SOURC","TOTAL_ID","TOTAL_NAME","min","max","median"])
-            df = df.rename(columns={"Date_Valid":"Date"})
+def get_dfs(data_dir=DEFAULT_CSV_DIR, verbose=False):
+    """
+    Get and merge dataframes imported using shread.py (write_dbs writes the files without merging them)
+    """
+    df_lists = {sensor: [] for sensor in SENSORS}
+    print('Preparing .csv files for database creation...')
+    for sensor, df in iter_dfs(data_dir, verbose=verbose):
+        df_lists[sensor].append(df)
 
-            mint_df_list.append(
-                df[df['Type'] == 'mint'].drop(columns='Type').copy()
-            )
-            maxt_df_list.append(
-                df[df['Type'] == 'maxt'].drop(columns='Type').copy()
-            )
-            rhm_df_list.append(
-                df[df['Type'] == 'rhm'].drop(columns='Type').copy()
-            )
-            pop12_df_list.append(
-                df[df['Type'] == 'pop12'].drop(columns='Type').copy()
-            )
-            qpf_df_list.append(
-                df[df['Type'] == 'qpf'].drop(columns='Type').copy()
-            )
-            snow_df_list.append(
-                df[df['Type'] == 'snow'].drop(columns='Type').copy()
-            )
-            sky_df_list.append(
-                df[df['Type'] == 'sky'].drop(columns='Type').copy()
-            )
+    df_dict = dict()
+    for sensor, df_list in df_lists.items():
+        df_dict[sensor] = pd.concat(df_list)
+        df_dict[sensor].name = sensor
+    print('  Success!!!\n')
+    return df_dict
 
-    df_mint = pd.concat(mint_df_list)
-    df_mint.name = 'mint'
-    df_maxt = pd.concat(maxt_df_list)
-    df_maxt.name = 'maxt'
-    df_rhm = pd.concat(rhm_df_list)
-    df_rhm.name = 'rhm'
-    df_pop12 = pd.concat(pop12_df_list)
-    df_pop12.name = 'pop12'
-    df_qpf = pd.concat(qpf_df_list)
-    df_qpf.name = 'qpf'
-    df_snow = pd.concat(snow_df_list)
-    df_snow.name = 'snow'
-    df_sky = pd.concat(sky_df_list)
-    df_sky.name = 'sky'
+def write_basins(con, df, db_name, if_exists='replace', written=None, basin_dates=None, verbose=False):
+    """
+    Write each basin in df to an open_build connection. For a db written in parts, written is the set of basin tables
+    already written by the build (see db_utils.get_part_mode); when replacing, their (date, point) indexes are left
+    for index_basins to create once all parts are written. Of the forecasts for a (date, point), the one with the
+    latest init date (INIT_FIELD) is kept. The dates each basin had rows written for are added to basin_dates (see
+    cube_basins).
+    """
+    index = (written is None) or (if_exists != 'replace')
+    if written is None:
+        written = set()
+    for basin, df_basin in df.groupby('LOCAL_NAME', sort=False, observed=True):
+        if verbose:
+            print(f'    Getting data for {basin}...')
+        basin_id = df_basin['LOCAL_ID'].iloc[0]
+        if verbose:
+            print(f'      Writing {basin} to {db_name}...')
+        basin_mode = get_part_mode(if_exists, basin_id, written)
+        # Under 'append' (or 'fail') rows already in the table aren't written: the dates written are the ones whose
+        # rows changed
+        check_dates = (basin_dates is not None) and (basin_mode in ['append', 'fail'])
+        try:
+            with savepoint(con):
+                df_points, df_basin = split_points(df_basin)
+                dates = pd.DatetimeIndex(df_basin['Date'].unique())
+                if check_dates:
+                    stamps = get_date_stamps(con, basin_id, dates, order_col=INIT_FIELD)
+                write_points(con, basin_id, df_points, basin_mode)
+                rows = write_keyed(
+                    con, basin_id, df_basin, ['Date'] + SPATIAL_INDEX_COLS, basin_mode, index, INIT_FIELD
+                )
+                if check_dates:
+                    new_stamps = get_date_stamps(con, basin_id, dates, order_col=INIT_FIELD)
+                    dates = get_changed_dates(dates, stamps, new_stamps)
+                if index:
+                    create_spatial_index(con, basin_id, 'Date', INIT_FIELD)
+            written.add(basin_id)
+            if basin_dates is not None:
+                basin_dates.setdefault(basin_id, set()).update(dates)
+            if verbose:
+                print(f'        Wrote {rows} rows')
+        except (sqlite3.Error, ValueError) as e:
+            print(f'      Error - did not write {basin_id} table to {db_name} - {e}')
 
-    print('  Success!!!\n')
-    return {'mint':df_mint,'maxt':df_maxt,'rhm':df_rhm,'pop12':df_pop12,'qpf':df_qpf,'snow':df_snow,'sky':df_sky}
+def index_basins(con, written, db_name, verbose=False):
+    """
+    Create the (date, point) index of each basin table in written (see write_basins)
+    """
+    for basin_id in written:
+        if verbose:
+            print(f'    Indexing {basin_id} in {db_name}...')
+        try:
+            with savepoint(con):
+                create_spatial_index(con, basin_id, 'Date', INIT_FIELD)
+        except sqlite3.Error as e:
+            print(f'      Error - did not index {basin_id} table in {db_name} - {e}')
 
-def get_unique_dates(tbl_name, db_path, date_field=DEFAULT_DATE_FIELD):
+def cube_basins(con, basin_dates, db_name, if_exists='replace', verbose=False):
     """
-    Get unique dates from shread data, to ensure no duplicates
+    Update the statistics cube (see db_utils.write_cube) of each basin table in basin_dates ({basin id: dates
+    written}) for the dates written, or for all dates when replacing
     """
-    if not db_path.is_file():
-        return pd.DataFrame(columns=[DEFAULT_DATE_FIELD])
-    db_con_str = f'sqlite:///{db_path.as_posix()}'
-    eng = sql.create_engine(db_con_str)
-    with eng.connect() as con:
+    for basin_id, dates in basin_dates.items():
+        if verbose:
+            print(f'    Updating the cube of {basin_id} in {db_name}...')
         try:
-            unique_dates = pd.read_sql(
-                f'select distinct {date_field} from {tbl_name}',
-                con
-            ).dropna()
-        except Exception:
-            return pd.DataFrame(columns=[DEFAULT_DATE_FIELD])
-    return pd.to_datetime(unique_dates[date_field])
-
-def write_db(df, db_path=DEFAULT_DB_DIR, if_exists='replace', check_dups=False,
+            with savepoint(con):
+                rows = write_cube(con, basin_id, None if if_exists == 'replace' else dates)
+            if verbose:
+                print(f'      Wrote {rows} cube rows')
+        except (sqlite3.Error, ValueError) as e:
+            print(f'      Error - did not write the cube of {basin_id} table to {db_name} - {e}')
+
+def write_db(df, db_path=DEFAULT_DB_DIR, if_exists='replace',
               zip_db=ZIP_IT, zip_frmt=ZIP_FRMT, verbose=False):
     """
     Write dataframe to database
     """
     sensor = df.name
     print(f'Creating sqlite db for {df.name}...\n')
-    print('  Getting unique basin names...')
-    basin_list = pd.unique(df['LOCAL_NAME'])
     db_name = f"{sensor}.db"
     db_path = Path(db_path, db_name)
     zip_name = f"{sensor}_db.zip"
     zip_path = Path(db_path, zip_name)
     print(f"  Writing {db_path}...")
-    df_basin = None
-    con = None
-    for basin in basin_list:
-        if verbose:
-            print(f'    Getting data for {basin}...')
-        df_basin = df[df['LOCAL_NAME'] == basin]
-        if df_basin.empty:
-            if verbose:
-                print(f'      No data for {basin}...')
-            continue
-        
-        basin_id = df_basin['LOCAL_ID'].iloc[0]
-        if if_exists == 'append' and check_dups:
-            if verbose:
-                print(f'      Checking for duplicate data in {basin}...')
-            drop_dates = get_unique_dates(basin_id, db_path)
-            initial_len = len(df_basin.index)
-            df_basin = df_basin[~df_basin[DEFAULT_DATE_FIELD].isin(drop_dates)]
-            if verbose:
-                print(f'        Prevented {initial_len - len(df_basin.index)} duplicates')
-        if verbose:
-            print(f'      Writing {basin} to {db_name}...')
-        try:
-            con = sqlite3.connect(db_path)
-            df_basin.to_sql(
-                basin_id, 
-                con, 
-                if_exists=if_exists,
-                chunksize=10000,
-                method='multi'
-            )
-        except sqlite3.Error as e:
-            print(f'      Error - did not write {basin_id} table to {db_name} - {e}')
-        finally:
-            if con:
-                con.close()
-                con = None
+    with open_build(db_path) as con:
+        basin_dates = dict()
+        write_basins(con, df, db_name, if_exists, basin_dates=basin_dates, verbose=verbose)
+        cube_basins(con, basin_dates, db_name, if_exists, verbose)
     if zip_db:
         if verbose:
             print('  When a problem comes along you must zip it! - ({zip_name})')
         with ZipFile(zip_path.as_posix(), 'w', compression=zip_frmt) as z:
             z.write(db_path.as_posix())
     print('Success!!\n')
-    
+
+def write_dbs(data_dir=DEFAULT_CSV_DIR, db_path=DEFAULT_DB_DIR, if_exists='replace',
+              zip_db=ZIP_IT, zip_frmt=ZIP_FRMT, chunk_rows=CHUNK_ROWS, batch_rows=BATCH_ROWS, verbose=False):
+    """
+    Write the shread.py output files to the NDFD dbs in bounded memory: the files are read chunk_rows rows at a
+    time (iter_dfs), and whenever batch_rows rows are waiting they are written to their basin tables and committed
+    (commit_build). Each db is one build (open_build, with STREAM_PRAGMAS), started when its first data is written;
+    the builds share one STREAM_PRAGMAS page cache. Once all files are written, the cubes of the basins written are
+    updated (cube_basins).
+    """
+    print('Creating sqlite dbs from .csv files...\n')
+    db_paths = dict()
+    written = dict()
+    basin_dates = dict()
+    pragmas = dict(STREAM_PRAGMAS, cache_size=STREAM_PRAGMAS['cache_size'] // len(SENSORS))
+    with ExitStack() as stack:
+        cons = dict()
+        for sensor, df in batch_parts(iter_dfs(data_dir, chunk_rows, verbose), batch_rows):
+            if sensor not in cons:
+                db_paths[sensor] = Path(db_path, f"{sensor}.db")
+                print(f"  Writing {db_paths[sensor]}...")
+                cons[sensor] = stack.enter_context(open_build(db_paths[sensor], pragmas))
+                written[sensor] = set()
+                basin_dates[sensor] = dict()
+            write_basins(
+                cons[sensor], df, db_paths[sensor].name, if_exists, written[sensor], basin_dates[sensor], verbose
+            )
+            commit_build(cons[sensor])
+        for sensor, con in cons.items():
+            index_basins(con, written[sensor], db_paths[sensor].name, verbose)
+            cube_basins(con, basin_dates[sensor], db_paths[sensor].name, if_exists, verbose)
+            commit_build(con)
+    if zip_db:
+        for sensor, sensor_path in db_paths.items():
+            zip_path = Path(db_path, f"{sensor}_db.zip")
+            if verbose:
+                print(f'  When a problem comes along you must zip it! - ({zip_path.name})')
+            with ZipFile(zip_path.as_posix(), 'w', compression=zip_frmt) as z:
+                z.write(sensor_path.as_posix())
+    print('Success!!\n')
+
 def parse_args():
     """
     Arg parsing for command line use
@@ -198,19 +242,25 @@ def parse_args():
     )
     parser.add_argument(
         "-e", "--exists", 
-        help="behavior if database table exists already",
-        choices=['replace', 'append', 'fail'], default='replace'
-    )
-    parser.add_argument(
-        "-c", "--check_dups", 
-        help="only write non-duplicate dates (can slow process ALOT!)",
-        default=False
+        help="behavior if database table exists already (append skips rows already in it, upsert updates them; "
+             "either way a forecast with a later init date replaces an earlier one)",
+        choices=['replace', 'append', 'upsert', 'fail'], default='replace'
     )
     parser.add_argument(
         "-z", "--zip", 
         help='zip database files after creation',
         default=False
     )
+    parser.add_argument(
+        "-m", "--migrate",
+        help="move existing db files to the current layout (points tables, indexes, cubes) and exit",
+        action="store_true"
+    )
+    parser.add_argument(
+        "-c", "--check_dups",
+        help="no longer used: the tables are keyed, so rows are never written twice",
+        action="store_true"
+    )
     parser.add_argument("--verbose", help="print/log verbose", action="store_true")
     return parser.parse_args()
 
@@ -225,28 +275,24 @@ if __name__ == '__main__':
 
     if args.version:
         print('shread_ndfd_to_db.py v1.0')
+
+    if args.check_dups:
+        print('Warning: -c/--check_dups is no longer used (the tables are keyed), ignoring it')
     
+    if args.migrate:
+        for sensor in SENSORS:
+            migrate_db(Path(args.output, f'{sensor}.db'), verbose=args.verbose)
+        sys.exit(0)
+
     for arg_path in [args.input, args.output]:
         if not Path(arg_path).is_dir():
             print('Invalid arg filepath ({args_path}), please try again.')
             sys.exit(1)
         
-    df_dict = get_dfs(Path(args.input), verbose=args.verbose)
-
-    df_mint = df_dict['mint']
-    df_maxt = df_dict['maxt']
-    df_rhm = df_dict['rhm']
-    df_pop12 = df_dict['pop12']
-    df_qpf = df_dict['qpf']
-    df_snow = df_dict['snow']
-    df_sky = df_dict['sky']
-    
-    for df in [df_mint,df_maxt,df_rhm,df_pop12,df_qpf,df_snow,df_sky]:
-        write_db(
-            df, 
-            if_exists=args.exists, 
-            check_dups=args.check_dups,
-            zip_db=args.zip, 
-            verbose=args.verbose
-        )
-    
\ No newline at end of file
+    write_dbs(
+        Path(args.input),
+        Path(args.output),
+        if_exists=args.exists,
+        zip_db=args.zip,
+        verbose=args.verbose
+    )
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:41:09 2026
+
+Compiles the SHREAD dbs (SNODAS swe and sd, NDFD) into Parquet files for plot_lib.utils.screen_spatial
+
+Each basin table (with its points table joined in) is written as a Parquet dataset, parquet/{sensor}/{basin}/,
+partitioned by month (month=YYYY-MM/part-0.parquet) and sorted by date and point, with column statistics. Reads for a
+date range then only open the months in the range, and skip row groups outside it or the elevation, slope and aspect
+filters. The dashboard reads these files instead of the dbs when SHREAD_SPATIAL_BACKEND=parquet and they are newer
+than the db (run this after the SHREAD db builds).
+
+Requires pyarrow.
+
+@author: buriona,tclarkin
+"""
+
+import sys
+import shutil
+import sqlite3
+import argparse
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Load directories and defaults
+this_dir = Path(__file__).absolute().resolve().parent
+#this_dir = Path('C:/Programs/shread_dash/database/SHREAD')
+sys.path.append(str(this_dir.parent))
+from db_utils import get_tables, get_points_name, POINT_COLS
+
+DEFAULT_DB_DIR = this_dir
+DEFAULT_PARQUET_DIR = Path(this_dir, 'parquet')
+DEFAULT_DATE_FIELD = 'Date'
+PARTITION_COL = 'month'
+# Rows per row group (the unit the column statistics are kept for)
+ROW_GROUP_ROWS = 32768
+COMPRESSION = 'zstd'
+
+# SHREAD dbs written to Parquet (SNODAS and NDFD)
+SENSORS = ['swe', 'sd', 'mint', 'maxt', 'rhm', 'pop12', 'qpf', 'snow', 'sky']
+
+def get_basin_dir(parquet_dir, sensor, basin):
+    """
+    Directory of the Parquet dataset of a basin table
+    """
+    return Path(parquet_dir, sensor, basin)
+
+def get_basin_tables(con, date_field=DEFAULT_DATE_FIELD):
+    """
+    List the basin tables (with a points table and a date field) in an open SHREAD db
+    """
+    tbl_names = get_tables(con)
+    basins = list()
+    for tbl_name in tbl_names:
+        if get_points_name(tbl_name) not in tbl_names:
+            continue
+        cols = [r[1] for r in con.execute(f'pragma table_info("{tbl_name}")')]
+        if date_field in cols:
+            basins.append(tbl_name)
+    return basins
+
+def get_months(con, basin, date_field=DEFAULT_DATE_FIELD):
+    """
+    Months (YYYY-MM) with data in a basin table
+    """
+    qry = f'select distinct substr("{date_field}", 1, 7) from "{basin}" order by 1'
+    return [r[0] for r in con.execute(qry) if r[0]]
+
+def get_next_month(month):
+    """
+    Month (YYYY-MM) after month
+    """
+    return (pd.Period(month, freq='M') + 1).strftime('%Y-%m')
+
+def read_month(con, basin, month, date_field=DEFAULT_DATE_FIELD):
+    """
+    Rows of a basin table in a month, with the point attributes of its points table (the columns screen_spatial
+    returns), sorted by date and point
+    """
+    points = get_points_name(basin)
+    point_str = ', '.join(f'p."{c}"' for c in POINT_COLS[1:])
+    qry = (
+        f'select f.*, {point_str} from "{basin}" f join "{points}" p on p.OBJECTID = f.OBJECTID '
+        f'where f."{date_field}" >= ? and f."{date_field}" < ? order by f."{date_field}", f.OBJECTID'
+    )
+    df = pd.read_sql(qry, con, params=(month, get_next_month(month)))
+    df[date_field] = pd.to_datetime(df[date_field])
+    return df
+
+def write_basin(con, basin, basin_dir, date_field=DEFAULT_DATE_FIELD):
+    """
+    Write a basin table to a Parquet dataset in basin_dir, a month at a time. The dataset is written next to
+    basin_dir and swapped in when done, so a reader never sees a half-written basin. Returns the number of rows
+    written.
+    """
+    build_dir = Path(f'{basin_dir}.build')
+    old_dir = Path(f'{basin_dir}.old')
+    for tmp_dir in [build_dir, old_dir]:
+        if tmp_dir.is_dir():
+            shutil.rmtree(tmp_dir)
+    rows = 0
+    try:
+        for month in get_months(con, basin, date_field):
+            df = read_month(con, basin, month, date_field)
+            part_dir = Path(build_dir, f'{PARTITION_COL}={month}')
+            part_dir.mkdir(parents=True)
+            pq.write_table(
+                pa.Table.from_pandas(df, preserve_index=False),
+                Path(part_dir, 'part-0.parquet'),
+                row_group_size=ROW_GROUP_ROWS,
+                compression=COMPRESSION,
+                write_statistics=True
+            )
+            rows += len(df)
+        if basin_dir.is_dir():
+            basin_dir.rename(old_dir)
+        build_dir.rename(basin_dir)
+    finally:
+        for tmp_dir in [build_dir, old_dir]:
+            if tmp_dir.is_dir():
+                shutil.rmtree(tmp_dir)
+    return rows
+
+def write_parquet(db_dir=DEFAULT_DB_DIR, parquet_dir=DEFAULT_PARQUET_DIR, sensors=None, verbose=False):
+    """
+    Write the basin tables of each SHREAD db in db_dir (all SENSORS, or sensors) to Parquet datasets in parquet_dir
+    """
+    if sensors is None:
+        sensors = SENSORS
+    print('Creating Parquet files from SHREAD dbs...\n')
+    for sensor in sensors:
+        db_path = Path(db_dir, f'{sensor}.db')
+        if not db_path.is_file():
+            print(f'  No db found at {db_path}, skipping...')
+            continue
+        print(f'  Writing {db_path.name} to {Path(parquet_dir, sensor)}...')
+        con = sqlite3.connect(f'{db_path.absolute().as_uri()}?mode=ro', uri=True)
+        try:
+            for basin in get_basin_tables(con):
+                if verbose:
+                    print(f'    Writing {basin}...')
+                try:
+                    rows = write_basin(con, basin, get_basin_dir(parquet_dir, sensor, basin))
+                    if verbose:
+                        print(f'      Wrote {rows} rows')
+                except (sqlite3.Error, OSError, pa.ArrowException) as e:
+                    print(f'      Error - did not write {basin} from {db_path.name} - {e}')
+        finally:
+            con.close()
+    print('Success!!\n')
+
+def parse_args():
+    """
+    Arg parsing for command line use
+    """
+    cli_desc = '''Creates Parquet files for screen_spatial from the SHREAD swe, sd and NDFD dbs'''
+
+    parser = argparse.ArgumentParser(description=cli_desc)
+    parser.add_argument(
+        "-V", "--version", help="show program version", action="store_true"
+    )
+    parser.add_argument(
+        "-i", "--input",
+        help=f"override default SHREAD db dir ({DEFAULT_DB_DIR})",
+        default=DEFAULT_DB_DIR
+    )
+    parser.add_argument(
+        "-o", "--output",
+        help=f"override default Parquet output dir ({DEFAULT_PARQUET_DIR})",
+        default=DEFAULT_PARQUET_DIR
+    )
+    parser.add_argument(
+        "-s", "--sensors",
+        help="only (re)write these dbs",
+        nargs="+",
+        choices=SENSORS,
+        default=None
+    )
+    parser.add_argument("--verbose", help="print/log verbose", action="store_true")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    """
+    Actual batch file run script
+    """
+
+    args = parse_args()
+    print(args)
+
+    if args.version:
+        print('shread_to_parquet.py v1.0')
+
+    if not Path(args.input).is_dir():
+        print(f'Invalid arg filepath ({args.input}), please try again.')
+        sys.exit(1)
+
+    write_parquet(Path(args.input), Path(args.output), sensors=args.sensors, verbose=args.verbose)
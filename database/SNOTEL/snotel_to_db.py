@@ -15,30 +15,114 @@ import numpy as np
 from datetime import timezone
 import datetime as dt
 import sqlite3
-import sqlalchemy as sql
 import zipfile
 from zipfile import ZipFile
-from requests import get as r_get
-from requests.exceptions import ReadTimeout
-from urllib3.exceptions import ReadTimeoutError
 from io import StringIO
 
 # Load directories and defaults
 this_dir = Path(__file__).absolute().resolve().parent
 #this_dir = Path('C:/Programs/shread_dash/database/SNOTEL')
+sys.path.append(str(this_dir.parent))
+from fetch_utils import get_text, fetch_all
+from db_utils import open_build, savepoint, get_last_dates, write_keyed
+
 ZIP_IT = False
 ZIP_FRMT = zipfile.ZIP_LZMA
 DEFAULT_DATE_FIELD = 'date'
 DEFAULT_CSV_DIR = Path(this_dir,'data')
 DEFAULT_DB_DIR = this_dir
+SNOTEL_URL = "https://nwcc-apps.sc.egov.usda.gov/awdb/site-plots/POR"
+# NRCS report generator, for downloading a date range of all variables at once (incremental updates)
+SNOTEL_REPORT_URL = "https://wcc.sc.egov.usda.gov/reportGenerator/view_csv/customSingleStationReport/daily"
+# Days before the last stored date downloaded again by incremental updates (picks up revised values)
+SNOTEL_LOOKBACK = 7
 
 # TODO check this!
 COL_TYPES = {
     'date': str,'site':str,'WTEQ':float,'SNWD':float,'PREC':float,'TAVG':float
 }
 
+# Unique key of each site table (rows are upserted on it, see db_utils.write_keyed)
+KEY_COLS = ['date']
+
 # Define functions
-def import_snotel(site_triplet,snotel_sites,vars=["WTEQ", "SNWD", "PREC", "TAVG"],out_dir=DEFAULT_CSV_DIR,verbose=False):
+def reshape_por(f, var):
+    """
+    Reshape an NRCS period of record csv (month-day rows, water year columns) to a daily UTC dataframe of var, from
+    the start of the first water year to today. Oct-Dec rows belong to the previous calendar year; Feb 29 is only
+    kept where there is data.
+    """
+    # Create index of dates for available data for current site
+    df_index = pd.date_range(dt.datetime.strptime(f"{f.index[0]}-{int(f.columns[0])-1}","%m-%d-%Y"),
+                               dt.datetime.today(),
+                               freq="D",
+                               tz='UTC')
+    # Create dataframe of available data (includes Feb 29)
+    snotel_in = pd.DataFrame(index=df_index)
+
+    # Water year columns only (skips the statistics columns)
+    years = list()
+    for year in f.columns:
+        try:
+            int(year)
+        except ValueError:
+            continue
+        years.append(year)
+
+    # One row per month-day and water year, without missing values
+    por = f[years]
+    por_long = pd.DataFrame({
+        "md": np.repeat(por.index.astype(str), len(years)),
+        "year": np.tile([int(year) for year in years], len(por.index)),
+        var: por.to_numpy().ravel(),
+    }).dropna(subset=[var])
+
+    # Dates (Oct-Dec in the previous calendar year)
+    month = por_long["md"].str[:2].astype(int)
+    cal_year = por_long["year"] - (month >= 10).astype(int)
+    por_dates = pd.to_datetime(
+        cal_year.astype(str) + "-" + por_long["md"], format="%Y-%m-%d", utc=True
+    )
+
+    snotel_in[var] = pd.Series(por_long[var].to_numpy(dtype=float), index=por_dates)
+    return snotel_in
+
+def import_snotel_window(site_triplet,start_date,vars=["WTEQ", "SNWD", "PREC", "TAVG"],verbose=False):
+    """
+    Download SNOTEL data from start_date to today from the NRCS report generator (one request for all vars).
+    Returns a dict of var: daily UTC dataframe, as built by import_snotel from the period of record csvs.
+    """
+    start_date = pd.to_datetime(start_date).tz_localize(None).normalize()
+    end_date = pd.to_datetime(dt.datetime.today()).normalize()
+    # The day before is needed for incremental precip
+    s_str = (start_date - dt.timedelta(days=1)).strftime("%Y-%m-%d")
+    e_str = end_date.strftime("%Y-%m-%d")
+    elements = ",".join(f"{var}::value" for var in vars)
+    triplet = site_triplet.replace("_", ":")
+    site_url = f'{SNOTEL_REPORT_URL}/{triplet}%7Cid=%22%22%7Cname/{s_str},{e_str}/{elements}'
+    if verbose == True:
+        print(site_url)
+
+    csv_str = get_text(site_url, timeout=5, verify=True)
+    f = pd.read_csv(StringIO(csv_str), comment="#")
+    # Columns are Date, then the elements in the order requested
+    f.columns = ["date"] + list(vars)
+    f.index = pd.to_datetime(f["date"]).dt.tz_localize("UTC")
+
+    snotel_dict = dict()
+    for var in vars:
+        snotel_in = pd.DataFrame(index=f.index)
+        snotel_in[var] = pd.to_numeric(f[var], errors="coerce")
+        if var == "PREC":
+            if verbose == True:
+                print("Calculating incremental Precip.")
+            snotel_in["PREC"] = snotel_in[var] - snotel_in[var].shift(1)
+            snotel_in.loc[snotel_in["PREC"] < 0, "PREC"] = 0
+        snotel_dict[var] = snotel_in.loc[snotel_in.index >= start_date.tz_localize("UTC")]
+    return snotel_dict
+
+def import_snotel(site_triplet,snotel_sites,vars=["WTEQ", "SNWD", "PREC", "TAVG"],out_dir=DEFAULT_CSV_DIR,
+                  start_date=None,verbose=False):
     """Download NRCS SNOTEL data
 
     Parameters
@@ -46,12 +130,14 @@ def import_snotel(site_triplet,snotel_sites,vars=["WTEQ", "SNWD", "PREC", "TAVG"
         site_triplet: three part SNOTEL triplet (e.g., 713_CO_SNTL)
         vars: array of variables for import (tested with WTEQ, SNWD, PREC, TAVG..other options may be available)
         out_dir: str to directory to save .csv...if None, will return df
+        start_date: datetime...if None, downloads the period of record, otherwise only data from start_date on
+            (see import_snotel_window)
         verbose: boolean
             True : enable print during function run
 
     Returns
     -------
-        dataframe
+        dataframe, or the path of the .csv if saved to out_dir
 
     """
     # Convert name to string, replacing spaces with %20
@@ -61,77 +147,37 @@ def import_snotel(site_triplet,snotel_sites,vars=["WTEQ", "SNWD", "PREC", "TAVG"
     # Create dictionary of variables
     snotel_dict = dict()
     ext = "DAILY"
-
-    # Cycle through variables
-    for var in vars:
-        if verbose == True:
-            print("Importing {} data".format(var))
-        site_url = f"https://nwcc-apps.sc.egov.usda.gov/awdb/site-plots/POR/{var}/{state}/{name}.csv"
-        print(site_url)
-        if verbose == True:
+    if start_date is not None:
+        snotel_dict = import_snotel_window(site_triplet, start_date, vars, verbose)
+    else:
+        # Cycle through variables
+        for var in vars:
+            if verbose == True:
+                print("Importing {} data".format(var))
+            site_url = f"{SNOTEL_URL}/{var}/{state}/{name}.csv"
             print(site_url)
-        failed = True
-        tries = 0
-        csv_str = ""
-        while failed:
-            try:
-                csv_str = r_get(site_url, timeout=5,verify=True).text
-                failed = False
-            except (ConnectionError, TimeoutError,ReadTimeout,ReadTimeoutError) as error:
-                print(f"{error}")
-                tries += 1
-                if tries <= 10:
-                    print(f"After {tries} tries, retrying...")
-                else:
-                    continue
-
+            if verbose == True:
+                print(site_url)
+            # Retries with backoff (see fetch_utils.retry_call), raises FetchError if the download keeps failing
+            csv_str = get_text(site_url, timeout=5, verify=True)
             if "not found on this server" in csv_str:
                 print("Site URL incorrect.")
                 continue
 
-        csv_io = StringIO(csv_str)
-        f = pd.read_csv(csv_io,index_col=0)
-
-        # Create index of dates for available data for current site
-        df_index = pd.date_range(dt.datetime.strptime(f"{f.index[0]}-{int(f.columns[0])-1}","%m-%d-%Y"),
-                                   dt.datetime.today(),
-                                   freq="D",
-                                   tz='UTC')
-        # Create dataframe of available data (includes Feb 29)
-        snotel_in = pd.DataFrame(index=df_index)
-
-        # Concatenate the cleaned data to the date index
-        for year in f.columns:
-            try:
-                int(year)
-            except ValueError:
-                continue
-            # Remove missing columns...
-            year_data = f.loc[:,year].dropna()
-
-            # Fix index (will no longer include Feb 29 when missing)
-            year_index = list()
-            for i in year_data.index:
-                if int(i[:2])>=10:
-                    year_index.append(dt.datetime.strptime(f"{i}-{int(year)-1}","%m-%d-%Y"))
-                else:
-                    year_index.append(dt.datetime.strptime(f"{i}-{int(year)}", "%m-%d-%Y"))
-
-            year_data.index = pd.DatetimeIndex(year_index,tz="utc")
-
-            # Set appropriate rows in snotel_in
-            snotel_in.loc[year_data.index,var] = year_data
+            csv_io = StringIO(csv_str)
+            f = pd.read_csv(csv_io,index_col=0)
+            snotel_in = reshape_por(f, var)
 
 
-        # For precip, calculate incremental precip and remove negative values
-        if var == "PREC":
-            if verbose == True:
-                print("Calculating incremental Precip.")
-            snotel_in["PREC"] = snotel_in[var] - snotel_in[var].shift(1)
-            snotel_in.loc[snotel_in["PREC"] < 0, "PREC"] = 0
+            # For precip, calculate incremental precip and remove negative values
+            if var == "PREC":
+                if verbose == True:
+                    print("Calculating incremental Precip.")
+                snotel_in["PREC"] = snotel_in[var] - snotel_in[var].shift(1)
+                snotel_in.loc[snotel_in["PREC"] < 0, "PREC"] = 0
 
-        # Add to dict
-        snotel_dict[var] = snotel_in
+            # Add to dict
+            snotel_dict[var] = snotel_in
 
     if verbose == True:
         print("Checking dates")
@@ -155,20 +201,29 @@ def import_snotel(site_triplet,snotel_sites,vars=["WTEQ", "SNWD", "PREC", "TAVG"
         if verbose == True:
             print("Added to dataframe")
 
+    # Only days with data are kept from a window (today is often still missing)
+    if start_date is not None:
+        data = data.dropna(how="all", subset=list(snotel_dict.keys()))
+
     if out_dir is None:
         return (data)
     else:
         if os.path.isdir(out_dir) is False:
             os.mkdir(out_dir)
-        data.to_csv(Path(out_dir,f"{site_triplet}.csv"),index_label="date")
+        csv_path = Path(out_dir,f"{site_triplet}.csv")
+        data.to_csv(csv_path,index_label="date")
+        return csv_path
 
-def get_dfs(data_dir=DEFAULT_CSV_DIR,verbose=False):
+def get_dfs(data_dir=DEFAULT_CSV_DIR,verbose=False,data_files=None):
     """
-    Get and merge dataframes imported using functions
+    Get and merge dataframes imported using functions (all .csv files in data_dir, or only data_files, e.g. the ones
+    written by this run)
     """
     snotel_df_list = []
     print('Preparing .csv files for database creation...')
-    for data_file in data_dir.glob('*.csv'):
+    if data_files is None:
+        data_files = data_dir.glob('*.csv')
+    for data_file in data_files:
         if verbose:
             print(f'Adding {data_file.name} to dataframe...')
         df = pd.read_csv(
@@ -182,81 +237,51 @@ def get_dfs(data_dir=DEFAULT_CSV_DIR,verbose=False):
                 df
             )
 
-    df_snotel_dv = pd.concat(snotel_df_list)
+    if snotel_df_list:
+        df_snotel_dv = pd.concat(snotel_df_list)
+    else:
+        # No rows in any file (e.g. incremental windows without new data)
+        df_snotel_dv = pd.DataFrame(columns=list(COL_TYPES)).astype(COL_TYPES)
     df_snotel_dv.name = 'snotel_dv'
     print('  Success!!!\n')
     return {'snotel_dv':df_snotel_dv}
 
-def get_unique_dates(tbl_name, db_path, date_field=DEFAULT_DATE_FIELD):
+def get_start_dates(db_path=DEFAULT_DB_DIR, lookback=SNOTEL_LOOKBACK):
     """
-    Get unique dates from snotel data, to ensure no duplicates
+    Start dates for incremental updates of the sites in snotel_dv.db in db_path: the last stored date, less lookback
+    days
     """
-    if not db_path.is_file():
-        return pd.DataFrame(columns=[DEFAULT_DATE_FIELD])
-    db_con_str = f'sqlite:///{db_path.as_posix()}'
-    eng = sql.create_engine(db_con_str)
-    with eng.connect() as con:
-        try:
-            unique_dates = pd.read_sql(
-                f'select distinct {date_field} from {tbl_name}',
-                con
-            ).dropna()
-        except Exception:
-            return pd.DataFrame(columns=[DEFAULT_DATE_FIELD])
-    return pd.to_datetime(unique_dates[date_field])
-
+    return {
+        site: last_date - dt.timedelta(days=lookback)
+        for site, last_date in get_last_dates(Path(db_path, 'snotel_dv.db'), 'snotel_').items()
+    }
 
-def write_db(df, db_path=DEFAULT_DB_DIR, if_exists='replace', check_dups=False,
+def write_db(df, db_path=DEFAULT_DB_DIR, if_exists='replace',
              zip_db=ZIP_IT, zip_frmt=ZIP_FRMT, verbose=False):
     """
     Write dataframe to database
     """
     sensor = df.name
     print(f'Creating sqlite db for {df.name}...\n')
-    print('  Getting unique site names...')
-    site_list = pd.unique(df['site'])
     db_name = f"{sensor}.db"
     db_path = Path(db_path, db_name)
     zip_name = f"{sensor}_db.zip"
     zip_path = Path(db_path, zip_name)
     print(f"  Writing {db_path}...")
-    df_site = None
-    con = None
-    for site in site_list:
-        if verbose:
-            print(f'    Getting data for {site}...')
-        df_site = df[df['site'] == site]
-        if df_site.empty:
+    with open_build(db_path) as con:
+        for site, df_site in df.groupby('site', sort=False):
             if verbose:
-                print(f'      No data for {site}...')
-            continue
-
-        site_id = site
-        if if_exists == 'append' and check_dups:
+                print(f'    Getting data for {site}...')
+            site_id = site
             if verbose:
-                print(f'      Checking for duplicate data in {site}...')
-            unique_dates = get_unique_dates(site_id, db_path)
-            initial_len = len(df_site.index)
-            df_site = df_site[~df_site[DEFAULT_DATE_FIELD].isin(unique_dates)]
-            if verbose:
-                print(f'        Prevented {initial_len - len(df_site.index)} duplicates')
-        if verbose:
-            print(f'      Writing snotel_{site_id} to {db_name}...')
-        try:
-            con = sqlite3.connect(db_path)
-            df_site.to_sql(
-                f"snotel_{site_id}",
-                con,
-                if_exists=if_exists,
-                chunksize=10000,
-                method='multi'
-            )
-        except sqlite3.Error as e:
-            print(f'      Error - did not write {site_id} table to {db_name} - {e}')
-        finally:
-            if con:
-                con.close()
-                con = None
+                print(f'      Writing snotel_{site_id} to {db_name}...')
+            try:
+                with savepoint(con):
+                    rows = write_keyed(con, f"snotel_{site_id}", df_site, KEY_COLS, if_exists)
+                if verbose:
+                    print(f'        Wrote {rows} rows')
+            except (sqlite3.Error, ValueError) as e:
+                print(f'      Error - did not write {site_id} table to {db_name} - {e}')
     if zip_db:
         if verbose:
             print('  When a problem comes along you must zip it! - ({zip_name})')
@@ -291,21 +316,25 @@ def parse_args():
     )
     parser.add_argument(
         "-e", "--exists",
-        help="behavior if database table exists already",
-        choices=['replace', 'append', 'fail'],
+        help="behavior if database table exists already (append skips rows already in it, upsert updates them)",
+        choices=['replace', 'append', 'upsert', 'fail'],
         default='replace'
     )
     parser.add_argument(
-        "-c", "--check_dups",
-        help="only write non-duplicate dates (can slow process ALOT!)",
-        action='store_true',
-        default='false'
+        "-n", "--incremental",
+        help=f"only download data since the last date in the db ({SNOTEL_LOOKBACK} days overlap) and upsert it",
+        action='store_true'
     )
     parser.add_argument(
         "-z", "--zip",
         help='zip database files after creation',
         action="store_true"
     )
+    parser.add_argument(
+        "-c", "--check_dups",
+        help="no longer used: the tables are keyed, so rows are never written twice",
+        action="store_true"
+    )
     parser.add_argument(
         "--verbose",
         help="print/log verbose",
@@ -321,33 +350,56 @@ if __name__ == '__main__':
 
     import argparse
 
+    # Arguments for db build
+    args = parse_args()
+    print(args)
+
     # Identify SNOTEL sites:
     snotel_sites = pd.read_csv(os.path.join(this_dir, "snotel_sites.csv"))
 
-    for site_triplet in snotel_sites.triplet:
-        print(site_triplet)
-        import_snotel(site_triplet,snotel_sites)
+    # Incremental: sites already in the db are only downloaded from their last date (less the lookback)
+    start_dates = dict()
+    if args.incremental:
+        start_dates = get_start_dates(Path(args.output))
+        args.exists = 'upsert'
+        print(f'Updating {len(start_dates)} sites incrementally...')
 
-    # Arguments for db build
-    args = parse_args()
-    print(args)
+    csv_paths = fetch_all(
+        lambda site_triplet: import_snotel(site_triplet, snotel_sites, start_date=start_dates.get(site_triplet)),
+        snotel_sites.triplet
+    )
 
     if args.version:
         print('snotel_to_db.py v1.0')
 
+    if args.check_dups:
+        print('Warning: -c/--check_dups is no longer used (the tables are keyed), ignoring it')
+
     for arg_path in [args.input, args.output]:
         if not Path(arg_path).is_dir():
             print('Invalid arg filepath ({args_path}), please try again.')
             sys.exit(1)
 
-    df_dict = get_dfs(Path(args.input), verbose=args.verbose)
+    # Incremental: only the files downloaded by this run are upserted (a site that failed keeps the older csv of
+    # an earlier run, which would overwrite newer rows in the db)
+    data_files = None
+    if args.incremental:
+        data_files = list(csv_paths.values())
+        if not data_files:
+            print('No SNOTEL data downloaded, nothing to update')
+            sys.exit(1)
+
+    df_dict = get_dfs(Path(args.input), verbose=args.verbose, data_files=data_files)
     df_snotel_dv = df_dict['snotel_dv']
 
     for df in [df_snotel_dv]:
+        if df.empty:
+            print(f'No {df.name} data to write, nothing to update')
+            continue
         write_db(
             df,
+            db_path=Path(args.output),
             if_exists=args.exists,
-            check_dups=args.check_dups,
             zip_db=args.zip,
             verbose=args.verbose
         )
@@ -14,12 +14,17 @@ The databases are built in SQLite.
 """
 
 import os
+import sys
 import datetime as dt
 from pathlib import Path
+# The retrieval scripts are run directly, so they put this directory on sys.path and import fetch_utils and db_utils
+# by file name. The dashboard does the same here, before importing any of them, so it shares their modules.
+sys.path.append(str(Path(__file__).absolute().resolve().parent))
 import pandas as pd
-from flask_sqlalchemy import SQLAlchemy
 import dash_bootstrap_components as dbc
 import dash
+from database.db_engines import ReadOnlySQLAlchemy, ENGINE_OPTIONS
+from database.consolidated_config import CONSOLIDATED_BIND, CONSOLIDATED_DB
 
 ### Launch SQLite DB Server ###
 # Define directories and app
@@ -41,7 +46,8 @@ def create_app():
         assets_folder=assets_path
     )
     app.title="WCAO Dashboard"
-    db_path = Path(app_dir, 'database')
+    # The dbs are read from database/ unless SHREAD_DB_DIR is set (e.g. to a copy of the dbs)
+    db_path = Path(os.environ.get('SHREAD_DB_DIR', Path(app_dir, 'database')))
     snodas_swe_db_path = Path(db_path, 'SHREAD', 'swe.db')
     snodas_sd_db_path = Path(db_path, 'SHREAD', 'sd.db')
     csas_iv_db_path = Path(db_path, 'CSAS', 'csas_iv.db')
@@ -77,6 +83,7 @@ def create_app():
     ndfd_sky_db_con_str = f'sqlite:///{ndfd_sky_db_path}'
 
     app.server.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.server.config['SQLALCHEMY_ENGINE_OPTIONS'] = ENGINE_OPTIONS
     app.server.config['SQLALCHEMY_BINDS'] = {
         'swe': snodas_swe_db_con_str,
         'sd': snodas_sd_db_con_str,
@@ -95,12 +102,16 @@ def create_app():
         "snow": ndfd_snow_db_con_str,
         "sky": ndfd_sky_db_con_str,
     }
+    # Optional consolidated site db (see database/consolidated_to_db.py)
+    consolidated_db_path = Path(db_path, CONSOLIDATED_DB)
+    if consolidated_db_path.is_file():
+        app.server.config['SQLALCHEMY_BINDS'][CONSOLIDATED_BIND] = f'sqlite:///{consolidated_db_path.as_posix()}'
 
     return app
 
 # Launch server
 app = create_app()
-db = SQLAlchemy(app.server)
+db = ReadOnlySQLAlchemy(app.server)
 db.reflect()
 
 ### Load in other Data ###
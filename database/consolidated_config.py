@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:58:10 2026
+
+Layout of the consolidated site db (built by consolidated_to_db.py, read by the dashboard). Only constants, so the
+dashboard can import it without loading the build script.
+
+@author: buriona,tclarkin
+"""
+
+CONSOLIDATED_BIND = 'consolidated'
+CONSOLIDATED_DB = f'{CONSOLIDATED_BIND}.db'
+SITE_COLUMNS_TABLE = 'site_columns'
+
+# Site dbs in the consolidated db: bind (and table name) -> (db dir, site table prefix, site table key)
+FAMILIES = {
+    'snotel_dv': ('SNOTEL', 'snotel_', ['date']),
+    'usgs_dv': ('FLOW', 'site_', ['date']),
+    'usgs_iv': ('FLOW', 'site_', ['date']),
+    'rfc_dv': ('FLOW', 'site_', ['fcst_dt', 'date']),
+    'rfc_iv': ('FLOW', 'site_', ['fcst_dt', 'date']),
+    'csas_dv': ('CSAS', '', ['date']),
+    'csas_iv': ('CSAS', '', ['date']),
+}
+
+def get_site_id(bind, tbl_name):
+    """
+    Site id of a site table of bind (table name without the prefix of the family)
+    """
+    prefix = FAMILIES[bind][1]
+    return tbl_name[len(prefix):]
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:02:41 2026
+
+Compiles the site dbs (SNOTEL, USGS, RFC and CSAS) into one consolidated SQLite DB
+
+Each site db has a table per site. The consolidated db (consolidated.db) has one long table per db instead, named
+after its dashboard bind (e.g. snotel_dv) and keyed on site_id plus the key of the site tables, so the sites of a
+selection can be read with one query. The columns of each site table are kept in site_columns, so reads return the
+same columns as the site table. plot_lib.utils reads from this db when it exists and is newer than the site db (run
+this after the site db builds).
+
+@author: buriona,tclarkin
+"""
+
+import sys
+import json
+import sqlite3
+import argparse
+from pathlib import Path
+
+# Load directories and defaults
+this_dir = Path(__file__).absolute().resolve().parent
+#this_dir = Path('C:/Programs/shread_dash/database')
+sys.path.append(str(this_dir))
+from db_utils import open_build, savepoint, get_tables, get_columns, create_key_index
+from consolidated_config import CONSOLIDATED_DB, SITE_COLUMNS_TABLE, FAMILIES, get_site_id
+
+DEFAULT_DB_DIR = this_dir
+
+def get_site_tables(con, bind):
+    """
+    List the site tables in an open site db
+    """
+    prefix, key_cols = FAMILIES[bind][1:]
+    return [
+        t for t in get_tables(con)
+        if t.startswith(prefix) and all(c in get_columns(con, t) for c in key_cols)
+    ]
+
+def write_family(con, bind, db_dir, verbose=False):
+    """
+    Replace the table of bind in the consolidated db with the rows of every site table in its site db. Returns the
+    number of rows written, or None if there is no site db.
+    """
+    dir_name, prefix, key_cols = FAMILIES[bind]
+    src_path = Path(db_dir, dir_name, f'{bind}.db')
+    if not src_path.is_file():
+        print(f'  No db found at {src_path}, skipping...')
+        return None
+    src = sqlite3.connect(f'{src_path.absolute().as_uri()}?mode=ro', uri=True)
+    try:
+        site_tables = get_site_tables(src, bind)
+        # Union of the site table columns and their declared types
+        col_types = dict()
+        site_cols = dict()
+        for tbl_name in site_tables:
+            cols = [(r[1], r[2]) for r in src.execute(f'pragma table_info("{tbl_name}")')]
+            site_cols[tbl_name] = [c for c, _ in cols]
+            for col, col_type in cols:
+                col_types.setdefault(col, set()).add(col_type)
+
+        con.execute(f'drop table if exists "{bind}"')
+        # A column declared with different types (e.g. TEXT for a site without data) gets no type, so its values
+        # are stored as they are in the site tables rather than converted by the affinity of the first table
+        col_str = ', '.join(
+            ['"site_id" TEXT'] + [f'"{c}" {min(t)}' if len(t) == 1 else f'"{c}"' for c, t in col_types.items()]
+        )
+        con.execute(f'create table "{bind}" ({col_str})')
+        con.execute(f'delete from {SITE_COLUMNS_TABLE} where family = ?', (bind,))
+        rows = 0
+        for tbl_name in site_tables:
+            site_id = get_site_id(bind, tbl_name)
+            cols = site_cols[tbl_name]
+            col_str = ', '.join(f'"{c}"' for c in cols)
+            val_str = ', '.join('?' for c in cols)
+            cur = con.executemany(
+                f'insert into "{bind}" ("site_id", {col_str}) values (?, {val_str})',
+                ((site_id,) + r for r in src.execute(f'select {col_str} from "{tbl_name}"'))
+            )
+            con.execute(
+                f'insert into {SITE_COLUMNS_TABLE} (family, site_id, columns) values (?, ?, ?)',
+                (bind, site_id, json.dumps(cols))
+            )
+            rows += cur.rowcount
+            if verbose:
+                print(f'    {tbl_name}: {cur.rowcount} rows')
+        create_key_index(con, bind, ['site_id'] + key_cols)
+    finally:
+        src.close()
+    return rows
+
+def write_db(db_dir=DEFAULT_DB_DIR, db_path=DEFAULT_DB_DIR, binds=None, verbose=False):
+    """
+    Build the consolidated db from the site dbs in db_dir (all FAMILIES, or binds)
+    """
+    if binds is None:
+        binds = list(FAMILIES)
+    db_path = Path(db_path, CONSOLIDATED_DB)
+    print('Creating consolidated sqlite db...\n')
+    print(f"  Writing {db_path}...")
+    with open_build(db_path) as con:
+        con.execute(
+            f'create table if not exists {SITE_COLUMNS_TABLE} ('
+            f'family text not null, site_id text not null, columns text, '
+            f'primary key (family, site_id))'
+        )
+        for bind in binds:
+            if verbose:
+                print(f'    Writing {bind}...')
+            try:
+                with savepoint(con):
+                    rows = write_family(con, bind, db_dir, verbose)
+                if verbose and (rows is not None):
+                    print(f'      Wrote {rows} rows')
+            except sqlite3.Error as e:
+                print(f'      Error - did not write {bind} table to {CONSOLIDATED_DB} - {e}')
+    print('Success!!\n')
+
+def parse_args():
+    """
+    Arg parsing for command line use
+    """
+    cli_desc = '''Creates the consolidated sqlite db file from the SNOTEL, USGS, RFC and CSAS dbs'''
+
+    parser = argparse.ArgumentParser(description=cli_desc)
+    parser.add_argument(
+        "-V",
+        "--version",
+        help="show program version",
+        action="store_true"
+    )
+    parser.add_argument(
+        "-i", "--input",
+        help=f"override default site db dir ({DEFAULT_DB_DIR})",
+        default=DEFAULT_DB_DIR
+    )
+    parser.add_argument(
+        "-o", "--output",
+        help=f"override default db output dir ({DEFAULT_DB_DIR})",
+        default=DEFAULT_DB_DIR
+    )
+    parser.add_argument(
+        "-b", "--binds",
+        help="only (re)write these dbs",
+        nargs="+",
+        choices=list(FAMILIES),
+        default=None
+    )
+    parser.add_argument(
+        "--verbose",
+        help="print/log verbose",
+        action="store_true")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    """
+    Actual batch file run script
+    """
+
+    args = parse_args()
+    print(args)
+
+    if args.version:
+        print('consolidated_to_db.py v1.0')
+
+    for arg_path in [args.input, args.output]:
+        if not Path(arg_path).is_dir():
+            print(f'Invalid arg filepath ({arg_path}), please try again.')
+            sys.exit(1)
+
+    write_db(Path(args.input), Path(args.output), binds=args.binds, verbose=args.verbose)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:30:12 2026
+
+Engines for the dashboard database binds (database.create_app)
+
+The dashboard only reads the dbs; the build scripts write a copy and move it over the live db (db_utils.open_build,
+replace_db). So the binds are opened read-only (sqlite URI mode=ro). Connections are pooled per bind, one per server
+thread, with a memory map and a larger page cache set on each new connection, so repeated queries reuse the pages
+and prepared statements of the connection. Pooled connections keep reading the file they opened, so
+plot_lib.utils.get_engine drops a bind's pool when its db changes (get_db_stamp), and the next queries open the
+rebuilt db. Where the move isn't allowed (Windows, while the db is open) the build is copied over the live db in one
+transaction instead, which the pooled connections read as well.
+
+@author: buriona,tclarkin
+"""
+
+import os
+from pathlib import Path
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+from flask_sqlalchemy import SQLAlchemy
+
+# Connections kept open per bind (one per server thread: waitress serves with 4 threads by default), and extra
+# connections allowed while all of those are in use (closed when returned)
+POOL_SIZE = int(os.environ.get("SHREAD_POOL_SIZE", 4))
+POOL_OVERFLOW = int(os.environ.get("SHREAD_POOL_OVERFLOW", 8))
+
+# Pragmas for each new connection: 256 MB memory map and 32 MB page cache
+READ_PRAGMAS = {
+    "mmap_size": 268435456,
+    "cache_size": -32000,
+    "temp_store": "MEMORY",
+}
+
+# SQLALCHEMY_ENGINE_OPTIONS (Flask-SQLAlchemy uses NullPool for sqlite unless a pool size is given). Pooled
+# connections are shared by the server threads.
+ENGINE_OPTIONS = {
+    "poolclass": QueuePool,
+    "pool_size": POOL_SIZE,
+    "max_overflow": POOL_OVERFLOW,
+    "connect_args": {"check_same_thread": False},
+}
+
+def open_read_only(dialect, conn_rec, cargs, cparams):
+    """
+    do_connect event: open the db file as a read-only sqlite URI. A missing db is still opened read-write, so sqlite
+    creates it empty as before.
+    """
+    db_path = Path(cargs[0])
+    if db_path.is_file():
+        cargs[0] = f"{db_path.absolute().as_uri()}?mode=ro"
+        cparams["uri"] = True
+
+def set_read_pragmas(dbapi_con, conn_rec):
+    """
+    connect event: apply READ_PRAGMAS to a new connection
+    """
+    cursor = dbapi_con.cursor()
+    for pragma, value in READ_PRAGMAS.items():
+        cursor.execute(f"pragma {pragma}={value}")
+    cursor.close()
+
+class ReadOnlySQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy with the sqlite binds opened read-only (open_read_only, set_read_pragmas). Use with
+    ENGINE_OPTIONS as SQLALCHEMY_ENGINE_OPTIONS.
+    """
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+        if engine.dialect.name == "sqlite":
+            event.listen(engine, "do_connect", open_read_only)
+            event.listen(engine, "connect", set_read_pragmas)
+        return engine
@@ -0,0 +1,720 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 09:12:44 2026
+
+SQLite utilities shared by the database build scripts (/database/SUBS/*_to_db.py)
+
+The build scripts are run directly (see /batch_scripts/), so they add this directory to sys.path and import this
+module as db_utils.
+
+@author: buriona,tclarkin
+"""
+
+import os
+import time
+import shutil
+import sqlite3
+from pathlib import Path
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+# Forecast init date of the NDFD basin tables: of the forecasts for a (date, point), the latest is kept (see
+# write_keyed)
+INIT_FIELD = 'Date_Init'
+
+# Static attributes of SHREAD grid points, stored once per basin in {basin}_points (see write_points)
+POINT_ID = 'OBJECTID'
+POINT_COLS = [POINT_ID, 'elev_ft', 'slope_d', 'aspct', 'nlcd', 'LOCAL_ID', 'LOCAL_NAME']
+
+# Columns used by plot_lib.utils.screen_spatial range scans on basin tables (after the date field)
+SPATIAL_INDEX_COLS = [POINT_ID]
+
+# Basin statistics cube of a SHREAD basin table (see write_cube): the points are binned into cells by 500 ft elevation
+# bands, 45 degree aspect octants and slope classes (degrees), and the cube keeps per date and cell statistics that add
+# up over cells, plus the percentiles of the points above each elevation band (with aspects in CUBE_ROLLUP_ASPECTS, the
+# dashboard's default aspect filter, which leaves out flat points). Points on a band edge get a cell of their own (see
+# get_cells), as the screen_spatial filters include both of their bounds.
+CUBE_ELEV_BAND = 500
+CUBE_ASPECT_BAND = 45
+CUBE_SLOPE_CLASSES = [0, 10, 20, 30, 45]
+CUBE_CELL_COLS = ['elev_band', 'aspct_oct', 'slope_cls']
+CUBE_PERCENTILES = [0.05, 0.5, 0.95]
+CUBE_ROLLUP_ASPECTS = [0, 360]
+# Dates read from a basin table at a time while computing its cube
+CUBE_DATES = 31
+
+# Pragmas while a build script writes a db (see open_build): no fsyncs and a 256 MB page cache. The build writes to
+# a copy of the db, so a crash can only corrupt the copy. The copy is set back to a rollback journal before it is
+# swapped in, so the live dbs have no -wal or -shm files to go stale when the file is replaced.
+BUILD_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'OFF',
+    'cache_size': -256000,
+    'temp_store': 'MEMORY',
+}
+
+# Pragmas (over BUILD_PRAGMAS) for a build that streams its data in batches and commits each one (see commit_build):
+# a 32 MB page cache, and sorts (e.g. the index builds) spilled to temp files, so memory stays flat as the data grows
+STREAM_PRAGMAS = {
+    'cache_size': -32000,
+    'temp_store': 'FILE',
+}
+
+# Seconds copy_db waits for readers of the old data to checkpoint a copy into a live db in WAL mode (see copy_db)
+CHECKPOINT_TIMEOUT = 5
+
+def get_build_path(db_path):
+    """
+    Path of the copy of a db that open_build writes to
+    """
+    return Path(f'{db_path}.build')
+
+def get_row_counts(db_path):
+    """
+    Number of rows in each table of a db file, as {table: rows}
+    """
+    con = sqlite3.connect(f'{Path(db_path).absolute().as_uri()}?mode=ro', uri=True)
+    try:
+        return {t: con.execute(f'select count(*) from "{t}"').fetchone()[0] for t in get_tables(con)}
+    finally:
+        con.close()
+
+def check_build(build_path, db_path):
+    """
+    Check a db built by open_build before it replaces the live db: it has to pass sqlite's quick_check, have rows,
+    and still have every table of the live db, with rows in each that had them. Raises sqlite3.DatabaseError
+    otherwise, and returns the row counts.
+    """
+    con = sqlite3.connect(f'{Path(build_path).absolute().as_uri()}?mode=ro', uri=True)
+    try:
+        check = con.execute('pragma quick_check').fetchone()[0]
+    finally:
+        con.close()
+    if check != 'ok':
+        raise sqlite3.DatabaseError(f'quick_check failed - {check}')
+    new_rows = get_row_counts(build_path)
+    if not sum(new_rows.values()):
+        raise sqlite3.DatabaseError('no rows written')
+    old_rows = get_row_counts(db_path) if Path(db_path).is_file() else dict()
+    lost = [t for t, rows in old_rows.items() if rows and not new_rows.get(t)]
+    if lost:
+        raise sqlite3.DatabaseError(f'tables missing or empty: {", ".join(lost)}')
+    return new_rows
+
+def has_wal_files(db_path):
+    """
+    True if a db has -wal or -shm files next to it (it is in WAL mode and was opened since)
+    """
+    return any(Path(f'{db_path}{suffix}').exists() for suffix in ['-wal', '-shm'])
+
+def copy_db(src_path, dst_path, timeout=30):
+    """
+    Copy a db over another with sqlite's backup API: a consistent copy of the source, even while it is being read,
+    written in one transaction on the destination, which keeps its journal mode. A destination in WAL mode (a live db
+    of an earlier build) is then set back to a rollback journal, or, while queries still read the old data, the copy
+    is checkpointed from the -wal file into the db, waiting up to CHECKPOINT_TIMEOUT for them; if they take longer
+    the rest is checkpointed by a later connection.
+    """
+    src = sqlite3.connect(f'{Path(src_path).absolute().as_uri()}?mode=ro', uri=True)
+    try:
+        dst = sqlite3.connect(dst_path, timeout=timeout)
+        try:
+            src.backup(dst)
+            if dst.execute('pragma journal_mode').fetchone()[0] == 'wal':
+                dst.execute(f'pragma busy_timeout={int(CHECKPOINT_TIMEOUT * 1000)}')
+                try:
+                    dst.execute('pragma journal_mode=DELETE')
+                except sqlite3.OperationalError:
+                    dst.execute('pragma wal_checkpoint(TRUNCATE)')
+        finally:
+            dst.close()
+    finally:
+        src.close()
+
+def remove_wal_files(db_path):
+    """
+    Delete the -wal and -shm files left next to a db that no connection has open (read-only connections leave them)
+    """
+    for suffix in ['-wal', '-shm']:
+        Path(f'{db_path}{suffix}').unlink(missing_ok=True)
+
+def replace_db(build_path, db_path, tries=5):
+    """
+    Swap a built db in for the live db by moving it into place (os.replace). Dashboard queries reading meanwhile
+    finish on the old file, and the dashboard drops its connections to it once it sees the new one
+    (plot_lib.utils.get_engine). Windows doesn't allow the move while the dashboard has the live db open, and a live
+    db with -wal or -shm files (WAL mode, from an earlier build) would have them read with the new file, so then the
+    live db is written over with the build through sqlite's backup API (copy_db) instead, retried while another
+    connection has it locked.
+    """
+    db_path = Path(db_path)
+    # The build ran with synchronous=OFF, so flush it to disk before it becomes the live db
+    with open(build_path, 'rb+') as f:
+        os.fsync(f.fileno())
+    remove_wal_files(build_path)
+    if not has_wal_files(db_path):
+        try:
+            os.replace(build_path, db_path)
+            return
+        except PermissionError:
+            pass
+    for attempt in range(tries):
+        try:
+            copy_db(build_path, db_path)
+            return
+        except sqlite3.OperationalError:
+            if attempt == tries - 1:
+                raise
+            time.sleep(1)
+
+@contextmanager
+def open_build(db_path, pragmas=None, vacuum=False):
+    """
+    Connection for a build script writing db_path. The writes go to a copy of the db (get_build_path), in one
+    transaction with BUILD_PRAGMAS (updated with pragmas, e.g. a smaller cache when several dbs are built at once);
+    write each table in a savepoint so a bad one doesn't undo the others. When done the copy is checked (check_build)
+    and swapped in for the live db (replace_db), so the dashboard never reads a half-written db. On error the copy is
+    deleted and the live db is left as it was. If the swap itself fails the error is printed and the copy is kept
+    (to swap in by hand), so the other dbs of a script are still built. Set vacuum to rebuild the copy's file after
+    the writes, e.g. after tables were recreated.
+    """
+    db_path = Path(db_path)
+    build_path = get_build_path(db_path)
+    for path in [build_path, f'{build_path}-wal', f'{build_path}-shm']:
+        Path(path).unlink(missing_ok=True)
+    if has_wal_files(db_path):
+        copy_db(db_path, build_path)
+    elif db_path.is_file():
+        # Only the build scripts write the live db, so the file itself is a consistent copy
+        shutil.copyfile(db_path, build_path)
+    keep_build = False
+    try:
+        con = sqlite3.connect(build_path, isolation_level=None)
+        try:
+            for pragma, value in dict(BUILD_PRAGMAS, **(pragmas or dict())).items():
+                con.execute(f'pragma {pragma}={value}')
+            con.execute('begin')
+            try:
+                yield con
+            except BaseException:
+                con.execute('rollback')
+                raise
+            con.execute('commit')
+            if vacuum:
+                con.execute('vacuum')
+            con.execute('pragma journal_mode=DELETE')
+        finally:
+            con.close()
+        try:
+            new_rows = check_build(build_path, db_path)
+        except sqlite3.DatabaseError as e:
+            print(f'  Error - did not replace {db_path} - {e}')
+            return
+        try:
+            replace_db(build_path, db_path)
+        except (OSError, sqlite3.Error) as e:
+            keep_build = True
+            print(f'  Error - could not replace {db_path} - {e}. The new db is kept at {build_path}')
+            return
+        print(f'  Replaced {db_path} ({len(new_rows)} tables, {sum(new_rows.values())} rows)')
+    finally:
+        if not keep_build:
+            build_path.unlink(missing_ok=True)
+        remove_wal_files(build_path)
+
+def commit_build(con):
+    """
+    Commit the writes so far in an open_build transaction and start the next one, so the pages written are flushed
+    from memory. The build is still checked and swapped in (or deleted on error) as a whole when open_build exits.
+    """
+    con.execute('commit')
+    con.execute('begin')
+
+@contextmanager
+def savepoint(con, name='write_table'):
+    """
+    Run the writes in the with block in a savepoint of the open_build transaction, rolling them back on error
+    """
+    con.execute(f'savepoint "{name}"')
+    try:
+        yield con
+    except BaseException:
+        con.execute(f'rollback to "{name}"')
+        con.execute(f'release "{name}"')
+        raise
+    con.execute(f'release "{name}"')
+
+def get_tables(con):
+    """
+    List the tables in an open sqlite db
+    """
+    return [
+        r[0] for r in con.execute("select name from sqlite_master where type='table'")
+    ]
+
+def get_columns(con, tbl_name):
+    """
+    List the columns of a table in an open sqlite db
+    """
+    return [r[1] for r in con.execute(f'pragma table_info("{tbl_name}")')]
+
+def get_points_name(tbl_name):
+    """
+    Name of the points (dimension) table for a SHREAD basin table
+    """
+    return f'{tbl_name}_points'
+
+def split_points(df_basin):
+    """
+    Split SHREAD basin data into the static point attributes and the slim (date, point, value) data
+    """
+    df_points = df_basin[POINT_COLS].drop_duplicates(subset=POINT_ID)
+    df_data = df_basin.drop(columns=POINT_COLS[1:])
+    return df_points, df_data
+
+def write_points(con, tbl_name, df_points, if_exists='replace'):
+    """
+    Write the points table for a SHREAD basin table, only adding new points unless replacing (or upserting)
+    """
+    pts_name = get_points_name(tbl_name)
+    if if_exists == 'fail':
+        if_exists = 'append'
+    write_keyed(con, pts_name, df_points, [POINT_ID], if_exists)
+    return pts_name
+
+def create_key_index(con, tbl_name, key_cols, order_col=None):
+    """
+    Create the unique index on the key columns of a table. Duplicate keys in tables written before they were keyed
+    (or written in parts, see write_keyed) are dropped first, keeping the row with the latest order_col, or the last
+    row written.
+    """
+    idx_name = f"ux_{tbl_name}_{'_'.join(key_cols)}"
+    col_str = ', '.join(f'"{c}"' for c in key_cols)
+    qry = f'create unique index if not exists "{idx_name}" on "{tbl_name}" ({col_str})'
+    try:
+        con.execute(qry)
+    except sqlite3.IntegrityError:
+        if order_col is None:
+            keep_qry = f'select max(rowid) from "{tbl_name}" group by {col_str}'
+        else:
+            keep_qry = (
+                f'select rowid from (select rowid, row_number() over (partition by {col_str} '
+                f'order by "{order_col}" desc, rowid desc) as n from "{tbl_name}") where n = 1'
+            )
+        con.execute(f'delete from "{tbl_name}" where rowid not in ({keep_qry})')
+        con.execute(qry)
+    return idx_name
+
+def create_spatial_index(con, tbl_name, date_field='Date', order_col=None):
+    """
+    Create the unique (date, point) index used by screen_spatial, and as the key of writes, on a SHREAD basin table
+    (replacing the non-unique index of earlier versions)
+    """
+    cols = [date_field] + SPATIAL_INDEX_COLS
+    old_name = f"ix_{tbl_name}_{'_'.join(cols)}"
+    con.execute(f'drop index if exists "{old_name}"')
+    return create_key_index(con, tbl_name, cols, order_col)
+
+def get_sql_dates(dates):
+    """
+    Format a DatetimeIndex as text, as written by DataFrame.to_sql (Timestamp.isoformat(' ')), with NaT as None.
+    Whole seconds are formatted with numpy (sub-second times fall back to isoformat).
+    """
+    local = dates if dates.tz is None else dates.tz_localize(None)
+    if ((local.microsecond + local.nanosecond) > 0).any():
+        return np.array([None if pd.isna(d) else d.isoformat(' ') for d in dates], dtype=object)
+    # 'YYYY-MM-DDTHH:MM:SS', edited as arrays of characters
+    text = np.datetime_as_string(local.values, unit='s').astype('U19')
+    text.view('U1').reshape(-1, 19)[:, 10] = ' '
+    if dates.tz is not None:
+        offsets = (local.asi8 - dates.asi8) // 60_000_000_000
+        codes, uniques = pd.factorize(offsets)
+        off_text = np.array(
+            [f"{'-' if o < 0 else '+'}{abs(o) // 60:02d}:{abs(o) % 60:02d}" for o in uniques], dtype='U6'
+        )
+        chars = np.empty((len(text), 25), dtype='U1')
+        chars[:, :19] = text.view('U1').reshape(-1, 19)
+        chars[:, 19:] = off_text.view('U1').reshape(-1, 6)[codes]
+        text = chars.view('U25').ravel()
+    text = text.astype(object)
+    text[dates.isna()] = None
+    return text
+
+def get_sql_values(df):
+    """
+    Rows of a dataframe as tuples for executemany: datetimes as text (see get_sql_dates) and NaN as NULL
+    """
+    values = list()
+    for col in df.columns:
+        s = df[col]
+        if pd.api.types.is_datetime64_any_dtype(s):
+            # SHREAD tables have few distinct dates, so only format each one once
+            codes, dates = pd.factorize(s)
+            text = np.append(get_sql_dates(pd.DatetimeIndex(dates)), None)
+            values.append(text[codes].tolist())
+        elif s.isna().any():
+            values.append(s.astype(object).where(s.notna(), None).tolist())
+        else:
+            values.append(s.tolist())
+    return list(zip(*values))
+
+def write_keyed(con, tbl_name, df, key_cols, if_exists='append', index=True, order_col=None):
+    """
+    Write a dataframe to a table keyed on key_cols (unique index, see create_key_index). Rows with a key already in the
+    table are skipped ('append') or updated ('upsert'); 'replace' drops the table first and 'fail' raises ValueError
+    if it exists. Within df, the last row of a key is kept. Returns the number of rows inserted or updated.
+
+    With order_col (e.g. INIT_FIELD), the row with the latest order_col is kept for a key instead, within df and
+    against the table: a row replaces the stored row of its key if its order_col is later ('append') or not earlier
+    ('upsert'), whatever order the rows are written in.
+
+    With index=False the rows are inserted without the key index, for a table a build replaces and writes in parts:
+    create_key_index is then run once all parts are written, keeping the last (or latest order_col) row of a key.
+    """
+    if order_col is not None:
+        df = df.sort_values(order_col, kind='stable')
+    df = df.drop_duplicates(subset=key_cols, keep='last')
+    tbl_names = get_tables(con)
+    if tbl_name in tbl_names:
+        if if_exists == 'fail':
+            raise ValueError(f'Table {tbl_name} already exists')
+        if if_exists == 'replace':
+            con.execute(f'drop table "{tbl_name}"')
+            tbl_names.remove(tbl_name)
+    # A new table is indexed after the insert (faster than updating the index row by row)
+    new_tbl = tbl_name not in tbl_names
+    if new_tbl:
+        con.execute(pd.io.sql.get_schema(df, tbl_name, con=con))
+    elif index:
+        create_key_index(con, tbl_name, key_cols, order_col)
+
+    cols = list(df.columns)
+    col_str = ', '.join(f'"{c}"' for c in cols)
+    key_str = ', '.join(f'"{c}"' for c in key_cols)
+    val_str = ', '.join('?' for c in cols)
+    set_str = ', '.join(f'"{c}"=excluded."{c}"' for c in cols if c not in key_cols)
+    if (order_col is not None) and set_str:
+        op = '>=' if if_exists == 'upsert' else '>'
+        conflict = f'do update set {set_str} where excluded."{order_col}" {op} "{tbl_name}"."{order_col}"'
+    elif (if_exists == 'upsert') and set_str:
+        conflict = f'do update set {set_str}'
+    else:
+        conflict = 'do nothing'
+    if new_tbl or (not index):
+        cur = con.executemany(f'insert into "{tbl_name}" ({col_str}) values ({val_str})', get_sql_values(df))
+        if index:
+            create_key_index(con, tbl_name, key_cols, order_col)
+    else:
+        cur = con.executemany(
+            f'insert into "{tbl_name}" ({col_str}) values ({val_str}) on conflict ({key_str}) {conflict}',
+            get_sql_values(df)
+        )
+    return cur.rowcount
+
+def get_part_mode(if_exists, tbl_name, written):
+    """
+    if_exists for write_keyed when a build writes a table in parts (e.g. a file at a time): if_exists until tbl_name
+    is in written (the tables the build has written), then 'upsert' after 'replace' or 'upsert' (the last row of a
+    key wins, as when written at once) and 'append' after 'append' or 'fail'
+    """
+    if tbl_name not in written:
+        return if_exists
+    if if_exists in ['replace', 'upsert']:
+        return 'upsert'
+    return 'append'
+
+def batch_parts(parts, batch_rows):
+    """
+    Collect (name, dataframe) parts into batches, yielding (name, dataframe) for every name waiting whenever
+    batch_rows rows are waiting in all, and for the rest at the end (memory is bounded by batch_rows, not the number of
+    names)
+    """
+    batches = dict()
+    rows = 0
+    for name, df in parts:
+        batches.setdefault(name, []).append(df)
+        rows += len(df)
+        if rows >= batch_rows:
+            for batch_name, df_list in batches.items():
+                yield batch_name, pd.concat(df_list)
+            batches = dict()
+            rows = 0
+    for name, df_list in batches.items():
+        yield name, pd.concat(df_list)
+
+def get_cube_names(tbl_name):
+    """
+    Names of the cell and rollup (above each elevation band) tables of the statistics cube of a SHREAD basin table
+    """
+    return f'{tbl_name}_cube', f'{tbl_name}_cube_rollup'
+
+def get_cube_pct_cols():
+    """
+    Column names of the CUBE_PERCENTILES in the rollup table of a cube (p5, p50, p95)
+    """
+    return [f'p{p * 100:g}' for p in CUBE_PERCENTILES]
+
+def get_band_cells(values, lo):
+    """
+    Cube cell of each value in a series from the lower edge of its band: the edge for a value on it, and the edge + 1
+    for a value above it
+    """
+    return lo + (values > lo)
+
+def get_cells(df_points):
+    """
+    Cube cell (CUBE_CELL_COLS) of each point in a frame of point attributes (elev_ft, slope_d and aspct)
+    """
+    elev, aspct, slope = df_points['elev_ft'], df_points['aspct'], df_points['slope_d']
+    slope_idx = np.maximum(np.searchsorted(CUBE_SLOPE_CLASSES, slope, side='right') - 1, 0)
+    slope_lo = pd.Series(np.asarray(CUBE_SLOPE_CLASSES)[slope_idx], index=slope.index).where(slope.notna())
+    return pd.DataFrame({
+        'elev_band': get_band_cells(elev, (elev // CUBE_ELEV_BAND) * CUBE_ELEV_BAND),
+        'aspct_oct': get_band_cells(aspct, (aspct // CUBE_ASPECT_BAND) * CUBE_ASPECT_BAND),
+        'slope_cls': get_band_cells(slope, slope_lo),
+    }, index=df_points.index)
+
+def get_cube_stats(df, date_field='Date'):
+    """
+    Per date and cell statistics of the cube cell table for a frame of (date, mean, elev_ft and cell) rows
+    """
+    df = df.assign(sq=df['mean'] ** 2)
+    return df.groupby([date_field] + CUBE_CELL_COLS, sort=False, observed=True).agg(
+        count=('mean', 'count'),
+        sum=('mean', 'sum'),
+        sumsq=('sq', 'sum'),
+        min=('mean', 'min'),
+        max=('mean', 'max'),
+        elev_sum=('elev_ft', 'sum'),
+        points=('mean', 'size'),
+    ).reset_index()
+
+def get_rollup_stats(df, df_cube, edges, date_field='Date'):
+    """
+    Per date statistics of the points in and above each elevation band in edges, with aspects in CUBE_ROLLUP_ASPECTS
+    (the cube rollup table), for a frame of (date, mean, elev_ft and cell) rows and its cell statistics
+    (get_cube_stats). The statistics that add up are summed over the bands from the top down; only the percentiles
+    are computed from the points of each band up.
+    """
+    df = df[df['aspct_oct'].between(*CUBE_ROLLUP_ASPECTS)]
+    df_cube = df_cube[df_cube['aspct_oct'].between(*CUBE_ROLLUP_ASPECTS)]
+    bands = df_cube.groupby([date_field, 'elev_band'], observed=True).agg({
+        'count': 'sum', 'sum': 'sum', 'sumsq': 'sum', 'min': 'min', 'max': 'max', 'elev_sum': 'sum', 'points': 'sum'
+    }).unstack('elev_band')
+    edges_desc = sorted(edges, reverse=True)
+    stats = dict()
+    for col in ['count', 'sum', 'sumsq', 'min', 'max', 'elev_sum', 'points']:
+        vals = bands[col].reindex(columns=edges_desc).values
+        if col == 'min':
+            vals = np.fmin.accumulate(vals, axis=1)
+        elif col == 'max':
+            vals = np.fmax.accumulate(vals, axis=1)
+        else:
+            vals = np.nancumsum(vals, axis=1)
+        stats[col] = pd.DataFrame(vals, index=bands.index, columns=edges_desc).stack(dropna=False)
+    sums = pd.DataFrame(stats)
+    sums.index.names = [date_field, 'elev_lo']
+    sums = sums[sums['points'] > 0]
+
+    # Percentiles (linear interpolation, as numpy/pandas) from the values sorted by date once, for each band up
+    df = df[df['mean'].notna()]
+    codes = df[date_field].cat.codes.values
+    order = np.lexsort((df['mean'].values, codes))
+    codes, vals, elev_bands = codes[order], df['mean'].values[order], df['elev_band'].values[order]
+    n_dates = len(df[date_field].cat.categories)
+    pct_dfs = dict()
+    for elev_lo in edges:
+        in_lo = elev_bands >= elev_lo
+        n = np.bincount(codes[in_lo], minlength=n_dates)
+        starts = np.cumsum(n) - n
+        lo_vals = vals[in_lo] if in_lo.any() else np.array([np.nan])
+        last = len(lo_vals) - 1
+        pcts = dict()
+        for p in CUBE_PERCENTILES:
+            pos = p * np.maximum(n - 1, 0)
+            lo = np.floor(pos).astype(int)
+            v_lo = lo_vals[np.minimum(starts + lo, last)]
+            v_hi = lo_vals[np.minimum(starts + np.minimum(lo + 1, np.maximum(n - 1, 0)), last)]
+            pcts[p] = np.where(n > 0, v_lo + (v_hi - v_lo) * (pos - lo), np.nan)
+        pct_dfs[elev_lo] = pd.DataFrame(pcts, index=df[date_field].cat.categories)
+    pct_df = pd.concat(pct_dfs, names=['elev_lo']).swaplevel().reindex(sums.index)
+
+    count = sums['count'].astype(int)
+    mean = sums['sum'] / count.where(count > 0)
+    # Sample standard deviation from sum of squares (as plot_lib.utils.screen_spatial_stats)
+    ss = sums['sumsq'] - count * mean ** 2
+    df_roll = pd.DataFrame({
+        'count': count,
+        'mean': mean,
+        'std': np.sqrt(ss.clip(lower=0) / (count - 1).where(count > 1)),
+        'min': sums['min'],
+    })
+    for pct_col, p in zip(get_cube_pct_cols(), CUBE_PERCENTILES):
+        df_roll[pct_col] = pct_df[p]
+    df_roll['max'] = sums['max']
+    df_roll['elev_ft'] = sums['elev_sum'] / sums['points']
+    df_roll['points'] = sums['points'].astype(int)
+    return df_roll.reset_index()
+
+def write_cube(con, tbl_name, dates=None, date_field='Date'):
+    """
+    Compute the statistics cube of a SHREAD basin table for dates (all dates if None, or if the table has no cube
+    yet), replacing the cube rows of those dates, CUBE_DATES at a time. plot_lib.utils.screen_spatial answers basin
+    statistics for filters that select whole cells from the cube. Returns the number of cube rows written.
+    """
+    cube_name, rollup_name = get_cube_names(tbl_name)
+    tbl_names = get_tables(con)
+    if (dates is None) or (cube_name not in tbl_names) or (rollup_name not in tbl_names):
+        for name in [cube_name, rollup_name]:
+            con.execute(f'drop table if exists "{name}"')
+        dates = [r[0] for r in con.execute(f'select distinct "{date_field}" from "{tbl_name}" order by 1')]
+    else:
+        dates = sorted(get_sql_dates(pd.DatetimeIndex(list(dates))))
+    pct_str = ', '.join(f'"{c}" REAL' for c in get_cube_pct_cols())
+    cell_str = ', '.join(f'"{c}" INTEGER' for c in CUBE_CELL_COLS)
+    con.execute(
+        f'create table if not exists "{cube_name}" ("{date_field}" TEXT, {cell_str}, "count" INTEGER, "sum" REAL, '
+        f'"sumsq" REAL, "min" REAL, "max" REAL, "elev_sum" REAL, "points" INTEGER)'
+    )
+    con.execute(
+        f'create table if not exists "{rollup_name}" ("{date_field}" TEXT, "elev_lo" INTEGER, "count" INTEGER, '
+        f'"mean" REAL, "std" REAL, "min" REAL, {pct_str}, "max" REAL, "elev_ft" REAL, "points" INTEGER)'
+    )
+    create_key_index(con, cube_name, [date_field] + CUBE_CELL_COLS)
+    create_key_index(con, rollup_name, [date_field, 'elev_lo'])
+
+    df_points = pd.read_sql(
+        f'select "{POINT_ID}", elev_ft, slope_d, aspct from "{get_points_name(tbl_name)}"', con, index_col=POINT_ID
+    )
+    df_points = df_points[['elev_ft']].join(get_cells(df_points))
+    edges = sorted(df_points['elev_band'].unique())
+    rows = 0
+    for i in range(0, len(dates), CUBE_DATES):
+        chunk = list(dates[i:i + CUBE_DATES])
+        date_str = ', '.join('?' for d in chunk)
+        for name in [cube_name, rollup_name]:
+            con.execute(f'delete from "{name}" where "{date_field}" in ({date_str})', chunk)
+        df = pd.read_sql(
+            f'select "{date_field}", "{POINT_ID}", mean from "{tbl_name}" where "{date_field}" in ({date_str})',
+            con, params=chunk
+        ).join(df_points, on=POINT_ID, how='inner')
+        # Group on date codes rather than hashing the date text in every groupby
+        df[date_field] = df[date_field].astype('category')
+        df_cube = get_cube_stats(df, date_field)
+        for name, df_stats in [(cube_name, df_cube), (rollup_name, get_rollup_stats(df, df_cube, edges, date_field))]:
+            col_str = ', '.join(f'"{c}"' for c in df_stats.columns)
+            val_str = ', '.join('?' for c in df_stats.columns)
+            cur = con.executemany(
+                f'insert into "{name}" ({col_str}) values ({val_str})', get_sql_values(df_stats)
+            )
+            rows += cur.rowcount
+    return rows
+
+def get_date_stamps(con, tbl_name, dates, date_field='Date', order_col=None):
+    """
+    Stamp of the rows of a basin table on each of dates (a DatetimeIndex), as {date text (see get_sql_dates): stamp}:
+    the number of rows, and with order_col the sum of its times (under 'append', write_keyed only replaces a row
+    with one of a later order_col, which raises the sum). Dates without rows, or all if there is no table, are left out.
+    """
+    if tbl_name not in get_tables(con):
+        return dict()
+    order_str = '0' if order_col is None else f'sum(cast(strftime(\'%s\', "{order_col}") as integer))'
+    sql_dates = list(get_sql_dates(dates))
+    stamps = dict()
+    for i in range(0, len(sql_dates), CUBE_DATES):
+        chunk = sql_dates[i:i + CUBE_DATES]
+        date_str = ', '.join('?' for d in chunk)
+        cur = con.execute(
+            f'select "{date_field}", count(*), {order_str} from "{tbl_name}" where "{date_field}" in ({date_str}) '
+            f'group by "{date_field}"', chunk
+        )
+        stamps.update((r[0], r[1:]) for r in cur)
+    return stamps
+
+def get_changed_dates(dates, stamps, new_stamps):
+    """
+    The dates (a DatetimeIndex) whose get_date_stamps changed between stamps and new_stamps (before and after a
+    write_keyed), i.e. the dates rows were written for
+    """
+    sql_dates = get_sql_dates(dates)
+    changed = [stamps.get(d) != new_stamps.get(d) for d in sql_dates]
+    return dates[np.array(changed, dtype=bool)]
+
+def normalize_table(con, tbl_name):
+    """
+    Move the point attributes of a SHREAD basin table written before the points table existed into
+    {basin}_points, leaving (date, point, value) in the basin table. Returns False if already normalized.
+    """
+    cols = get_columns(con, tbl_name)
+    if not all(c in cols for c in POINT_COLS):
+        return False
+    pts_name = get_points_name(tbl_name)
+    tmp_name = f'{tbl_name}_tmp'
+    pts_str = ', '.join(f'"{c}"' for c in POINT_COLS)
+    data_str = ', '.join(f'"{c}"' for c in cols if (c not in POINT_COLS[1:]) and (c != 'index'))
+    con.execute(f'drop table if exists "{pts_name}"')
+    con.execute(
+        f'create table "{pts_name}" as select {pts_str} from "{tbl_name}" group by "{POINT_ID}"'
+    )
+    create_key_index(con, pts_name, [POINT_ID])
+    con.execute(f'drop table if exists "{tmp_name}"')
+    con.execute(f'create table "{tmp_name}" as select {data_str} from "{tbl_name}"')
+    con.execute(f'drop table "{tbl_name}"')
+    con.execute(f'alter table "{tmp_name}" rename to "{tbl_name}"')
+    return True
+
+def migrate_db(db_path, date_field='Date', verbose=False):
+    """
+    Bring an existing SHREAD db up to the current layout (points tables, screen_spatial indexes and cubes). The
+    migration is written to a build copy and swapped in (open_build), so the live db is never rewritten in place.
+    """
+    db_path = Path(db_path)
+    if not db_path.is_file():
+        print(f'  No db found at {db_path}, skipping...')
+        return
+    print(f'  Migrating {db_path}...')
+    try:
+        with open_build(db_path, vacuum=True) as con:
+            tbl_names = [t for t in get_tables(con) if not t.endswith('_points')]
+            for tbl_name in tbl_names:
+                if normalize_table(con, tbl_name) and verbose:
+                    print(f'    Moved point attributes of {tbl_name} to {get_points_name(tbl_name)}')
+                cols = get_columns(con, tbl_name)
+                if not all(c in cols for c in [date_field] + SPATIAL_INDEX_COLS):
+                    continue
+                order_col = INIT_FIELD if INIT_FIELD in cols else None
+                idx_name = create_spatial_index(con, tbl_name, date_field, order_col)
+                if verbose:
+                    print(f'    Created {idx_name}')
+                rows = write_cube(con, tbl_name, date_field=date_field)
+                if verbose:
+                    print(f'    Wrote {rows} cube rows for {tbl_name}')
+            con.execute('analyze')
+    except sqlite3.Error as e:
+        print(f'    Error - could not migrate {db_path} - {e}')
+
+def get_last_dates(db_path, prefix, date_field='date', where_qry=None):
+    """
+    Get the last stored date of each {prefix}{site} table in a site db, as {site: date (UTC)}, of the rows matching
+    where_qry if given (e.g. only rows with data). The stored dates may have different UTC offsets, so they are
+    compared in UTC (sqlite julianday) rather than as text.
+    """
+    db_path = Path(db_path)
+    if not db_path.is_file():
+        return dict()
+    last_dates = dict()
+    con = sqlite3.connect(db_path)
+    try:
+        for tbl_name in get_tables(con):
+            if not tbl_name.startswith(prefix):
+                continue
+            where_str = f' where {where_qry}' if where_qry else ''
+            last_date = con.execute(
+                f'select datetime(max(julianday("{date_field}"))) from "{tbl_name}"{where_str}'
+            ).fetchone()[0]
+            if last_date is not None:
+                last_dates[tbl_name[len(prefix):]] = pd.to_datetime(last_date, utc=True)
+    finally:
+        con.close()
+    return last_dates
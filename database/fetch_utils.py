@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:05:32 2026
+
+HTTP utilities shared by the database retrieval scripts (/database/SUBS/*_to_db.py)
+
+Downloads go through one requests.Session (so connections are reused) and fetch_all runs them on a thread pool, with
+at most HOST_CONNECTIONS requests in flight per host. Connection errors, timeouts and 429/5xx responses are retried
+with exponential backoff and jitter, within the deadline of the fetch_all run. Like db_utils, the scripts add this
+directory to sys.path and import this module as fetch_utils. The dashboard imports it by that name too (the database
+package puts this directory on sys.path), so there is one module and the session and host slots are shared; don't
+import it as database.fetch_utils.
+
+@author: buriona,tclarkin
+"""
+
+import os
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+# Concurrent downloads (threads) and requests per host
+MAX_WORKERS = 8
+HOST_CONNECTIONS = 4
+DEFAULT_TIMEOUT = 10
+
+# Retries after the first attempt, backoff base and cap (seconds) and the time allowed for one fetch_all run
+RETRIES = int(os.environ.get("SHREAD_FETCH_RETRIES", 3))
+BACKOFF = float(os.environ.get("SHREAD_FETCH_BACKOFF", 0.5))
+BACKOFF_MAX = 8
+RUN_DEADLINE = float(os.environ.get("SHREAD_FETCH_DEADLINE", 1800))
+RETRY_STATUS = [429, 500, 502, 503, 504]
+RETRY_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+_session = None
+_host_slots = dict()
+_lock = threading.Lock()
+_local = threading.local()
+
+class FetchError(Exception):
+    """
+    A download that failed after all retries, or ran out of time
+    """
+
+class RetryStatus(IOError):
+    """
+    A response with a status in RETRY_STATUS
+    """
+
+def get_session():
+    """
+    The shared requests.Session, with a connection pool large enough for MAX_WORKERS threads
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+    return _session
+
+def host_slot(url):
+    """
+    Semaphore limiting the requests in flight to the host of url (use as a context manager). Also used around
+    downloads that don't go through get_text (e.g. dataretrieval).
+    """
+    host = urlsplit(url).netloc
+    with _lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(HOST_CONNECTIONS)
+    return _host_slots[host]
+
+def get_deadline():
+    """
+    Deadline (time.monotonic) of the fetch_all run in this thread, or None
+    """
+    return getattr(_local, "deadline", None)
+
+def get_backoff(attempt):
+    """
+    Seconds to wait before retry number attempt (from 1): exponential, capped at BACKOFF_MAX, with full jitter
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF * 2 ** (attempt - 1)))
+
+def retry_call(func, *args, desc=None, retries=None, retry_on=RETRY_ERRORS, **kwargs):
+    """
+    Call func(*args, **kwargs), retrying on the retry_on exceptions with backoff. Raises FetchError once the retries
+    are used up or the next attempt would pass the deadline.
+    """
+    if retries is None:
+        retries = RETRIES
+    if desc is None:
+        desc = getattr(func, "__name__", str(func))
+    deadline = get_deadline()
+    attempt = 0
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except retry_on as e:
+            error = e
+        attempt += 1
+        if attempt > retries:
+            raise FetchError(f"{desc} failed after {attempt} tries - {error}") from error
+        wait = get_backoff(attempt)
+        if (deadline is not None) and (time.monotonic() + wait >= deadline):
+            raise FetchError(f"{desc} ran out of time after {attempt} tries - {error}") from error
+        print(f"  {error}, retrying {desc} in {wait:.1f} s ({attempt} of {retries})...")
+        time.sleep(wait)
+
+def _get(url, timeout, **kwargs):
+    """
+    One GET with the shared session, holding a slot for the host. Responses in RETRY_STATUS raise RetryStatus.
+    """
+    deadline = get_deadline()
+    if deadline is not None:
+        timeout = max(min(timeout, deadline - time.monotonic()), 0.1)
+    with host_slot(url):
+        response = get_session().get(url, timeout=timeout, **kwargs)
+    if response.status_code in RETRY_STATUS:
+        raise RetryStatus(f"{response.status_code} response")
+    return response
+
+def get_text(url, timeout=DEFAULT_TIMEOUT, retries=None, **kwargs):
+    """
+    GET url with the shared session (retrying as in retry_call) and return the response text
+    """
+    response = retry_call(
+        _get, url, timeout, desc=url, retries=retries, retry_on=RETRY_ERRORS + (RetryStatus,), **kwargs
+    )
+    return response.text
+
+def _run_item(func, item, deadline):
+    """
+    Run func(item) in a fetch_all worker, with the run deadline set for retry_call
+    """
+    if time.monotonic() >= deadline:
+        raise FetchError("run deadline passed before it started")
+    _local.deadline = deadline
+    try:
+        return func(item)
+    finally:
+        _local.deadline = None
+
+def fetch_all(func, items, max_workers=MAX_WORKERS, deadline=RUN_DEADLINE, verbose=False):
+    """
+    Run func(item) for each item on a thread pool and return {item: result}. Items that raise are printed and left
+    out, so one bad site doesn't stop the others; the failures are listed at the end. Downloads aren't retried past
+    deadline seconds from the start of the run.
+    """
+    items = list(items)
+    results = dict()
+    failed = list()
+    run_deadline = time.monotonic() + deadline
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {item: pool.submit(_run_item, func, item, run_deadline) for item in items}
+        for item in items:
+            try:
+                results[item] = futures[item].result()
+            except Exception as e:
+                print(f'  Error - could not fetch {item} - {e}')
+                failed.append(item)
+                continue
+            if verbose:
+                print(f'  Fetched {item}')
+    if failed:
+        print(f'  {len(failed)} of {len(items)} failed: {", ".join(str(item) for item in failed)}')
+    return results
@@ -13,13 +13,11 @@ import pandas as pd
 import plotly.graph_objects as go
 from database import csas_gages, dust_ts, dust_layers
 
-from plot_lib.utils import screen_csas
-from plot_lib.utils import import_csas_live
 
-
-def get_csas_plot(start_date, end_date, plot_dust, csas_sel, dtype, plot_albedo,offline=True):
+def get_csas_plot(data, start_date, end_date, plot_dust, csas_sel, dtype, plot_albedo,offline=True):
     """
     :description: this function updates the snowplot
+    :param data: the data for the selection (from plot_lib.data_store)
     :param start_date: start date (from date selector)
     :param end_date: end date (from date selector)
     :param plot_dust: boolean for plotting dust layers
@@ -38,26 +36,22 @@ def get_csas_plot(start_date, end_date, plot_dust, csas_sel, dtype, plot_albedo,
     csas_a_df = pd.DataFrame()
     csas_s_df = pd.DataFrame()
 
+    csas_df = data["csas"][dtype]
     for site in csas_sel:
-        if offline:
-            csas_df = screen_csas(site, start_date, end_date,dtype)
-        else:
-            csas_df = import_csas_live(site,start_date,end_date,dtype)
-
         if site == "SBSG":
-            csas_f_df[site] = csas_df["flow"]
+            csas_f_df[site] = csas_df["flow", site]
             if ylabel=="":
                 ylabel = "Flow (ft^3/s)"
             else:
                 ylabel = f"{ylabel} | Flow (ft^3/s)"
         elif site != "PTSP":
-            csas_s_df[site] = csas_df["snwd"]
+            csas_s_df[site] = csas_df["snwd", site]
             if ylabel=="":
                 ylabel = "Depth (in)"
             else:
                 ylabel = f"{ylabel} | Depth (in)"
         if (plot_albedo) and (site != "SBSG"):
-            csas_a_df[site] = csas_df["albedo"]
+            csas_a_df[site] = csas_df["albedo", site]
 
     csas_max = np.nanmax([csas_f_df.max().max(),csas_s_df.max().max()])
 
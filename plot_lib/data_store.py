@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 10:02:15 2026
+
+SHREAD Dash Data Store
+
+Loads the data for a dashboard selection once, for all of the plots (shread_dash.py). The data is kept server-side,
+keyed by a hash of the selection; the browser only holds the key and the selection (dcc.Store 'data_store'). Each
+dataset is also kept under a key of its own inputs, so a new selection only loads the datasets whose inputs changed
+(e.g. adding a gage doesn't reload the basin stats). Like the screen_* results (plot_lib.utils.cache_result), kept
+data is dropped when a db it was read from is rebuilt (get_db_stamp) and after CACHE_TTL seconds; downloads (live
+data) after CACHE_TTL seconds.
+
+@author: buriona, tclarkin
+"""
+
+import json
+import time
+import hashlib
+import threading
+import datetime as dt
+from collections import OrderedDict
+import pandas as pd
+
+from database import snotel_sites, usgs_gages
+from database.consolidated_config import CONSOLIDATED_BIND
+from database.FLOW.rfc_to_db import import_rfc
+from database.FLOW.usgs_to_db import import_nwis
+from plot_lib import utils
+from plot_lib.utils import import_snotel, import_csas_live, sites_to_wide
+from plot_lib.utils import screen_spatial, screen_csas_many, screen_snotel_many, screen_usgs_many, screen_rfc
+
+# Number of selections, and of datasets, kept in the store (least recently used dropped first)
+STORE_SIZE = 8
+DATASET_STORE_SIZE = 64
+
+# The server threads share the stores, so they are only read and changed under _store_lock (selections and datasets
+# are loaded outside of it). Entries are (stamps, time stored, data), with stamps the db stamps of the binds the data
+# was read from, as {bind: stamp} (see is_fresh).
+_store = OrderedDict()
+_datasets = OrderedDict()
+_store_lock = threading.Lock()
+
+def get_selection_key(selection):
+    """
+    Hash of a selection (dict of the dashboard inputs), used as the store key
+    """
+    sel_str = json.dumps(selection, sort_keys=True, default=str)
+    return hashlib.sha1(sel_str.encode()).hexdigest()
+
+def get_stamps(binds):
+    """
+    Stamps (plot_lib.utils.get_db_stamp) of the dbs of binds, as {bind: stamp}
+    """
+    return {bind: utils.get_db_stamp(bind) for bind in binds}
+
+def is_fresh(entry, now):
+    """
+    True if a store entry was stored less than CACHE_TTL seconds ago and none of the dbs it was read from has been
+    rebuilt since
+    """
+    stamps, stored, _ = entry
+    return (now - stored < utils.CACHE_TTL) and (get_stamps(stamps) == stamps)
+
+def get_site_binds(bind):
+    """
+    Binds the site data of bind is read from: the site db, and the consolidated db (see plot_lib.utils.read_sites)
+    """
+    return [bind, CONSOLIDATED_BIND]
+
+def get_dataset_key(func, args, kwargs):
+    """
+    Key of the dataset func(*args, **kwargs) in the dataset store: the function name and its arguments (lists as
+    tuples)
+    """
+    def to_key(value):
+        if isinstance(value, (list, tuple)):
+            return tuple(to_key(v) for v in value)
+        return value
+    return func.__name__, to_key(args), to_key(sorted(kwargs.items()))
+
+def get_dataset(binds, func, *args, **kwargs):
+    """
+    Dataset func(*args, **kwargs), read from the dbs of binds (none for a download), from the dataset store while
+    fresh (is_fresh) or loaded into it
+    """
+    key = get_dataset_key(func, args, kwargs)
+    stamps = get_stamps(binds)
+    now = time.monotonic()
+    with _store_lock:
+        entry = _datasets.get(key)
+        if (entry is not None) and is_fresh(entry, now):
+            _datasets.move_to_end(key)
+            return entry[2]
+
+    data = func(*args, **kwargs)
+    with _store_lock:
+        _datasets[key] = (stamps, now, data)
+        _datasets.move_to_end(key)
+        while len(_datasets) > DATASET_STORE_SIZE:
+            _datasets.popitem(last=False)
+    return data
+
+def import_snotel_wide(snotel_sel, slabel):
+    """
+    Download the SNOTEL sites (snow variable slabel, temperature and precip) as a wide df
+    """
+    return sites_to_wide(
+        {s: import_snotel(s, snotel_sites, vars=[slabel, "TAVG", "PREC"]) for s in snotel_sel}, snotel_sel
+    )
+
+def import_csas_wide(csas_sel, start_date, end_date, dtype):
+    """
+    Download the CSAS sites as a wide df
+    """
+    return sites_to_wide(
+        {site: import_csas_live(site, start_date, end_date, dtype) for site in csas_sel}, csas_sel
+    )
+
+def import_nwis_wide(usgs_sel, start_date, end_date, dtype):
+    """
+    Download the USGS gages as a wide df
+    """
+    return sites_to_wide({g: import_nwis(g, start_date, end_date, dtype) for g in usgs_sel}, usgs_sel)
+
+def load_data(selection, stamps=None):
+    """
+    Fetch every dataset the plots need for a selection, with one screen_* call per dataset (or a download per site),
+    reusing the datasets already in the dataset store (see get_dataset)
+    :param selection: dict of basin, stype, elrange, aspects, slopes, start_date, end_date, dtype, snotel_sel,
+        csas_sel, usgs_sel, forecast_sel and offline
+    :param stamps: dict the stamps of the dbs the data is read from, before it's read, are added to ({bind: stamp},
+        see load_selection)
+    :return: dict of snodas (basin stats), ndfd ({sensor: basin stats}), snotel (wide df), csas ({dtype: wide df}),
+        usgs (wide df) and rfc ({site: (df, fcst_dt)}); the wide dfs have (variable, site) columns
+        (see plot_lib.utils.sites_to_wide)
+    """
+    basin = selection["basin"]
+    start_date = selection["start_date"]
+    end_date = selection["end_date"]
+    dtype = selection["dtype"]
+    offline = selection["offline"]
+    if stamps is None:
+        stamps = dict()
+
+    def get(binds, func, *args, **kwargs):
+        stamps.update(get_stamps(binds))
+        return get_dataset(binds, func, *args, **kwargs)
+
+    data = {
+        "snodas": None,
+        "ndfd": dict(),
+        "snotel": None,
+        "csas": dict(),
+        "usgs": None,
+        "rfc": dict(),
+    }
+
+    ## SHREAD basin stats
+    if basin:
+        data["snodas"] = get(
+            [selection["stype"]], screen_spatial, selection["stype"], start_date, end_date, basin, selection["aspects"],
+            selection["elrange"], selection["slopes"], agg=True
+        )
+        for sensor in selection["forecast_sel"]:
+            if sensor == "flow":
+                continue
+            data["ndfd"][sensor] = get(
+                [sensor], screen_spatial, sensor, start_date, end_date, basin, selection["aspects"],
+                selection["elrange"], selection["slopes"], "Date", agg=True, percentiles=False
+            )
+
+    ## SNOTEL (snow, temperature and precip for the snow and met plots)
+    slabel = "WTEQ" if selection["stype"] == "swe" else "SNWD"
+    snotel_sel = selection["snotel_sel"]
+    if offline:
+        data["snotel"] = get(get_site_binds("snotel_dv"), screen_snotel_many, snotel_sel, start_date, end_date)
+    else:
+        data["snotel"] = get([], import_snotel_wide, snotel_sel, slabel)
+
+    ## CSAS (the snow plot is always daily)
+    csas_sel = selection["csas_sel"]
+    for csas_dtype in sorted({"dv", dtype}):
+        if offline:
+            data["csas"][csas_dtype] = get(
+                get_site_binds(f"csas_{csas_dtype}"), screen_csas_many, csas_sel, start_date, end_date, csas_dtype
+            )
+        else:
+            data["csas"][csas_dtype] = get([], import_csas_wide, csas_sel, start_date, end_date, csas_dtype)
+
+    ## USGS and RFC flows
+    usgs_sel = selection["usgs_sel"]
+    if offline:
+        data["usgs"] = get(get_site_binds(f"usgs_{dtype}"), screen_usgs_many, usgs_sel, start_date, end_date, dtype)
+    else:
+        data["usgs"] = get([], import_nwis_wide, usgs_sel, start_date, end_date, dtype)
+
+    # No forecast data needed if dates aren't displayed (see get_flow_plot)
+    if ("flow" in selection["forecast_sel"]) and (pd.to_datetime(end_date) > dt.datetime.now()):
+        for g in usgs_sel:
+            rfc = usgs_gages.loc[int(g), "rfc"]
+            if pd.isna(rfc):
+                continue
+            if offline:
+                data["rfc"][g] = get(get_site_binds(f"rfc_{dtype}"), screen_rfc, rfc, "last", dtype)
+            else:
+                data["rfc"][g] = get([], import_rfc, rfc, dtype)
+
+    return data
+
+def get_stored(key, now):
+    """
+    Data of a selection key in the store while fresh (is_fresh), or None
+    """
+    with _store_lock:
+        entry = _store.get(key)
+        if (entry is not None) and is_fresh(entry, now):
+            _store.move_to_end(key)
+            return entry[2]
+    return None
+
+def load_selection(selection):
+    """
+    Key and data of a selection, from the store while fresh or loaded into it
+    """
+    key = get_selection_key(selection)
+    now = time.monotonic()
+    data = get_stored(key, now)
+    if data is not None:
+        return key, data
+
+    # Stamped with the dbs as they were before each dataset was read, so a rebuild during the load drops the data
+    stamps = dict()
+    data = load_data(selection, stamps)
+    with _store_lock:
+        _store[key] = (stamps, now, data)
+        _store.move_to_end(key)
+        while len(_store) > STORE_SIZE:
+            _store.popitem(last=False)
+    return key, data
+
+def store_selection(selection):
+    """
+    Load the data for a selection into the store (unless already there) and return its key
+    """
+    return load_selection(selection)[0]
+
+def get_data(store_data):
+    """
+    Data for the contents of the 'data_store' dcc.Store ({"key":..., "selection":...}), reloading the selection if
+    it has left the store (e.g. evicted, out of date, or loaded by another server process)
+    """
+    data = get_stored(store_data["key"], time.monotonic())
+    if data is None:
+        data = load_selection(store_data["selection"])[1]
+    return data
@@ -15,13 +15,10 @@ import pytz
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
-from database.FLOW.rfc_to_db import import_rfc
-from database.FLOW.usgs_to_db import import_nwis
 
 from database import csas_gages, usgs_gages
 
-from plot_lib.utils import import_csas_live
-from plot_lib.utils import shade_forecast,screen_csas,screen_rfc,screen_usgs
+from plot_lib.utils import shade_forecast, align_sites
 
 def get_log_scale_dd(ymax):
     log_scale_dd = [
@@ -72,10 +69,11 @@ def get_log_scale_dd(ymax):
     ]
     return log_scale_dd
 
-def get_flow_plot(usgs_sel, dtype, forecast_sel, start_date, end_date, csas_sel,
+def get_flow_plot(data, usgs_sel, dtype, forecast_sel, start_date, end_date, csas_sel,
                   plot_albedo,offline=True):
     """
     :description: this function updates the flow plot
+    :param data: the data for the selection (from plot_lib.data_store)
     :param usgs_sel: list of selected usgs sites ([])
     :param dtype: data type (dv/iv)
     :param forecast_sel: list, forecast variables
@@ -97,52 +95,36 @@ def get_flow_plot(usgs_sel, dtype, forecast_sel, start_date, end_date, csas_sel,
         dates = pd.date_range(start_date, end_date, freq="15T", tz='UTC')
 
     # Create dataframes for data, names and rfc sites
-    usgs_f_df = pd.DataFrame(index=dates)
+    usgs_f_df = align_sites(data["usgs"], "flow", usgs_sel, dates)
     name_df = pd.DataFrame(index=usgs_sel)
 
-    if "flow" in forecast_sel:
-        rfc_f_df = pd.DataFrame(index=dates)
-
     for g in usgs_sel:
         name_df.loc[g, "usgs"] = name_df.loc[g, "name"] = f'{g} {usgs_gages.loc[int(g), "name"]}'
 
-        if offline:
-            usgs_in = screen_usgs(g,start_date,end_date,dtype)
-        else:
-            usgs_in = import_nwis(g,start_date,end_date,dtype)
-
-        usgs_in = usgs_f_df.merge(usgs_in["flow"],left_index=True,right_index=True,how="left")
-        usgs_f_df[g] = usgs_in["flow"]
-
     if "flow" in forecast_sel:
 
-        # dummy forecast date for now
-        fcst_dt = "last"
-
+        rfc_dfs = dict()
         for g in usgs_sel:
-            if pd.isna(usgs_gages.loc[int(g),"rfc"])==False:
+            if g in data["rfc"]:
                 rfc = usgs_gages.loc[int(g),"rfc"]
 
-                if offline:
-                    rfc_in,fcst_dt = screen_rfc(rfc,fcst_dt,dtype)
-                else:
-                    rfc_in,fcst_dt = import_rfc(rfc,dtype)
-
-                usgs_interp = True
+                rfc_in,fcst_dt = data["rfc"][g]
                 if dtype == "dv":
-                    rfc_in.index = rfc_in.index + dt.timedelta(hours=-12)
-                    usgs_last = usgs_f_df[g].dropna().index.max()
-                    if pd.isna(usgs_last):
-                        usgs_interp = False
-
-                rfc_in = rfc_f_df.merge(rfc_in["flow"], left_index=True, right_index=True, how="left")
-                if (dtype == "dv") and (usgs_interp):
-                    rfc_in.loc[usgs_last,"flow"] = usgs_f_df.loc[usgs_last,g]
-                rfc_f_df[g] = rfc_in["flow"].interpolate()
+                    rfc_in = rfc_in.set_axis(rfc_in.index + dt.timedelta(hours=-12))
+                rfc_dfs[g] = rfc_in
 
                 name_df.loc[g,"rfc"] = f"RFC {rfc} {fcst_dt}"
                 name_df.loc[g,"name"] = f'{name_df.loc[g, "usgs"]} ({name_df.loc[g,"rfc"]})'
 
+        rfc_f_df = align_sites(rfc_dfs, "flow", list(rfc_dfs), dates)
+        if dtype == "dv":
+            # Start each forecast from the last observed flow
+            for g in rfc_f_df.columns:
+                usgs_last = usgs_f_df[g].dropna().index.max()
+                if not pd.isna(usgs_last):
+                    rfc_f_df.loc[usgs_last, g] = usgs_f_df.loc[usgs_last, g]
+        rfc_f_df = rfc_f_df.interpolate()
+
     if len(usgs_sel) > 0:
         flow_max = usgs_f_df.max().max()
         if ("flow" in forecast_sel) and (len(rfc_f_df)>0):
@@ -155,16 +137,12 @@ def get_flow_plot(usgs_sel, dtype, forecast_sel, start_date, end_date, csas_sel,
     if len(csas_sel)>0:
         csas_f_df = pd.DataFrame()
         csas_a_df = pd.DataFrame()
+        csas_df = data["csas"][dtype]
         for site in csas_sel:
-            if offline:
-                csas_df = screen_csas(site,start_date,end_date,dtype)
-            else:
-                csas_df = import_csas_live(site,start_date,end_date,dtype)
-
             if site == "SBSG":
-                csas_f_df[site] = csas_df["flow"]
+                csas_f_df[site] = csas_df["flow", site]
             elif site != "PTSP":
-                csas_a_df[site] = csas_df["albedo"]
+                csas_a_df[site] = csas_df["albedo", site]
 
         csas_max = np.nanmax([csas_f_df.max().max(),csas_a_df.max().max()])
     else:
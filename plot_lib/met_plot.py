@@ -18,20 +18,16 @@ import time
 from database import snotel_sites
 from database import csas_gages
 
-from plot_lib.utils import import_snotel,import_csas_live
-from plot_lib.utils import screen_spatial,ba_stats_std,screen_csas,screen_snotel
 from plot_lib.utils import ba_mean_plot
-from plot_lib.utils import shade_forecast
+from plot_lib.utils import shade_forecast, align_sites
 
-def get_met_plot(basin, elrange, aspects, slopes, start_date,
+def get_met_plot(data, basin, start_date,
                  end_date, snotel_sel, csas_sel, plot_albedo, dtype,
                  forecast_sel,offline=True):
     """
     :description: this function updates the meteorology plot
+    :param data: the data for the selection (from plot_lib.data_store)
     :param basin: the selected basins (checklist)
-    :param elrange: the range of elevations ([min,max])
-    :param aspects: the range of aspects  ([min,max])
-    :param slopes: the range of slopes ([min,max])
     :param start_date: start date (from date selector)
     :param end_date: end date (from date selector)
     :param snotel_sel: list of selected snotel sites ([])
@@ -54,8 +50,8 @@ def get_met_plot(basin, elrange, aspects, slopes, start_date,
     if len(snotel_sel) > 0:
 
         # Process daily temperature and precip, create name list
-        snotel_p_df = pd.DataFrame(index=dates)
-        snotel_t_df = pd.DataFrame(index=dates)
+        snotel_t_df = align_sites(data["snotel"], "TAVG", snotel_sel, dates)
+        snotel_p_df = align_sites(data["snotel"], "PREC", snotel_sel, dates)
         name_df = pd.DataFrame(index=snotel_sel)
 
         for s in snotel_sel:
@@ -63,18 +59,6 @@ def get_met_plot(basin, elrange, aspects, slopes, start_date,
             name_df.loc[s, "name"] = str(snotel_sites.loc[s, "site_no"]) + " " + snotel_sites.loc[
                 s, "name"] + " (" + str(round(snotel_sites.loc[s, "elev_ft"], 0)) + " ft)"
 
-            # Import SNOTEL data
-            if offline:
-                snotel_in = screen_snotel(f"snotel_{s}", start_date, end_date)
-            else:
-                snotel_in = import_snotel(s,snotel_sites,vars=["TAVG", "PREC"])
-
-            # Merge and add to temp and precip df
-            snotel_t_in = snotel_t_df.merge(snotel_in["TAVG"], left_index=True, right_index=True, how="left")
-            snotel_t_df.loc[:, s] = snotel_t_in["TAVG"]
-            snotel_p_in = snotel_p_df.merge(snotel_in["PREC"], left_index=True, right_index=True, how="left")
-            snotel_p_df.loc[:, s] = snotel_p_in["PREC"]
-
         # Calculate maximum values (for plotting axes)
         snotel_t_max = snotel_t_df.max().max()
         snotel_t_min = snotel_t_df.min().min()
@@ -90,16 +74,12 @@ def get_met_plot(basin, elrange, aspects, slopes, start_date,
     csas_t_df = pd.DataFrame()
     csas_a_df = pd.DataFrame()
 
+    csas_df = data["csas"][dtype]
     for site in csas_sel:
-        if offline:
-            csas_df = screen_csas(site, start_date, end_date,dtype)
-        else:
-            csas_df = import_csas_live(site, start_date, end_date,dtype)
-
         if site != "SBSG":
-            csas_t_df[site] = csas_df["temp"]
+            csas_t_df[site] = csas_df["temp", site]
         if (plot_albedo) and (site != "SBSG") and (site != "PTSP"):
-            csas_a_df[site] = csas_df["albedo"]
+            csas_a_df[site] = csas_df["albedo", site]
 
     csas_max = np.nanmax([csas_t_df.max().max(),csas_a_df.max().max()])
 
@@ -127,14 +107,11 @@ def get_met_plot(basin, elrange, aspects, slopes, start_date,
                 if sensor in ["snow","rhm","sky","flow"]:
                     continue
 
-                df = screen_spatial(sensor,start_date,end_date,basin,aspects,elrange,slopes,"Date")
-                if df.empty:
+                # Basin average values
+                ba_ndfd = data["ndfd"].get(sensor)
+                if (ba_ndfd is None) or ba_ndfd.empty:
                     continue
                 else:
-                    # Calculate basin average values
-                    ba_ndfd = ba_stats_std(df, "Date")
-                    ba_ndfd = ba_ndfd.tz_localize(tz="utc")
-
                     #if sensor!="qpf":
                     ba_ndfd = ba_ndfd['mean'].resample(step).mean()
                     #else:
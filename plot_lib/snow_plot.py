@@ -13,24 +13,21 @@ Script for running the snow plot in the dashboard (shread_dash.py)
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
-from plot_lib.utils import import_snotel,import_csas_live
 
 from database import snotel_sites
 from database import csas_gages
-from plot_lib.utils import screen_spatial,ba_stats_all,ba_stats_std,screen_csas,screen_snotel
 from plot_lib.utils import ba_min_plot, ba_max_plot, ba_mean_plot, ba_median_plot
-from plot_lib.utils import shade_forecast
-
-def get_basin_stats(snodas_df,stype="swe"):
-    dates = snodas_df["Date"].unique()
-    last_date = dates.max()
-    snodas_unique = snodas_df[snodas_df["Date"]==last_date]
-    mean_el = round(snodas_unique["elev_ft"].mean(),0)
-    points = len(snodas_unique)
+from plot_lib.utils import shade_forecast, align_sites
+
+def get_basin_stats(ba_snodas,stype="swe"):
+    # Use statistics for the last date (ba_snodas from screen_spatial(..., agg=True))
+    snodas_last = ba_snodas.iloc[-1]
+    mean_el = round(snodas_last["elev_ft"],0)
+    points = int(snodas_last["points"])
     area = round(points * 0.216, 0) # points do not correspond to 1 sq km (0.38 sq mi), they are closer to 0.21 sq mi.
 
     if stype=="swe":
-        mean_ft = snodas_unique["mean"].mean()/12
+        mean_ft = snodas_last["mean"]/12
         vol_af = round(mean_ft*area*640,0)
         stats = (
             f'Volume: ~{vol_af:,.0f} acre-feet | '
@@ -45,16 +42,14 @@ def get_basin_stats(snodas_df,stype="swe"):
 
     return stats
 
-def get_snow_plot(basin, stype, elrange, aspects, slopes, start_date,
-                     end_date, dtype,snotel_sel,csas_sel,forecast_sel,plot_albedo,
+def get_snow_plot(data, basin, stype, start_date,
+                     end_date, snotel_sel,csas_sel,forecast_sel,plot_albedo,
                   offline=True):
     """
     :description: this function updates the snowplot
+    :param data: the data for the selection (from plot_lib.data_store)
     :param basin: the selected basins (checklist)
     :param stype: the snow type (swe/snowdepth)
-    :param elrange: the range of elevations ([min,max])
-    :param aspects: the range of aspects  ([min,max])
-    :param slopes: the range of slopes ([min,max])
     :param start_date: start date (from date selector)
     :param end_date: end date (from date selector)
     :param snotel_sel: list of selected snotel sites ([])
@@ -85,33 +80,24 @@ def get_snow_plot(basin, stype, elrange, aspects, slopes, start_date,
         basin_stats_str = ''
     else:
         snodas_plot = True
-        snodas_df = screen_spatial(
-            stype, start_date, end_date, basin, aspects, elrange, slopes
-        )
-        if snodas_df.empty:
+        # Basin average values
+        ba_snodas = data["snodas"]
+        if ba_snodas.empty:
             snodas_plot = False
             snodas_max = np.nan
             basin_stats_str = 'No valid SHREAD data for given parameters'
         else:
-            # Calculate basin average values
-            ba_snodas = ba_stats_all(snodas_df)
             snodas_max = ba_snodas['95%'].max()
-            basin_stats_str = get_basin_stats(snodas_df,stype)
+            basin_stats_str = get_basin_stats(ba_snodas,stype)
             
     ## Process SNOTEL data (if selected)
 
     # Add data for selected SNOTEL sites
-    snotel_s_df = pd.DataFrame(index=dates)
+    snotel_s_df = align_sites(data["snotel"], slabel, snotel_sel, dates)
     name_df = pd.DataFrame(index=snotel_sel)
     for s in snotel_sel:
         name_df.loc[s, "name"] = str(snotel_sites.loc[s, "site_no"]) + " " + snotel_sites.loc[s, "name"] + " (" + str(
             round(snotel_sites.loc[s, "elev_ft"], 0)) + " ft)"
-        if offline:
-            snotel_in = screen_snotel(f"snotel_{s}", start_date, end_date)
-        else:
-            snotel_in = import_snotel(s,snotel_sites,vars=[slabel])
-        snotel_in = snotel_s_df.merge(snotel_in[slabel], left_index=True, right_index=True, how="left")
-        snotel_s_df.loc[:, s] = snotel_in[slabel]
 
     if len(snotel_sel) == 0:
         snotel_max = np.nan
@@ -120,14 +106,10 @@ def get_snow_plot(basin, stype, elrange, aspects, slopes, start_date,
 
     ## Process CSAS data (if selected)
     csas_a_df = pd.DataFrame()
+    csas_df = data["csas"][dtype]
     for site in csas_sel:
-        if offline:
-            csas_df = screen_csas(site, start_date, end_date,dtype)
-        else:
-            csas_df = import_csas_live(site,start_date,end_date,dtype)
-
         if (plot_albedo) and (site != "SBSG") and (site != "PTSP"):
-            csas_a_df[site] = csas_df["albedo"]
+            csas_a_df[site] = csas_df["albedo", site]
 
     # Process NDFD, if selected
 
@@ -155,14 +137,11 @@ def get_snow_plot(basin, stype, elrange, aspects, slopes, start_date,
                 if sensor in ["qpf","maxt","mint","pop12"]:
                     continue
 
-                df = screen_spatial(sensor,start_date,end_date,basin,aspects,elrange,slopes,"Date")
-                if df.empty:
+                # Basin average values
+                ba_ndfd = data["ndfd"].get(sensor)
+                if (ba_ndfd is None) or ba_ndfd.empty:
                     continue
                 else:
-                    # Calculate basin average values
-                    ba_ndfd = ba_stats_std(df, "Date")
-                    ba_ndfd = ba_ndfd.tz_localize(tz="utc")
-
                     #if sensor!="qpf":
                     ba_ndfd = ba_ndfd['mean'].resample(step).mean()
                     #else:
@@ -7,28 +7,52 @@ Additional utilities used in multiple scripts for shread_dash.py
 @author: buriona,tclarkin
 """
 
+import os
 import time
+import json
+import inspect as pyinspect
+import threading
+from functools import wraps
+from io import StringIO
+from collections import OrderedDict
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
 import dash
-from database import db
+from sqlalchemy import inspect, text
+from database import db, app
+from database.FLOW.rfc_to_db import RFC_META_TABLE
+from database.consolidated_config import CONSOLIDATED_BIND, SITE_COLUMNS_TABLE, get_site_id
+from database.SNOTEL import snotel_to_db
+# fetch_utils is imported by file name, as the retrieval scripts do (database/__init__.py puts database/ on sys.path),
+# so the dashboard's downloads share the scripts' session and host slots
+from fetch_utils import get_text
+from database.db_utils import get_cube_names, get_cube_pct_cols, get_cells
+from database.db_utils import CUBE_CELL_COLS, CUBE_PERCENTILES, CUBE_ROLLUP_ASPECTS
+# Optional Parquet backend of screen_spatial (see database/SHREAD/shread_to_parquet.py)
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as pa_ds
+    from database.SHREAD.shread_to_parquet import DEFAULT_PARQUET_DIR, PARTITION_COL, get_basin_dir
+except ImportError:
+    pa_ds = None
+# Optional DuckDB engine of screen_spatial and ba_stats_all
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
 import datetime as dt
 from datetime import timezone
-from requests import get as r_get
-from requests.exceptions import ReadTimeout
-from io import StringIO
 
 # Function for importing data
 
 def import_snotel(site_triplet,snotel_sites,vars=["WTEQ", "SNWD", "PREC", "TAVG"],verbose=False):
-    """Download NRCS SNOTEL data
+    """Download NRCS SNOTEL data (see database/SNOTEL/snotel_to_db.import_snotel)
 
     Parameters
     ---------
         site_triplet: three part SNOTEL triplet (e.g., 713_CO_SNTL)
         vars: array of variables for import (tested with WTEQ, SNWD, PREC, TAVG..other options may be available)
-        out_dir: str to directory to save .csv...if None, will return df
         verbose: boolean
             True : enable print during function run
 
@@ -37,108 +61,7 @@ def import_snotel(site_triplet,snotel_sites,vars=["WTEQ", "SNWD", "PREC", "TAVG"
         dataframe
 
     """
-    # Convert name to string, replacing spaces with %20
-    name = snotel_sites.loc[snotel_sites.triplet==site_triplet,"name"].item().title().replace(" ", "%20")
-    state = snotel_sites.loc[snotel_sites.triplet==site_triplet,"state"].item()
-
-    # Create dictionary of variables
-    snotel_dict = dict()
-    ext = "DAILY"
-
-    # Cycle through variables
-    for var in vars:
-        if verbose == True:
-            print("Importing {} data".format(var))
-        site_url = f"https://nwcc-apps.sc.egov.usda.gov/awdb/site-plots/POR/{var}/{state}/{name}.csv"
-        print(site_url)
-        if verbose == True:
-            print(site_url)
-        failed = True
-        tries = 0
-        csv_str = ""
-        while failed:
-            try:
-                csv_str = r_get(site_url, timeout=5,verify=True).text
-                failed = False
-            except (ConnectionError, TimeoutError,ReadTimeout,ReadTimeoutError) as error:
-                print(f"{error}")
-                tries += 1
-                if tries <= 10:
-                    print(f"After {tries} tries, retrying...")
-                else:
-                    continue
-
-            if "not found on this server" in csv_str:
-                print("Site URL incorrect.")
-                continue
-
-        csv_io = StringIO(csv_str)
-        f = pd.read_csv(csv_io,index_col=0)
-
-        # Create index of dates for available data for current site
-        df_index = pd.date_range(dt.datetime.strptime(f"{f.index[0]}-{int(f.columns[0])-1}","%m-%d-%Y"),
-                                   dt.datetime.today(),
-                                   freq="D",
-                                   tz='UTC')
-        # Create dataframe of available data (includes Feb 29)
-        snotel_in = pd.DataFrame(index=df_index)
-
-        # Concatenate the cleaned data to the date index
-        for year in f.columns:
-            try:
-                int(year)
-            except ValueError:
-                continue
-            # Remove missing columns...
-            year_data = f.loc[:,year].dropna()
-
-            # Fix index (will no longer include Feb 29 when missing)
-            year_index = list()
-            for i in year_data.index:
-                if int(i[:2])>=10:
-                    year_index.append(dt.datetime.strptime(f"{i}-{int(year)-1}","%m-%d-%Y"))
-                else:
-                    year_index.append(dt.datetime.strptime(f"{i}-{int(year)}", "%m-%d-%Y"))
-
-            year_data.index = pd.DatetimeIndex(year_index,tz="utc")
-
-            # Set appropriate rows in snotel_in
-            snotel_in.loc[year_data.index,var] = year_data
-
-
-        # For precip, calculate incremental precip and remove negative values
-        if var == "PREC":
-            if verbose == True:
-                print("Calculating incremental Precip.")
-            snotel_in["PREC"] = snotel_in[var] - snotel_in[var].shift(1)
-            snotel_in.loc[snotel_in["PREC"] < 0, "PREC"] = 0
-
-        # Add to dict
-        snotel_dict[var] = snotel_in
-
-    if verbose == True:
-        print("Checking dates")
-    begin = end = pd.to_datetime(dt.datetime.now()).tz_localize("UTC")
-    for key in snotel_dict.keys():
-        if snotel_dict[key].index.min() < begin:
-            begin = snotel_dict[key].index.min()
-        if snotel_dict[key].index.max() > end:
-            end = snotel_dict[key].index.max()
-
-    dates = pd.date_range(begin,end,freq="D",tz='UTC')
-    data = pd.DataFrame(index=dates)
-    data["site"] = site_triplet
-
-    if verbose == True:
-        print("Preparing output")
-    for key in snotel_dict.keys():
-        # Merge to output dataframe
-        snotel_in = data.merge(snotel_dict[key][key], left_index=True, right_index=True, how="left")
-        data[key] = snotel_in[key]
-        if verbose == True:
-            print("Added to dataframe")
-
-    return (data)
+    return snotel_to_db.import_snotel(site_triplet, snotel_sites, vars=vars, out_dir=None, verbose=verbose)
 
 
 def compose_date(years, months=1, days=1, weeks=None, hours=None, minutes=None,
@@ -189,10 +112,7 @@ def import_csas_live(site, start_date, end_date,dtype="dv",verbose=False):
     site_url = f"https://www.snowstudies.org/{site}-full-{ext}/"
 
     # Import
-    failed = True
-    tries = 0
-    df_in = None
-    f = pd.read_html(site_url)
+    f = pd.read_html(StringIO(get_text(site_url)))
 
     csas_in = f[0]
 
@@ -253,35 +173,745 @@ def import_csas_live(site, start_date, end_date,dtype="dv",verbose=False):
 
     return(csas_out)
 
+# Percentiles reported for basin statistics (see ba_stats_all)
+BA_PERCENTILES = [0.05, 0.5, 0.95]
+
+# Tables of each bind, filled as the screen_* functions are called, and the stamp (get_db_stamp) of the db file when
+# its tables were read
+_bind_tables = dict()
+_bind_stamps = dict()
+
+def get_engine(bind):
+    """
+    Returns the engine for bind. When the db has been rebuilt (get_db_stamp) the engine's pooled connections are
+    dropped (db_engines.ENGINE_OPTIONS), so no connection keeps the pages or memory map of the old data, and the table
+    names of check_table are refreshed. So are they on the first call for bind: connections opened at start up may be
+    of a db file replaced since.
+    """
+    engine = db.get_engine(bind=bind)
+    stamp = get_db_stamp(bind)
+    if _bind_stamps.get(bind) != stamp:
+        engine.dispose()
+        _bind_tables.pop(bind, None)
+        _bind_stamps[bind] = stamp
+    return engine
+
+def check_table(bind, tbl_name):
+    """
+    Returns tbl_name if it is a table in the db for bind, otherwise raises a ValueError. Table names can't be bound
+    parameters, so this guards the names formatted into the screen_* queries.
+    """
+    # get_engine drops the table names of a rebuilt db, which may have dropped tables
+    engine = get_engine(bind)
+    tables = _bind_tables.get(bind)
+    if (tables is None) or (tbl_name not in tables):
+        # Rebuilt dbs may have new tables, so refresh before giving up
+        tables = set(inspect(engine).get_table_names())
+        _bind_tables[bind] = tables
+    if tbl_name not in tables:
+        raise ValueError(f"{tbl_name} is not a table in the {bind} db")
+    return tbl_name
+
+def read_bind(bind, qry, params, parse_dates=None):
+    """
+    Run qry (with :params) on bind and return a dataframe. The values are bound, so the SQL of a query is the same on
+    every call and the pooled connections (db_engines.ENGINE_OPTIONS) reuse its prepared statement. No statements are
+    cached here: SQLAlchemy's compiled cache and sqlite3's statement cache of each connection already key on the SQL.
+    """
+    return pd.read_sql(text(qry), get_engine(bind), params=params, parse_dates=parse_dates)
+
+# Results of the screen_* functions, cached per call (see cache_result). Size and time to live (seconds) can be set
+# with the SHREAD_CACHE_SIZE and SHREAD_CACHE_TTL environment variables.
+CACHE_SIZE = int(os.environ.get("SHREAD_CACHE_SIZE", 256))
+CACHE_TTL = float(os.environ.get("SHREAD_CACHE_TTL", 3600))
+
+_cache = OrderedDict()
+_cache_stats = dict()
+_cache_lock = threading.Lock()
+
+# The db files are checked for a rebuild (get_db_stamp) at most once every STAMP_INTERVAL seconds per bind, so the
+# queries of a callback share one check; set with the SHREAD_STAMP_INTERVAL environment variable (0 checks on every
+# call)
+STAMP_INTERVAL = float(os.environ.get("SHREAD_STAMP_INTERVAL", 2))
+
+# Last stamp of each bind, as {bind: (time checked, stamp)}
+_db_stamps = dict()
+
+def get_db_stamp(bind):
+    """
+    Stamp of the db file for bind (see stat_db), checked again once STAMP_INTERVAL seconds have passed since the last
+    check
+    """
+    now = time.monotonic()
+    checked = _db_stamps.get(bind)
+    if (checked is not None) and (now - checked[0] < STAMP_INTERVAL):
+        return checked[1]
+    stamp = stat_db(bind)
+    _db_stamps[bind] = (now, stamp)
+    return stamp
+
+def stat_db(bind):
+    """
+    Inode, modified time and size of the db file for bind, which change when the db is rebuilt
+    (database_update_full.bat). A live db in WAL mode (from an earlier build) may have a rebuild still in the -wal
+    file: while it has data, the latest modified time and the total size of the two files are used.
+    """
+    db_path = db.get_engine(bind=bind).url.database
+    try:
+        db_stat = os.stat(db_path)
+    except (OSError, TypeError):
+        return None
+    try:
+        wal_stat = os.stat(f"{db_path}-wal")
+    except OSError:
+        wal_stat = None
+    if (wal_stat is None) or (wal_stat.st_size == 0):
+        return (db_stat.st_ino, db_stat.st_mtime_ns, db_stat.st_size)
+    return (
+        db_stat.st_ino, max(db_stat.st_mtime_ns, wal_stat.st_mtime_ns), db_stat.st_size + wal_stat.st_size
+    )
+
+def copy_result(result):
+    """
+    Copy of a cached result, so callers can't modify the cached dataframes
+    """
+    if isinstance(result, tuple):
+        return tuple(copy_result(r) for r in result)
+    if isinstance(result, pd.DataFrame):
+        return result.copy()
+    return result
+
+def cache_result(bind_fmt):
+    """
+    Decorator caching the results of a screen_* function (LRU, CACHE_SIZE entries, CACHE_TTL seconds). Entries are
+    dropped when the db file of the bind changes; bind_fmt is formatted with the function arguments to get the bind.
+    """
+    def decorator(func):
+        sig = pyinspect.signature(func)
+        _cache_stats[func.__name__] = {"hits": 0, "misses": 0}
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            call_args = sig.bind(*args, **kwargs)
+            call_args.apply_defaults()
+            bind = bind_fmt.format(**call_args.arguments)
+            key = (func.__name__, json.dumps(call_args.arguments, sort_keys=True, default=str))
+            stamp = get_db_stamp(bind)
+            stats = _cache_stats[func.__name__]
+            now = time.monotonic()
+            with _cache_lock:
+                entry = _cache.get(key)
+                if (entry is not None) and (entry[0] == stamp) and (now - entry[1] < CACHE_TTL):
+                    _cache.move_to_end(key)
+                    stats["hits"] += 1
+                    return copy_result(entry[2])
+                stats["misses"] += 1
+
+            result = func(*args, **kwargs)
+            if CACHE_SIZE > 0:
+                with _cache_lock:
+                    _cache[key] = (stamp, now, result)
+                    _cache.move_to_end(key)
+                    while len(_cache) > CACHE_SIZE:
+                        _cache.popitem(last=False)
+            return copy_result(result)
+
+        return wrapper
+    return decorator
+
+def cache_info():
+    """
+    Hit and miss counters of the screen_* result cache, per function and in total
+    """
+    with _cache_lock:
+        info = {name: dict(stats) for name, stats in _cache_stats.items()}
+        info["total"] = {
+            "hits": sum(stats["hits"] for stats in _cache_stats.values()),
+            "misses": sum(stats["misses"] for stats in _cache_stats.values()),
+            "size": len(_cache),
+            "maxsize": CACHE_SIZE,
+            "ttl": CACHE_TTL,
+        }
+    return info
+
+def clear_cache():
+    """
+    Empty the screen_* result cache (counters are kept)
+    """
+    with _cache_lock:
+        _cache.clear()
+
+def use_consolidated(bind):
+    """
+    Returns True if the site tables of bind are read from the consolidated db (database/consolidated_to_db.py): it
+    was there when the dashboard started, has a table for bind and is newer than the db of bind
+    """
+    if CONSOLIDATED_BIND not in app.server.config['SQLALCHEMY_BINDS']:
+        return False
+    try:
+        check_table(CONSOLIDATED_BIND, bind)
+    except ValueError:
+        return False
+    stamp = get_db_stamp(CONSOLIDATED_BIND)
+    site_stamp = get_db_stamp(bind)
+    return (stamp is not None) and ((site_stamp is None) or (stamp[1] >= site_stamp[1]))
+
+@cache_result(CONSOLIDATED_BIND)
+def get_site_columns(bind, site_id):
+    """
+    Columns of the site table of site_id in the consolidated db, or None if the site isn't in it
+    """
+    qry = f"select columns from {SITE_COLUMNS_TABLE} where family = :family and site_id = :site_id"
+    cols_df = read_bind(CONSOLIDATED_BIND, qry, {"family": bind, "site_id": site_id})
+    if cols_df.empty:
+        return None
+    return json.loads(cols_df["columns"].iloc[0])
+
+def read_site(bind, tbl_name, where_qry, params):
+    """
+    Read the rows of a site table matching where_qry (with :params) as a dataframe. The rows come from the
+    consolidated db when it is used for bind (use_consolidated) and has the site, otherwise from tbl_name in the db
+    of bind; either way with the columns of the site table.
+    """
+    if use_consolidated(bind):
+        site_id = get_site_id(bind, tbl_name)
+        cols = get_site_columns(bind, site_id)
+        if cols is not None:
+            col_str = ", ".join(f'"{c}"' for c in cols)
+            qry = f'select {col_str} from "{bind}" where site_id = :site_id and {where_qry}'
+            return read_bind(CONSOLIDATED_BIND, qry, dict(params, site_id=site_id), parse_dates=['date'])
+    tbl_name = check_table(bind, tbl_name)
+    return read_bind(bind, f'select * from "{tbl_name}" where {where_qry}', params, parse_dates=['date'])
+
+def read_sites(bind, tbl_names, where_qry, params):
+    """
+    read_site for several site tables of bind, as a dict of dataframes by table name (empty for a site without a
+    table). The sites in the consolidated db are read with one query (site_id in ...), the rest one table at a time.
+    """
+    site_dfs = dict()
+    if use_consolidated(bind):
+        site_ids = {tbl_name: get_site_id(bind, tbl_name) for tbl_name in tbl_names}
+        site_cols = {tbl_name: get_site_columns(bind, site_ids[tbl_name]) for tbl_name in tbl_names}
+        found = [tbl_name for tbl_name in tbl_names if site_cols[tbl_name] is not None]
+        if found:
+            site_params = {f"site_{i}": site_ids[tbl_name] for i, tbl_name in enumerate(found)}
+            in_str = ", ".join(f":{p}" for p in site_params)
+            qry = f'select * from "{bind}" where site_id in ({in_str}) and {where_qry}'
+            all_df = read_bind(CONSOLIDATED_BIND, qry, dict(params, **site_params), parse_dates=['date'])
+            groups = dict(list(all_df.groupby("site_id", sort=False)))
+            for tbl_name in found:
+                site_df = groups.get(site_ids[tbl_name], all_df.iloc[:0])
+                site_dfs[tbl_name] = site_df[site_cols[tbl_name]].reset_index(drop=True)
+    for tbl_name in tbl_names:
+        if tbl_name not in site_dfs:
+            try:
+                site_dfs[tbl_name] = read_site(bind, tbl_name, where_qry, params)
+            except ValueError:
+                # A site without a table (e.g. not downloaded yet) has no data, rather than failing the others
+                site_dfs[tbl_name] = pd.DataFrame(columns=["date"])
+    return site_dfs
+
+def index_by_date(out_df):
+    """
+    Index a site dataframe on its (UTC) date column
+    """
+    out_df.index = pd.to_datetime(out_df['date'], utc=True)
+    out_df.index.name = None
+    return out_df
+
+def sites_to_wide(site_dfs, sites, variables=None):
+    """
+    Combine date indexed site dataframes (dict by site) into one wide frame on the union of their dates, with a
+    (variable, site) column for every variable (all of them, or variables) and site (all NaN where a site has no such
+    data)
+    """
+    frames = dict()
+    for s, df in site_dfs.items():
+        df = df[~df.index.duplicated(keep="last")]
+        if variables is None:
+            frames[s] = df.drop(columns="date", errors="ignore")
+        else:
+            frames[s] = df[[v for v in variables if v in df.columns]]
+    if frames:
+        wide_df = pd.concat(frames, axis=1).swaplevel(axis=1).sort_index()
+    else:
+        wide_df = pd.DataFrame(index=pd.DatetimeIndex([], tz="UTC"))
+    if variables is None:
+        variables = list(dict.fromkeys(v for df in frames.values() for v in df.columns))
+    return wide_df.reindex(columns=pd.MultiIndex.from_product([list(variables), list(sites)]))
+
+def align_sites(site_data, var, sites, dates=None):
+    """
+    Frame of variable var with a column per site, reindexed once to the date axis dates (or on the dates of the data
+    with dates=None). site_data is a wide frame (sites_to_wide) or a dict of date indexed site dataframes; sites
+    without var are all NaN.
+    """
+    if isinstance(site_data, dict):
+        site_data = sites_to_wide(site_data, sites, [var])
+    var_df = site_data.reindex(columns=pd.MultiIndex.from_product([[var], list(sites)]))
+    var_df.columns = var_df.columns.droplevel(0)
+    if dates is not None:
+        var_df = var_df.reindex(dates)
+    return var_df
+
+# Backend screen_spatial reads SHREAD data from: "sqlite" (the dbs) or "parquet" (the files written by
+# database/SHREAD/shread_to_parquet.py, in SHREAD_PARQUET_DIR), set with the SHREAD_SPATIAL_BACKEND environment
+# variable. Basins without (current) Parquet files are read from the dbs.
+SPATIAL_BACKEND = os.environ.get("SHREAD_SPATIAL_BACKEND", "sqlite")
+PARQUET_DIR = os.environ.get("SHREAD_PARQUET_DIR", None if pa_ds is None else DEFAULT_PARQUET_DIR)
+# Columns read from the Parquet files for basin statistics
+PARQUET_STATS_COLS = ["Date", "elev_ft", "slope_d", "aspct", "mean"]
+
+def use_parquet(bind, basin):
+    """
+    Returns the Parquet dataset dir of basin in the db of bind if screen_spatial reads it: SPATIAL_BACKEND is
+    "parquet", pyarrow is installed and the dataset is newer than the db. Otherwise returns None.
+    """
+    if (SPATIAL_BACKEND != "parquet") or (pa_ds is None):
+        return None
+    basin_dir = get_basin_dir(PARQUET_DIR, bind, basin)
+    try:
+        parquet_mtime = os.stat(basin_dir).st_mtime_ns
+    except OSError:
+        return None
+    stamp = get_db_stamp(bind)
+    if (stamp is not None) and (parquet_mtime < stamp[1]):
+        return None
+    return basin_dir
+
+def get_date_bounds(s_date, e_date):
+    """
+    Start and end of a screen_spatial date range as timestamps, and whether the end is included: the same dates as
+    the text comparison of the SQLite query, where an end date without a time excludes that day
+    """
+    e_str = str(e_date)
+    return pd.Timestamp(str(s_date)), pd.Timestamp(e_str), len(e_str) > 10
+
+def screen_spatial_parquet(basin_dir, s_date, e_date, aspects=[0, 360], elrange=[0, 20000], slopes=[0, 100],
+                           date_col="Date", agg=False, percentiles=True):
+    """
+    screen_spatial from the Parquet dataset of a basin: the filters are pushed down to the scan, so only the months
+    in the date range are opened and row groups outside the filters (column statistics) are skipped. With agg=True
+    only PARQUET_STATS_COLS are read and the statistics are computed with pandas (as screen_spatial_stats).
+    """
+    s_date, e_date, e_incl = get_date_bounds(s_date, e_date)
+    date = pa_ds.field(date_col)
+    month = pa_ds.field(PARTITION_COL)
+    expr = (
+        (month >= s_date.strftime("%Y-%m")) & (month <= e_date.strftime("%Y-%m"))
+        & (date >= s_date) & ((date <= e_date) if e_incl else (date < e_date))
+        & (pa_ds.field("slope_d") >= slopes[0]) & (pa_ds.field("slope_d") <= slopes[1])
+        & (pa_ds.field("elev_ft") >= elrange[0]) & (pa_ds.field("elev_ft") <= elrange[1])
+    )
+    aspct = pa_ds.field("aspct")
+    if aspects[0] < 0:
+        expr = expr & ((aspct >= 360 + aspects[0]) | (aspct <= aspects[1]))
+    else:
+        expr = expr & (aspct >= aspects[0]) & (aspct <= aspects[1])
+
+    dataset = pa_ds.dataset(
+        basin_dir, format="parquet",
+        partitioning=pa_ds.partitioning(pa.schema([(PARTITION_COL, pa.string())]), flavor="hive")
+    )
+    if agg:
+        cols = PARQUET_STATS_COLS
+    else:
+        cols = [c for c in dataset.schema.names if c != PARTITION_COL]
+    out_df = dataset.to_table(columns=cols, filter=expr).to_pandas()
+
+    if agg:
+        grouped = out_df.groupby(date_col, sort=True)
+        ba_df = grouped["mean"].agg(["count", "mean", "std", "min"])
+        if percentiles:
+            pct_df = grouped["mean"].quantile(BA_PERCENTILES).unstack().reindex(columns=BA_PERCENTILES)
+            for p in BA_PERCENTILES:
+                ba_df[f"{p:.0%}"] = pct_df[p]
+        ba_df["max"] = grouped["mean"].max()
+        ba_df["elev_ft"] = grouped["elev_ft"].mean()
+        ba_df["points"] = grouped.size()
+        out_df = ba_df
+    else:
+        out_df.index = out_df[date_col]
+    out_df.index = pd.to_datetime(out_df.index, utc=True)
+    out_df.index.name = None
+    return out_df
+
+# Engine screen_spatial and ba_stats_all run on: "sqlite" (SQLite, or pyarrow and pandas for Parquet files) or
+# "duckdb" (an embedded DuckDB, multi-threaded, on the Parquet files or on the dbs through the DuckDB sqlite extension),
+# set with the SHREAD_SPATIAL_ENGINE environment variable, and the DuckDB threads with SHREAD_DUCKDB_THREADS. Sources
+# DuckDB can't read (e.g. the sqlite extension isn't installed) use the "sqlite" engine. Extensions aren't downloaded
+# by the dashboard: install the sqlite extension with the environment (see README.txt).
+SPATIAL_ENGINE = os.environ.get("SHREAD_SPATIAL_ENGINE", "sqlite")
+DUCKDB_THREADS = int(os.environ.get("SHREAD_DUCKDB_THREADS", os.cpu_count() or 1))
+
+# Embedded DuckDB (and whether its sqlite extension loaded) and the binds attached to it, as
+# {bind: (db stamp, schema name or None if it can't be attached)}
+_duckdb = dict()
+_duckdb_attached = dict()
+_duckdb_lock = threading.Lock()
+
+def use_duckdb():
+    """
+    Returns True if screen_spatial and ba_stats_all run on DuckDB (SPATIAL_ENGINE is "duckdb" and it is installed)
+    """
+    return (SPATIAL_ENGINE == "duckdb") and (duckdb is not None)
+
+def get_duckdb():
+    """
+    Returns a cursor (connection) of the embedded DuckDB, an in-memory db shared by the dashboard threads
+    """
+    with _duckdb_lock:
+        if "con" not in _duckdb:
+            _duckdb["con"] = duckdb.connect(
+                config={"threads": DUCKDB_THREADS, "autoinstall_known_extensions": False}
+            )
+        return _duckdb["con"].cursor()
+
+def load_duckdb_sqlite(con):
+    """
+    Load the DuckDB sqlite extension (installed ahead of time, it isn't downloaded) once, and return True if it's
+    loaded. If it can't be, a warning is printed and the dbs are read with SQLite.
+    """
+    if "sqlite" not in _duckdb:
+        try:
+            con.execute("load sqlite")
+            _duckdb["sqlite"] = True
+        except duckdb.Error as e:
+            print(f"Warning: DuckDB sqlite extension not installed, reading the dbs with SQLite - {e}")
+            _duckdb["sqlite"] = False
+    return _duckdb["sqlite"]
+
+def attach_duckdb(bind):
+    """
+    Attach the db of bind to the embedded DuckDB (read-only, with the sqlite extension) and return its schema name,
+    or None if it can't be attached. The db is attached again when it is rebuilt (get_db_stamp).
+    """
+    stamp = get_db_stamp(bind)
+    if stamp is None:
+        return None
+    con = get_duckdb()
+    try:
+        with _duckdb_lock:
+            if not load_duckdb_sqlite(con):
+                return None
+            old_stamp, schema = _duckdb_attached.get(bind, (None, None))
+            if old_stamp == stamp:
+                return schema
+            try:
+                if schema is not None:
+                    con.execute(f'detach "{schema}"')
+                db_path = get_engine(bind).url.database
+                con.execute(f"attach '{db_path}' as \"{bind}\" (type sqlite, read_only)")
+                schema = bind
+            except duckdb.Error as e:
+                print(f"DuckDB can't read the {bind} db, using SQLite - {e}")
+                schema = None
+            _duckdb_attached[bind] = (stamp, schema)
+    finally:
+        con.close()
+    return schema
+
+def get_duckdb_stats_qry(from_qry, date_col="Date", percentiles=True, points=True):
+    """
+    DuckDB query of the per date basin statistics of screen_spatial_stats (points=True) or ba_stats_all
+    (points=False) for the rows of from_qry
+    """
+    pct_str = ", ".join(str(p) for p in BA_PERCENTILES)
+    stats_qry = (
+        f'select "{date_col}" as "{date_col}", count(mean) as "count", avg(mean) as "mean", '
+        f'stddev_samp(mean) as "std", min(mean) as "min", '
+        f'{f"quantile_cont(mean, [{pct_str}]) as pct, " if percentiles else ""}'
+        f'max(mean) as "max"{", avg(elev_ft) as elev_ft, count(*) as points" if points else ""} '
+        f'{from_qry}group by "{date_col}"'
+    )
+    cols = ['"count"', '"mean"', '"std"', '"min"']
+    if percentiles:
+        cols += [f'pct[{i + 1}] as "{p:.0%}"' for i, p in enumerate(BA_PERCENTILES)]
+    cols += ['"max"'] + (["elev_ft", "points"] if points else [])
+    return f'select "{date_col}", {", ".join(cols)} from ({stats_qry}) order by "{date_col}"'
+
+def screen_spatial_duckdb(bind, basin, basin_dir, s_date, e_date, aspects=[0, 360], elrange=[0, 20000],
+                          slopes=[0, 100], date_col="Date", agg=False, percentiles=True):
+    """
+    screen_spatial on DuckDB, from the Parquet dataset in basin_dir (see use_parquet) or else from the db of bind.
+    From the db only the statistics (agg=True) are computed: the rows are selected in SQLite (sqlite_query, using the
+    (date, point) index) and aggregated in DuckDB. Returns None if the query should run on SQLite instead.
+    """
+    s_date, e_date, e_incl = get_date_bounds(s_date, e_date)
+    if aspects[0] < 0:
+        aspect_qry = f"and (aspct >= {360 + float(aspects[0])} or aspct <= {float(aspects[1])}) "
+    else:
+        aspect_qry = f"and aspct >= {float(aspects[0])} and aspct <= {float(aspects[1])} "
+    where_qry = (
+        f'"{date_col}" >= \'{s_date:%Y-%m-%d %H:%M:%S}\' '
+        f'and "{date_col}" {"<=" if e_incl else "<"} \'{e_date:%Y-%m-%d %H:%M:%S}\' '
+        f"and slope_d >= {float(slopes[0])} "
+        f"and slope_d <= {float(slopes[1])} "
+        f"and elev_ft >= {float(elrange[0])} "
+        f"and elev_ft <= {float(elrange[1])} "
+        f"{aspect_qry}"
+    )
+    if basin_dir is not None:
+        from_qry = (
+            f"from read_parquet('{basin_dir.as_posix()}/*/*.parquet', hive_partitioning = true, "
+            f"hive_types = {{'{PARTITION_COL}': varchar}}) where "
+            f"{PARTITION_COL} >= '{s_date:%Y-%m}' and {PARTITION_COL} <= '{e_date:%Y-%m}' and {where_qry}"
+        )
+    elif agg:
+        schema = attach_duckdb(bind)
+        if schema is None:
+            return None
+        points = check_table(bind, f"{basin}_points")
+        # sqlite_query returns text, so the columns are cast back
+        sqlite_qry = (
+            f'select f."{date_col}", f.mean, p.elev_ft from "{basin}" f join "{points}" p on p.OBJECTID = f.OBJECTID '
+            f'where {where_qry}'
+        ).replace("'", "''")
+        from_qry = (
+            f'from (select cast("{date_col}" as timestamp) as "{date_col}", cast(mean as double) as mean, '
+            f"cast(elev_ft as double) as elev_ft from sqlite_query('{schema}', '{sqlite_qry}')) "
+        )
+    else:
+        return None
+
+    if agg:
+        qry = get_duckdb_stats_qry(from_qry, date_col, percentiles)
+    else:
+        qry = f"select * exclude ({PARTITION_COL}) {from_qry}"
+    con = get_duckdb()
+    try:
+        out_df = con.execute(qry).df()
+    finally:
+        con.close()
+
+    out_df.index = pd.to_datetime(out_df[date_col], utc=True).astype("datetime64[ns, UTC]")
+    out_df.index.name = None
+    if agg:
+        out_df = out_df.drop(columns=date_col)
+    return out_df
+
+# Basin statistics of screen_spatial(agg=True) are read from the cube of the basin table (db_utils.write_cube), when
+# it has one and the filters select whole cells; set SHREAD_SPATIAL_CUBE=0 to always compute them from the points
+USE_CUBE = os.environ.get("SHREAD_SPATIAL_CUBE", "1") != "0"
+
+@cache_result("{bind}")
+def get_basin_cells(bind, basin):
+    """
+    Point attributes (elev_ft, slope_d and aspct) of a basin and the cube cell of each point
+    """
+    points = check_table(bind, f"{basin}_points")
+    df_points = read_bind(bind, f'select elev_ft, slope_d, aspct from "{points}"', {}).dropna()
+    return df_points.join(get_cells(df_points))
+
+def get_cube_cells(bind, basin, aspects=[0, 360], elrange=[0, 20000], slopes=[0, 100]):
+    """
+    Cube cells selected by the screen_spatial filters of a basin, as {cell column: selected values}, or None if a
+    filter splits the points of an elevation band, aspect octant or slope class
+    """
+    df_cells = get_basin_cells(bind, basin)
+    aspct = df_cells["aspct"]
+    if aspects[0] < 0:
+        aspct_in = (aspct >= 360 + aspects[0]) | (aspct <= aspects[1])
+    else:
+        aspct_in = (aspct >= aspects[0]) & (aspct <= aspects[1])
+    masks = {
+        "elev_band": df_cells["elev_ft"].between(elrange[0], elrange[1]),
+        "aspct_oct": aspct_in,
+        "slope_cls": df_cells["slope_d"].between(slopes[0], slopes[1]),
+    }
+    cells = dict()
+    for col, mask in masks.items():
+        cell_in = mask.groupby(df_cells[col]).agg(["any", "all"])
+        if (cell_in["any"] != cell_in["all"]).any():
+            return None
+        cells[col] = [int(c) for c in cell_in.index[cell_in["all"]]]
+    return cells
+
+def screen_spatial_cube(bind, basin, s_date, e_date, aspects=[0, 360], elrange=[0, 20000], slopes=[0, 100],
+                        date_col="Date", percentiles=True):
+    """
+    screen_spatial(agg=True) from the cube of a basin table: the statistics of the selected cells are added up per
+    date in SQLite, or read from the rollup of the points above an elevation band when the filters select those.
+    Percentiles don't add up, so with percentiles=True only filters on elevation (from a band up) with all slopes and
+    the CUBE_ROLLUP_ASPECTS are answered. Returns None if the basin has no cube or the filters don't select whole cells.
+    """
+    cube_name, rollup_name = get_cube_names(basin)
+    try:
+        check_table(bind, cube_name)
+        check_table(bind, rollup_name)
+    except ValueError:
+        return None
+    cells = get_cube_cells(bind, basin, aspects, elrange, slopes)
+    if (cells is None) or not all(cells.values()):
+        return None
+    params = {"s_date": str(s_date), "e_date": str(e_date)}
+    where_qry = f"where `{date_col}` >= :s_date and `{date_col}` <= :e_date "
+
+    # The rollup holds the points above an elevation band (all slopes, CUBE_ROLLUP_ASPECTS)
+    df_cells = get_basin_cells(bind, basin)
+    elev_lo = min(cells["elev_band"])
+    aspct_lo, aspct_hi = CUBE_ROLLUP_ASPECTS
+    rollup_cells = {
+        "elev_band": [c for c in df_cells["elev_band"].unique() if c >= elev_lo],
+        "aspct_oct": [c for c in df_cells["aspct_oct"].unique() if aspct_lo <= c <= aspct_hi],
+        "slope_cls": df_cells["slope_cls"].unique(),
+    }
+    in_rollup = all(set(cells[col]) == set(int(c) for c in rollup_cells[col]) for col in CUBE_CELL_COLS)
+    if percentiles and not (in_rollup and (CUBE_PERCENTILES == BA_PERCENTILES)):
+        return None
+
+    cols = ["count", "mean", "std", "min"]
+    if percentiles:
+        cols += [f"{p:.0%}" for p in BA_PERCENTILES]
+    cols += ["max", "elev_ft", "points"]
+    if in_rollup:
+        params["elev_lo"] = elev_lo
+        qry = f'select * from "{rollup_name}" {where_qry}and elev_lo = :elev_lo order by `{date_col}`'
+        ba_df = read_bind(bind, qry, params)
+        ba_df = ba_df.rename(columns=dict(zip(get_cube_pct_cols(), [f"{p:.0%}" for p in BA_PERCENTILES])))
+    else:
+        cell_qry = " ".join(
+            f"and {col} in ({', '.join(str(c) for c in cells[col])})" for col in CUBE_CELL_COLS
+        )
+        qry = (
+            f"select `{date_col}`, sum(count) as count, sum(sum) as sum, sum(sumsq) as sumsq, min(min) as min, "
+            f"max(max) as max, sum(elev_sum) as elev_sum, sum(points) as points "
+            f'from "{cube_name}" {where_qry}{cell_qry} group by `{date_col}` order by `{date_col}`'
+        )
+        ba_df = read_bind(bind, qry, params)
+        ba_df["mean"] = ba_df["sum"] / ba_df["count"].where(ba_df["count"] > 0)
+        # Sample standard deviation from sum of squares (as screen_spatial_stats)
+        ss = ba_df["sumsq"] - ba_df["count"] * ba_df["mean"] ** 2
+        ba_df["std"] = np.sqrt(ss.clip(lower=0) / (ba_df["count"] - 1).where(ba_df["count"] > 1))
+        ba_df["elev_ft"] = ba_df["elev_sum"] / ba_df["points"]
+
+    ba_df.index = pd.to_datetime(ba_df[date_col], utc=True)
+    ba_df.index.name = None
+    return ba_df[cols]
+
 # Function to screen data by basin, aspect, elevation and slopes (using points)
+@cache_result("{db_type}")
 def screen_spatial(db_type, s_date, e_date, basin, aspects=[0, 360],
-                  elrange=[0, 20000], slopes=[0, 100],date_col="Date"):
-
+                  elrange=[0, 20000], slopes=[0, 100],date_col="Date",
+                  agg=False, percentiles=True):
+    """
+    Returns the points in basin matching the date, aspect, elevation and slope filters. With agg=True the basin
+    statistics are computed in SQLite instead and one row per date is returned (count, mean, std, min, max, mean
+    elev_ft and number of points, plus the BA_PERCENTILES when percentiles=True), matching ba_stats_all(df).
+
+    Point attributes are stored once per basin in {basin}_points, so the aspect, elevation and slope filters are
+    resolved against that table first and only the matching points are read from the basin table. Basins with
+    Parquet files are read from those instead when configured (see use_parquet), and the queries run on DuckDB
+    when configured (see use_duckdb). Statistics for filters that select whole cells of the basin's cube are read
+    from the cube (see screen_spatial_cube).
+    """
     bind = db_type
-    qry = (
-        f"select * from {basin} where "
-        f"`{date_col}` >= '{s_date}' "
-        f"and `{date_col}` <= '{e_date}' "
-        f"and slope_d >= {slopes[0]} "
-        f"and slope_d <= {slopes[1]} "
-        f"and elev_ft >= {elrange[0]} "
-        f"and elev_ft <= {elrange[1]} "
-    )
-    input_df = pd.read_sql(qry, db.get_engine(bind=bind), parse_dates=['Date'])
+    basin = check_table(bind, basin)
+    if agg and USE_CUBE:
+        out_df = screen_spatial_cube(bind, basin, s_date, e_date, aspects, elrange, slopes, date_col, percentiles)
+        if out_df is not None:
+            return out_df
+    basin_dir = use_parquet(bind, basin)
+    if use_duckdb():
+        out_df = screen_spatial_duckdb(
+            bind, basin, basin_dir, s_date, e_date, aspects, elrange, slopes, date_col, agg, percentiles
+        )
+        if out_df is not None:
+            return out_df
+    if basin_dir is not None:
+        return screen_spatial_parquet(
+            basin_dir, s_date, e_date, aspects, elrange, slopes, date_col, agg, percentiles
+        )
+    points = check_table(bind, f"{basin}_points")
+    params = {
+        "s_date": str(s_date),
+        "e_date": str(e_date),
+        "slope_lo": slopes[0],
+        "slope_hi": slopes[1],
+        "elev_lo": elrange[0],
+        "elev_hi": elrange[1],
+        "aspct_hi": aspects[1],
+    }
     if aspects[0] < 0:
-        minaspect = 360 + aspects[0]
-        out_df = input_df[
-            (input_df["aspct"] >= minaspect) | (input_df["aspct"] <= aspects[1])
-        ]
+        params["aspct_lo"] = 360 + aspects[0]
+        aspect_qry = "and (aspct >= :aspct_lo or aspct <= :aspct_hi) "
     else:
-        out_df = input_df[
-            (input_df["aspct"] >= aspects[0]) & (input_df["aspct"] <= aspects[1])
-        ]
+        params["aspct_lo"] = aspects[0]
+        aspect_qry = "and aspct >= :aspct_lo and aspct <= :aspct_hi "
+    from_qry = (
+        f'from "{basin}" f join "{points}" p on p.OBJECTID = f.OBJECTID where '
+        f"f.`{date_col}` >= :s_date "
+        f"and f.`{date_col}` <= :e_date "
+        f"and f.OBJECTID in ("
+        f'select OBJECTID from "{points}" where '
+        f"slope_d >= :slope_lo "
+        f"and slope_d <= :slope_hi "
+        f"and elev_ft >= :elev_lo "
+        f"and elev_ft <= :elev_hi "
+        f"{aspect_qry}) "
+    )
+    if agg:
+        return screen_spatial_stats(bind, from_qry, params, date_col, percentiles)
+
+    qry = f"select f.*, p.elev_ft, p.slope_d, p.aspct, p.nlcd, p.LOCAL_ID, p.LOCAL_NAME {from_qry}"
+    out_df = read_bind(bind, qry, params, parse_dates=['Date'])
     
     out_df.index = pd.to_datetime(out_df['Date'], utc=True)
     out_df.index.name = None
     return (out_df)
 
+def screen_spatial_stats(bind, from_qry, params, date_col="Date", percentiles=True):
+    """
+    Per date basin statistics for the points selected by from_qry, aggregated in SQLite (see screen_spatial)
+    """
+    qry = (
+        f"select f.`{date_col}` as Date, count(f.mean) as count, avg(f.mean) as mean, "
+        f"sum(f.mean*f.mean) as sumsq, min(f.mean) as min, max(f.mean) as max, "
+        f"avg(p.elev_ft) as elev_ft, count(*) as points "
+        f"{from_qry}"
+        f"group by f.`{date_col}` order by f.`{date_col}`"
+    )
+    ba_df = read_bind(bind, qry, params, parse_dates=['Date'])
+    ba_df.index = pd.to_datetime(ba_df['Date'], utc=True)
+    ba_df.index.name = None
+
+    # Sample standard deviation from sum of squares (as in pandas describe)
+    ss = ba_df["sumsq"] - ba_df["count"] * ba_df["mean"] ** 2
+    ba_df["std"] = np.sqrt(ss.clip(lower=0) / (ba_df["count"] - 1).where(ba_df["count"] > 1))
+    cols = ["count", "mean", "std", "min"]
+
+    if percentiles:
+        # Exact percentiles: rank the values for each date in SQLite and only return the (at most two) ranks
+        # needed to interpolate each percentile, as in numpy/pandas (linear interpolation)
+        rank_qry = " or ".join(
+            f"(rn >= cast({p}*(n-1) as integer) and rn <= cast({p}*(n-1) as integer) + 1)"
+            for p in BA_PERCENTILES
+        )
+        qry = (
+            f"with ranked as ("
+            f"select f.`{date_col}` as Date, f.mean, "
+            f"row_number() over (partition by f.`{date_col}` order by f.mean) - 1 as rn, "
+            f"count(*) over (partition by f.`{date_col}`) as n "
+            f"{from_qry}and f.mean is not null) "
+            f"select Date, rn, n, mean from ranked where {rank_qry}"
+        )
+        rank_df = read_bind(bind, qry, params, parse_dates=['Date'])
+        rank_df["Date"] = pd.to_datetime(rank_df["Date"], utc=True)
+        vals = rank_df.set_index(["Date", "rn"])["mean"]
+        n = rank_df.groupby("Date")["n"].first()
+        for p in BA_PERCENTILES:
+            pos = p * (n - 1)
+            lo = np.floor(pos).astype(int)
+            hi = np.minimum(lo + 1, n - 1)
+            v_lo = vals.reindex(list(zip(n.index, lo))).values
+            v_hi = vals.reindex(list(zip(n.index, hi))).values
+            label = f"{p:.0%}"
+            ba_df[label] = pd.Series(v_lo + (v_hi - v_lo) * (pos - lo).values, index=n.index)
+            cols.append(label)
+
+    cols = cols + ["max", "elev_ft", "points"]
+    return ba_df[cols]
+
 # Function to calculate mean, median, 5th and 95th states for screened basin
 def ba_stats_std(df, date_field="Date"):
     ba_df = df[[date_field, 'mean']].groupby(
@@ -291,75 +921,118 @@ def ba_stats_std(df, date_field="Date"):
     return ba_df
 
 def ba_stats_all(df, date_field="Date"):
+    if use_duckdb():
+        con = get_duckdb()
+        try:
+            con.register("ba_df", df[[date_field, 'mean']])
+            ba_df = con.execute(get_duckdb_stats_qry("from ba_df ", date_field, points=False)).df()
+        finally:
+            con.close()
+        return ba_df.set_index(date_field).astype(float)
     ba_df = df[[date_field, 'mean']].groupby(
         by=date_field,
         sort=True,
-    ).describe(percentiles=[0.05, 0.5, 0.95]).droplevel(0, axis=1)
+    ).describe(percentiles=BA_PERCENTILES).droplevel(0, axis=1)
     return ba_df
 
 
 # Function to screen csas data by site and date
+@cache_result("csas_{dtype}")
 def screen_csas(site,s_date,e_date,dtype):
     bind_dict = {
         'iv': 'csas_iv',
         'dv': 'csas_dv'
     }
     bind = bind_dict[dtype]
-    qry = (
-        f"select * from {site} where "
-        f"`date` >= '{s_date}' "
-        f"and `date` <= '{e_date}' "
-    )
-    out_df = pd.read_sql(qry, db.get_engine(bind=bind), parse_dates=['date'])
+    qry = "`date` >= :s_date and `date` <= :e_date"
+    params = {"s_date": str(s_date), "e_date": str(e_date)}
+    out_df = read_site(bind, site, qry, params)
 
     out_df.index = pd.to_datetime(out_df['date'], utc=True)
     out_df.index.name = None
     return (out_df)
 
 # Function to screen snotel data by site and date
+@cache_result("snotel_dv")
 def screen_snotel(site,s_date,e_date):
     bind = 'snotel_dv'
-    qry = (
-        f"select * from {site} where "
-        f"`date` >= '{s_date}' "
-        f"and `date` <= '{e_date}' "
-    )
-    out_df = pd.read_sql(qry, db.get_engine(bind=bind), parse_dates=['date'])
+    qry = "`date` >= :s_date and `date` <= :e_date"
+    params = {"s_date": str(s_date), "e_date": str(e_date)}
+    out_df = read_site(bind, site, qry, params)
 
     out_df.index = pd.to_datetime(out_df['date'], utc=True)
     out_df.index.name = None
     return (out_df)
 
+@cache_result("usgs_{dtype}")
 def screen_usgs(site,s_date,e_date,dtype):
     bind = f'usgs_{dtype}'
-    qry = (
-        f"select * from site_{site} where "
-        f"`date` >= '{s_date}' "
-        f"and `date` <= '{e_date}' "
-    )
-    out_df = pd.read_sql(qry, db.get_engine(bind=bind), parse_dates=['date'])
+    qry = "`date` >= :s_date and `date` <= :e_date"
+    params = {"s_date": str(s_date), "e_date": str(e_date)}
+    out_df = read_site(bind, f"site_{site}", qry, params)
 
     out_df.index = pd.to_datetime(out_df['date'], utc=True)
     out_df.index.name = None
     return (out_df)
 
+# Functions to screen several sites at once, returning one wide frame with (variable, site) columns (sites_to_wide)
+@cache_result("csas_{dtype}")
+def screen_csas_many(sites,s_date,e_date,dtype):
+    bind = f'csas_{dtype}'
+    qry = "`date` >= :s_date and `date` <= :e_date"
+    params = {"s_date": str(s_date), "e_date": str(e_date)}
+    site_dfs = read_sites(bind, sites, qry, params)
+
+    return sites_to_wide({s: index_by_date(site_dfs[s]) for s in sites}, sites)
+
+@cache_result("snotel_dv")
+def screen_snotel_many(sites,s_date,e_date):
+    bind = 'snotel_dv'
+    qry = "`date` >= :s_date and `date` <= :e_date"
+    params = {"s_date": str(s_date), "e_date": str(e_date)}
+    site_dfs = read_sites(bind, [f"snotel_{s}" for s in sites], qry, params)
+
+    return sites_to_wide({s: index_by_date(site_dfs[f"snotel_{s}"]) for s in sites}, sites)
+
+@cache_result("usgs_{dtype}")
+def screen_usgs_many(sites,s_date,e_date,dtype):
+    bind = f'usgs_{dtype}'
+    qry = "`date` >= :s_date and `date` <= :e_date"
+    params = {"s_date": str(s_date), "e_date": str(e_date)}
+    site_dfs = read_sites(bind, [f"site_{s}" for s in sites], qry, params)
+
+    return sites_to_wide({s: index_by_date(site_dfs[f"site_{s}"]) for s in sites}, sites)
+
+@cache_result("rfc_{dtype}")
 def screen_rfc(site,fcst_dt,dtype):
     bind = f'rfc_{dtype}'
+    tbl_name = f"site_{site}"
 
-    # Check for last forecast date
+    # Check for last forecast date (kept in rfc_meta by rfc_to_db.write_db, or read from the consolidated db; dbs
+    # built before that are scanned)
     if fcst_dt=="last":
-        unique_dates = pd.read_sql(
-            f'select distinct fcst_dt from site_{site}',
-            db.get_engine(bind=bind),parse_dates=['fcst_dt']
-        ).dropna()
-        last = unique_dates.max().item()
+        if use_consolidated(bind):
+            last_df = read_bind(
+                CONSOLIDATED_BIND, f'select max(fcst_dt) as fcst_dt from "{bind}" where site_id = :site_id',
+                {"site_id": site}
+            )
+        else:
+            try:
+                check_table(bind, RFC_META_TABLE)
+                last_df = read_bind(
+                    bind, f"select fcst_dt from {RFC_META_TABLE} where site = :site and dtype = :dtype",
+                    {"site": site, "dtype": dtype}
+                )
+            except ValueError:
+                last_df = pd.DataFrame(columns=["fcst_dt"])
+        if last_df["fcst_dt"].dropna().empty:
+            last_df = read_bind(
+                bind, f'select max(fcst_dt) as fcst_dt from "{check_table(bind, tbl_name)}"', dict()
+            )
+        last = pd.to_datetime(last_df["fcst_dt"].iloc[0])
         fcst_dt = last.strftime("%Y-%m-%d")
 
-    qry = (
-        f"select * from site_{site} where "
-        f"`fcst_dt` = '{fcst_dt}' "
-    )
-    out_df = pd.read_sql(qry, db.get_engine(bind=bind), parse_dates=['date'])
+    out_df = read_site(bind, tbl_name, "`fcst_dt` = :fcst_dt", {"fcst_dt": str(fcst_dt)})
 
     out_df.index = pd.to_datetime(out_df['date'], utc=True)
     out_df.index.name = None
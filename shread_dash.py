@@ -33,6 +33,7 @@ from database import snotel_list,usgs_list,csas_list,forecast_list
 from database import sloperange, elevrange, aspectdict, elevdict, slopedict
 
 from plot_lib.utils import get_plot_config
+from plot_lib.data_store import store_selection, get_data
 from plot_lib.snow_plot import get_snow_plot
 from plot_lib.met_plot import get_met_plot
 from plot_lib.flow_plot import get_flow_plot
@@ -324,6 +325,8 @@ def get_layout():
                     ))
                 ]
             ),
+            # Selection key for the server-side data store (see update_data_store)
+            dcc.Store(id='data_store'),
             ## TODO: Change to figure with subplots.
             dbc.Row(
                 [
@@ -488,9 +491,23 @@ def load_preset_dates(a,b,c,d,start,end):
         end_date = dt.datetime.strftime(end_date, "%Y-%m-%d")
     return(start_date,end_date)
 
+# Inputs of the data store, and those used by each plot
+ALL_INPUTS = [
+    'basin', 'stype', 'elevations', 'aspects', 'slopes', 'date_selection', 'dtype',
+    'snotel_sel', 'csas_sel', 'usgs_sel', 'forecast_sel', 'offline'
+]
+SNOW_INPUTS = [
+    'basin', 'stype', 'elevations', 'aspects', 'slopes', 'date_selection', 'dtype',
+    'snotel_sel', 'csas_sel', 'offline'
+]
+MET_INPUTS = [
+    'basin', 'elevations', 'aspects', 'slopes', 'date_selection', 'dtype', 'snotel_sel', 'csas_sel', 'offline'
+]
+FLOW_INPUTS = ['usgs_sel', 'dtype', 'date_selection', 'csas_sel', 'offline']
+CSAS_INPUTS = ['date_selection', 'csas_sel', 'dtype', 'offline']
+
 @app.callback(
-    Output('snow_plot', 'figure'),
-    Output('mean_elevation', 'children'),
+    Output('data_store', 'data'),
     [
         Input('basin', 'value'),
         Input('stype', 'value'),
@@ -502,29 +519,74 @@ def load_preset_dates(a,b,c,d,start,end):
         Input('dtype', 'value'),
         Input('snotel_sel', 'value'),
         Input('csas_sel','value'),
+        Input('usgs_sel', 'value'),
         Input('forecast_sel','value'),
-        Input('plot_albedo_snow','checked'),
         Input('offline','checked'),
+    ])
+def update_data_store(basin, stype, elrange, aspects, slopes, start_date,
+                      end_date, dtype, snotel_sel, csas_sel, usgs_sel, forecast_sel, offline):
+    """
+    :description: this function loads the data for the selection once (server-side), for all of the plots
+    :return: the selection, its key in the data store and the input that triggered the update
+    """
+    ctx = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
+    selection = {
+        "basin": basin,
+        "stype": stype,
+        "elrange": elrange,
+        "aspects": aspects,
+        "slopes": slopes,
+        "start_date": start_date,
+        "end_date": end_date,
+        "dtype": dtype,
+        "snotel_sel": snotel_sel,
+        "csas_sel": csas_sel,
+        "usgs_sel": usgs_sel,
+        "forecast_sel": forecast_sel,
+        "offline": offline,
+    }
+    key = store_selection(selection)
+
+    return {"key": key, "selection": selection, "trigger": ctx}
+
+def plot_update(ctx, store, inputs, sensors=[]):
+    """
+    :description: checks if a plot needs updating, i.e. if the input that changed the data store is used by the plot
+    :param ctx: id of the input that triggered the plot callback
+    :param store: contents of the data_store
+    :param inputs: ids of the inputs used by the plot
+    :param sensors: forecast variables shown in the plot (forecast_sel changes are skipped if none are selected)
+    :return: boolean
+    """
+    trigger = store["trigger"]
+    if (ctx != "data_store") or (trigger not in ALL_INPUTS):
+        return True
+    if trigger == "forecast_sel":
+        for fcst in store["selection"]["forecast_sel"]:
+            if fcst in sensors:
+                return True
+        return False
+    return trigger in inputs
+
+@app.callback(
+    Output('snow_plot', 'figure'),
+    Output('mean_elevation', 'children'),
+    [
+        Input('data_store', 'data'),
+        Input('plot_albedo_snow','checked'),
         State('snow_plot', 'figure'),
         State('mean_elevation', 'children'),
     ])
-def update_snow_plot(basin, stype, elrange, aspects, slopes, start_date,
-                     end_date, dtype,snotel_sel,csas_sel,forecast_sel,plot_albedo,offline,fig,basin_stats):
+def update_snow_plot(store,plot_albedo,fig,basin_stats):
 
-    fcst_update = True
     ctx = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
-    if ctx == "forecast_sel":
-        fcst_update = False
-        for fcst in forecast_sel:
-            if fcst in ["snow","rhm","sky"]:
-                fcst_update = True
-            else:
-                continue
+    fcst_update = plot_update(ctx, store, SNOW_INPUTS, ["snow","rhm","sky"])
     if fcst_update:
+        sel = store["selection"]
         fig, basin_stats = get_snow_plot(
-            basin, stype, elrange, aspects, slopes, start_date,
-            end_date, dtype,snotel_sel,csas_sel,forecast_sel,plot_albedo,
-            offline
+            get_data(store), sel["basin"], sel["stype"], sel["start_date"],
+            sel["end_date"], sel["snotel_sel"], sel["csas_sel"], sel["forecast_sel"], plot_albedo,
+            sel["offline"]
         )
 
     return fig, basin_stats
@@ -532,90 +594,59 @@ def update_snow_plot(basin, stype, elrange, aspects, slopes, start_date,
 @app.callback(
     Output('met_plot', 'figure'),
     [
-        Input('basin', 'value'),
-        Input('elevations', 'value'),
-        Input('aspects', 'value'),
-        Input('slopes', 'value'),
-        Input('date_selection', 'start_date'),
-        Input('date_selection', 'end_date'),
-        Input('snotel_sel', 'value'),
-        Input('csas_sel','value'),
+        Input('data_store', 'data'),
         Input('plot_albedo_met','checked'),
-        Input('dtype', 'value'),
-        Input('forecast_sel','value'),
-        Input('offline','checked'),
         State('met_plot', 'figure')
     ])
-def update_met_plot(basin, elrange, aspects, slopes, start_date,
-                    end_date, snotel_sel, csas_sel, plot_albedo, dtype,
-                    forecast_sel,offline,fig):
+def update_met_plot(store, plot_albedo, fig):
 
-    fcst_update = True
     ctx = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
-    if ctx == "forecast_sel":
-        fcst_update = False
-        for fcst in forecast_sel:
-            if fcst in ["mint","maxt","qpf","pop12"]:
-                fcst_update = True
-            else:
-                continue
-
+    fcst_update = plot_update(ctx, store, MET_INPUTS, ["mint","maxt","qpf","pop12"])
     if fcst_update:
+        sel = store["selection"]
         fig = get_met_plot(
-            basin, elrange, aspects, slopes, start_date,
-            end_date, snotel_sel, csas_sel, plot_albedo, dtype,
-            forecast_sel,offline
+            get_data(store), sel["basin"], sel["start_date"],
+            sel["end_date"], sel["snotel_sel"], sel["csas_sel"], plot_albedo, sel["dtype"],
+            sel["forecast_sel"], sel["offline"]
         )
     return fig
 
 @app.callback(
     Output('flow_plot', 'figure'),
     [
-        Input('usgs_sel', 'value'),
-        Input('dtype', 'value'),
-        Input('forecast_sel', 'value'),
-        Input('date_selection', 'start_date'),
-        Input('date_selection', 'end_date'),
-        Input('csas_sel','value'),
+        Input('data_store', 'data'),
         Input('plot_albedo_flow','checked'),
-        Input('offline','checked'),
         State('flow_plot', 'figure'),
     ])
-def update_flow_plot(usgs_sel, dtype, forecast_sel, start_date, end_date,
-                     csas_sel, plot_albedo,
-                     offline,fig):
+def update_flow_plot(store, plot_albedo, fig):
 
-    fcst_update = True
     ctx = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
-    if ctx == "forecast_sel":
-        fcst_update = False
-        for fcst in forecast_sel:
-            if fcst in ["flow"]:
-                fcst_update = True
-            else:
-                continue
-
+    fcst_update = plot_update(ctx, store, FLOW_INPUTS, ["flow"])
     if fcst_update:
+        sel = store["selection"]
         fig = get_flow_plot(
-            usgs_sel, dtype, forecast_sel, start_date, end_date, csas_sel, plot_albedo,
-            offline
+            get_data(store), sel["usgs_sel"], sel["dtype"], sel["forecast_sel"], sel["start_date"],
+            sel["end_date"], sel["csas_sel"], plot_albedo, sel["offline"]
         )
     return fig
 
 @app.callback(
     Output('csas_plot', 'figure'),
     [
-        Input('date_selection', 'start_date'),
-        Input('date_selection', 'end_date'),
+        Input('data_store', 'data'),
         Input('plot_dust',"checked"),
-        Input('csas_sel', 'value'),
-        Input('dtype', 'value'),
         Input('plot_albedo_csas','checked'),
-        Input('offline','checked'),
+        State('csas_plot', 'figure'),
     ])
-def update_csas_plot(start_date, end_date, plot_dust, csas_sel, dtype, albedo,offline):
+def update_csas_plot(store, plot_dust, albedo, fig):
 
-    fig = get_csas_plot(start_date, end_date, plot_dust, csas_sel, dtype, albedo,offline)
+    ctx = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
+    if plot_update(ctx, store, CSAS_INPUTS):
+        sel = store["selection"]
+        fig = get_csas_plot(
+            get_data(store), sel["start_date"], sel["end_date"], plot_dust, sel["csas_sel"], sel["dtype"], albedo,
+            sel["offline"]
+        )
 
     return fig
 
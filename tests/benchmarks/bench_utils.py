@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 09:12:40 2026
+
+Helpers of the benchmarks in tests/benchmarks. The benchmarks are skipped in the normal test run; run them with:
+
+    python -m pytest tests/benchmarks --benchmark -s
+
+Each prints its timings as a table. The data is synthetic (see conftest.py), sized with SHREAD_BENCH_SCALE (1 by
+default, the sizes in each benchmark's docstring).
+
+@author: buriona,tclarkin
+"""
+
+import os
+import time
+import threading
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from conftest import BASINS, get_points
+
+SCALE = float(os.environ.get('SHREAD_BENCH_SCALE', 1))
+
+def scaled(n):
+    """
+    n scaled by SHREAD_BENCH_SCALE (at least 1)
+    """
+    return max(1, int(n * SCALE))
+
+def time_call(func, *args, repeat=5, **kwargs):
+    """
+    Run func repeat times and return the times (ms) and the last result
+    """
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        times.append((time.perf_counter() - start) * 1000)
+    return times, result
+
+def time_users(func, users, calls):
+    """
+    Run func(i) calls times in each of users threads at once and return the times (ms) of all calls
+    """
+    times = list()
+    lock = threading.Lock()
+
+    def worker(user):
+        for call in range(calls):
+            start = time.perf_counter()
+            func(user * calls + call)
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                times.append(elapsed)
+
+    threads = [threading.Thread(target=worker, args=(user,)) for user in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return times
+
+def print_table(title, header, rows):
+    """
+    Print the rows (lists of values) of a benchmark under a title, floats with one decimal
+    """
+    rows = [[f'{v:.1f}' if isinstance(v, float) else str(v) for v in row] for row in rows]
+    widths = [max(len(str(h)), *(len(row[i]) for row in rows)) for i, h in enumerate(header)]
+    print(f'\n{title}')
+    print('  ' + '  '.join(str(h).rjust(w) for h, w in zip(header, widths)))
+    for row in rows:
+        print('  ' + '  '.join(v.rjust(w) for v, w in zip(row, widths)))
+
+def write_season_csvs(csv_dir, dates, n_points, seed=0):
+    """
+    Write synthetic SNODAS shread.py output files (swe and snowdepth, every basin of BASINS, n_points points) for
+    dates, as write_snodas_csvs but with the points generated once
+    """
+    csv_dir = Path(csv_dir)
+    csv_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    df_points = pd.concat([get_points(basin_id, n_points) for basin_id in BASINS], ignore_index=True)
+    for date in pd.to_datetime(dates):
+        dfs = list()
+        for shread_type in ['swe', 'snowdepth']:
+            df = df_points.copy()
+            df.insert(0, 'Date', f'{date:%Y-%m-%d}')
+            df.insert(1, 'Type', shread_type)
+            df['mean'] = rng.gamma(2.0, 5.0, len(df)).round(3)
+            dfs.append(df)
+        pd.concat(dfs).to_csv(Path(csv_dir, f'snodas_{date:%Y%m%d}.csv'), index=False)
+    return csv_dir
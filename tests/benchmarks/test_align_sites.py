@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 14:36:20 2026
+
+Benchmark of the alignment of site series to a plot's date axis (plot_lib/utils.py align_sites, sites_to_wide)
+against the merge per site of the plot builders it replaced (align_sites_legacy): 20 sites x 15 minute data over a
+season (with gaps), one variable (flow_plot) and three variables (snow_plot, from one wide frame).
+
+@author: buriona,tclarkin
+"""
+
+import pandas as pd
+import pytest
+from plot_lib import utils
+from test_utils import make_site_dfs, align_sites_legacy
+from bench_utils import scaled, time_call, print_table
+
+pytestmark = pytest.mark.benchmark
+
+def align_legacy(site_dfs, variables, sites, dates):
+    return [align_sites_legacy(site_dfs, var, sites, dates) for var in variables]
+
+def align_dict(site_dfs, variables, sites, dates):
+    return [utils.align_sites(site_dfs, var, sites, dates) for var in variables]
+
+def align_wide(site_dfs, variables, sites, dates):
+    wide_df = utils.sites_to_wide(site_dfs, sites, variables)
+    return [utils.align_sites(wide_df, var, sites, dates) for var in variables]
+
+def test_align_sites():
+    dates = pd.date_range('2020-10-01', periods=scaled(273) * 96, freq='15min', tz='UTC')
+    plot_dates = pd.date_range(dates[0] - pd.Timedelta(days=6), dates[-1] + pd.Timedelta(days=6), freq='15min')
+    sites = [f'0935{i:04d}' for i in range(scaled(20))]
+    rows = list()
+    for case, variables in [('1 variable', ['flow']), ('3 variables', ['WTEQ', 'SNWD', 'PREC'])]:
+        site_dfs = make_site_dfs(dates, sites, variables)
+        legacy_times, expected = time_call(align_legacy, site_dfs, variables, sites, plot_dates, repeat=3)
+        row = [case, min(legacy_times)]
+        for align in [align_dict, align_wide]:
+            times, var_dfs = time_call(align, site_dfs, variables, sites, plot_dates, repeat=3)
+            for var_df, expected_df in zip(var_dfs, expected):
+                pd.testing.assert_frame_equal(var_df, expected_df, check_freq=False)
+            row.append(min(times))
+        rows.append(row)
+    print_table(
+        f'Alignment of {len(sites)} sites x {len(dates)} 15 minute steps to the plot axis (ms, best of 3)',
+        ['data', 'merge per site', 'align_sites', 'sites_to_wide + align_sites'], rows
+    )
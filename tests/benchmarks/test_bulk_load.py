@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 14:10:53 2026
+
+Benchmark of the build scripts' db writes (database/db_utils.py open_build, write_keyed), in rows/s into a fresh dir:
+the same tables written with to_sql (multi) and a connection per table (as write_db did before), with write_keyed
+and a connection and commit per table, and with write_keyed in one open_build transaction with BUILD_PRAGMAS. Then
+the full write_db (points tables, indexes and cubes included for SHREAD). A SNODAS season: 2 basins x 2000 points x
+365 days; snotel_dv: 300 sites x 3650 days.
+
+@author: buriona,tclarkin
+"""
+
+import sqlite3
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pytest
+from database import db_utils
+from database.SHREAD import shread_snow_to_db
+from database.SNOTEL import snotel_to_db
+from bench_utils import scaled, time_call, print_table, write_season_csvs
+
+pytestmark = pytest.mark.benchmark
+
+def get_snodas_tables(tmp_path):
+    """
+    The slim (date, point, value) tables of a synthetic SNODAS season of swe.db, as {table: frame}
+    """
+    csv_dir = write_season_csvs(Path(tmp_path, 'csv'), pd.date_range('2020-10-01', periods=scaled(365)), scaled(2000))
+    df = shread_snow_to_db.get_dfs(csv_dir)['swe']
+    tables = dict()
+    for _, df_basin in df.groupby('LOCAL_NAME', sort=False, observed=True):
+        tables[df_basin['LOCAL_ID'].iloc[0]] = db_utils.split_points(df_basin)[1]
+    return df, tables
+
+def get_snotel_tables():
+    """
+    Synthetic daily snotel_dv site tables, as {table: frame}
+    """
+    rng = np.random.default_rng(0)
+    dates = pd.date_range('2012-10-01', periods=scaled(3650), tz='UTC')
+    dfs = list()
+    for i in range(scaled(300)):
+        df = pd.DataFrame({'date': dates, 'site': f'{i}_CO_SNTL'})
+        for var in ['WTEQ', 'SNWD', 'PREC', 'TAVG']:
+            df[var] = rng.gamma(2.0, 5.0, len(dates)).round(1)
+        dfs.append(df)
+    df = pd.concat(dfs, ignore_index=True)
+    df.name = 'snotel_dv'
+    tables = {f'snotel_{site}': df_site for site, df_site in df.groupby('site', sort=False)}
+    return df, tables
+
+def write_to_sql(db_path, tables, key_cols):
+    for tbl_name, df in tables.items():
+        con = sqlite3.connect(db_path)
+        try:
+            df.to_sql(tbl_name, con, if_exists='replace', chunksize=10000, method='multi')
+        finally:
+            con.close()
+
+def write_keyed_per_table(db_path, tables, key_cols):
+    for tbl_name, df in tables.items():
+        con = sqlite3.connect(db_path)
+        try:
+            db_utils.write_keyed(con, tbl_name, df, key_cols, 'replace')
+            con.commit()
+        finally:
+            con.close()
+
+def write_bulk(db_path, tables, key_cols):
+    with db_utils.open_build(db_path) as con:
+        for tbl_name, df in tables.items():
+            with db_utils.savepoint(con):
+                db_utils.write_keyed(con, tbl_name, df, key_cols, 'replace')
+
+def run_fresh(db_path, func, *args):
+    db_path.unlink(missing_ok=True)
+    db_utils.remove_wal_files(db_path)
+    return func(*args)
+
+def test_bulk_load(tmp_path):
+    df_snodas, snodas_tables = get_snodas_tables(tmp_path)
+    df_snotel, snotel_tables = get_snotel_tables()
+    rows = list()
+    for name, tables, key_cols, write_db, df in [
+        ('SNODAS season', snodas_tables, ['Date', 'OBJECTID'], shread_snow_to_db.write_db, df_snodas),
+        ('snotel_dv', snotel_tables, ['date'], snotel_to_db.write_db, df_snotel),
+    ]:
+        n_rows = sum(len(df_tbl) for df_tbl in tables.values())
+        db_path = Path(tmp_path, f'{df.name}.db')
+        for path, func in [
+            ('to_sql (multi), connection per table', write_to_sql),
+            ('write_keyed, commit per table', write_keyed_per_table),
+            ('open_build, one transaction', write_bulk),
+        ]:
+            times, _ = time_call(run_fresh, db_path, func, db_path, tables, key_cols, repeat=1)
+            rows.append([name, path, n_rows, times[0] / 1000, n_rows / times[0]])
+        times, _ = time_call(run_fresh, db_path, write_db, df, tmp_path, repeat=1)
+        rows.append([name, 'write_db', n_rows, times[0] / 1000, n_rows / times[0]])
+    print_table('Db writes into a fresh dir', ['data', 'path', 'rows', 's', 'k rows/s'], rows)
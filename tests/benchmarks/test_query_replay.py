@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:02:18 2026
+
+Benchmark replaying a recorded sequence of dashboard interactions (slider moves over a basin and two USGS gages) with
+the values of the screen_* queries bound (read_bind) or formatted into the SQL (as before bound parameters), each
+with a connection per query and with the pooled engines (database/db_engines.py). Bound SQL is the same on every
+call, so a pooled connection reuses its prepared statements; formatted SQL is parsed and planned on every call.
+swe.db: the shread_dbs fixture (2 basins x 60 points x 31 days); usgs_dv.db: the usgs_dbs fixture.
+
+@author: buriona,tclarkin
+"""
+
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import NullPool
+from database import db, db_engines
+from plot_lib import utils
+from bench_utils import scaled, time_call, print_table
+
+pytestmark = pytest.mark.benchmark
+
+def make_engines(binds, options):
+    engines = dict()
+    for bind in binds:
+        db_path = db.get_engine(bind=bind).url.database
+        engines[bind] = create_engine(f'sqlite:///{Path(db_path).as_posix()}', **options)
+        event.listen(engines[bind], 'do_connect', db_engines.open_read_only)
+        event.listen(engines[bind], 'connect', db_engines.set_read_pragmas)
+    return engines
+
+def read_formatted(bind, qry, params, parse_dates=None):
+    """
+    read_bind with the values formatted into the SQL, as the screen_* queries were built before
+    """
+    for name in sorted(params, key=len, reverse=True):
+        value = params[name]
+        qry = qry.replace(f':{name}', repr(value) if isinstance(value, str) else str(value))
+    return pd.read_sql(text(qry), utils.get_engine(bind), parse_dates=parse_dates)
+
+def record_interactions(n):
+    """
+    A recorded sequence of n interactions: (start date, end date, elevation range, aspects) of the slider moves
+    """
+    rng = np.random.default_rng(0)
+    interactions = list()
+    for _ in range(n):
+        start = pd.Timestamp('2021-01-01') + pd.Timedelta(days=int(rng.integers(0, 20)))
+        end = start + pd.Timedelta(days=int(rng.integers(3, 11)))
+        lo = int(rng.integers(7000, 10000))
+        aspects = [[0, 360], [90, 270], [-45, 45]][int(rng.integers(0, 3))]
+        interactions.append((f'{start:%Y-%m-%d}', f'{end:%Y-%m-%d}', [lo, lo + 2500], aspects))
+    return interactions
+
+def replay(interactions):
+    for s_date, e_date, elrange, aspects in interactions:
+        utils.screen_spatial('swe', s_date, e_date, 'NVRN5L_F', aspects, elrange, [0, 45], agg=True)
+        utils.screen_spatial('swe', s_date, e_date, 'DRGC2H_F', aspects, elrange, [0, 45])
+        for site in ['09355500', '09361500']:
+            utils.screen_usgs(site, s_date, e_date, 'dv')
+
+def test_query_replay(shread_dbs, usgs_dbs, monkeypatch):
+    monkeypatch.setattr(utils, 'CACHE_SIZE', 0)
+    interactions = record_interactions(scaled(200))
+    rows = list()
+    for setup, options in [
+        ('connection per query', {'poolclass': NullPool}),
+        ('pooled', db_engines.ENGINE_OPTIONS),
+    ]:
+        engines = make_engines(['swe', 'usgs_dv'], options)
+        for sql, read in [('formatted', read_formatted), ('bound', utils.read_bind)]:
+            with monkeypatch.context() as m:
+                m.setattr(utils, 'get_engine', lambda bind: engines[bind])
+                m.setattr(utils, 'read_bind', read)
+                replay(interactions[:5])
+                times, _ = time_call(replay, interactions, repeat=3)
+            rows.append([setup, sql, min(times) / len(interactions)])
+        for engine in engines.values():
+            engine.dispose()
+    print_table(
+        f'Replay of {len(interactions)} interactions (2 screen_spatial + 2 screen_usgs each), ms per interaction',
+        ['connections', 'values', 'ms'], rows
+    )
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 09:31:05 2026
+
+Benchmark of the dashboard's read latency by connection setup (database/db_engines.py): p50/p95 of point
+lookups and uncached screen_spatial calls by 1 and 8 concurrent users, with a connection per query and no pragmas
+(Flask-SQLAlchemy's default for sqlite) and with ENGINE_OPTIONS (pooled, READ_PRAGMAS), then with ENGINE_OPTIONS
+while rebuilds are swapped in. swe.db: 2 basins x 3000 points x 120 days.
+
+@author: buriona,tclarkin
+"""
+
+import threading
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import NullPool
+from database import db_engines, db_utils
+from database.SHREAD import shread_snow_to_db
+from plot_lib import utils
+from conftest import TEST_DB_DIR
+from bench_utils import scaled, time_users, print_table, write_season_csvs
+
+pytestmark = pytest.mark.benchmark
+
+def make_engine(db_path, options, pragmas):
+    engine = create_engine(f'sqlite:///{Path(db_path).as_posix()}', **options)
+    event.listen(engine, 'do_connect', db_engines.open_read_only)
+    if pragmas:
+        event.listen(engine, 'connect', db_engines.set_read_pragmas)
+    return engine
+
+@pytest.fixture(scope='module')
+def season_db(tmp_path_factory):
+    csv_dir = write_season_csvs(
+        tmp_path_factory.mktemp('season'), pd.date_range('2021-01-01', periods=scaled(120)), scaled(3000)
+    )
+    shread_snow_to_db.write_dbs(csv_dir, Path(TEST_DB_DIR, 'SHREAD'), if_exists='replace')
+    yield Path(TEST_DB_DIR, 'SHREAD', 'swe.db')
+    utils.clear_cache()
+
+def screen(i):
+    """
+    One uncached callback: the statistics of a 3 week window with filters that don't align with the cube
+    """
+    rng = np.random.default_rng(i)
+    start = pd.Timestamp('2021-01-01') + pd.Timedelta(days=int(rng.integers(0, scaled(120) - 21)))
+    lo = int(rng.integers(7000, 10000))
+    utils.screen_spatial(
+        'swe', f'{start:%Y-%m-%d}', f'{start + pd.Timedelta(days=21):%Y-%m-%d}', 'NVRN5L_F',
+        [90, 270], [lo + 77, lo + 2077], [3, 37], agg=True
+    )
+
+def lookup(i):
+    """
+    One small query (the attributes of a point)
+    """
+    utils.read_bind('swe', 'select * from "NVRN5L_F_points" where OBJECTID = :pid', {'pid': i % scaled(3000)})
+
+def test_read_latency(season_db, monkeypatch):
+    monkeypatch.setattr(utils, 'CACHE_SIZE', 0)
+    monkeypatch.setattr(utils, 'USE_CUBE', False)
+    setups = {
+        'connection per query': make_engine(season_db, {'poolclass': NullPool}, False),
+        'pooled + READ_PRAGMAS': make_engine(season_db, db_engines.ENGINE_OPTIONS, True),
+    }
+    rows = list()
+    for name, engine in setups.items():
+        with monkeypatch.context() as m:
+            m.setattr(utils, 'get_engine', lambda bind: engine)
+            for query, func, calls in [('lookup', lookup, 200), ('screen_spatial', screen, 8)]:
+                func(0)
+                for users in [1, 8]:
+                    times = time_users(func, users, calls)
+                    rows.append([name, query, users, np.percentile(times, 50), np.percentile(times, 95)])
+        engine.dispose()
+
+    # The dashboard's engine while rebuilds are swapped in (replace_db) without a stop
+    build_path = Path(season_db.parent, 'swe_bench.db')
+    stop = threading.Event()
+    swaps = list()
+
+    def swap():
+        while not stop.is_set():
+            db_utils.copy_db(season_db, build_path)
+            db_utils.replace_db(build_path, season_db)
+            swaps.append(1)
+        build_path.unlink(missing_ok=True)
+        db_utils.remove_wal_files(build_path)
+
+    thread = threading.Thread(target=swap)
+    thread.start()
+    try:
+        for query, func, calls in [('lookup', lookup, 200), ('screen_spatial', screen, 8)]:
+            times = time_users(func, 4, calls)
+            rows.append(['pooled, during rebuilds', query, 4, np.percentile(times, 50), np.percentile(times, 95)])
+    finally:
+        stop.set()
+        thread.join()
+    print_table(
+        f'Read latency (ms), swe.db {scaled(3000)} points x {scaled(120)} days '
+        f'({len(swaps)} swaps during the last runs)',
+        ['setup', 'query', 'users', 'p50', 'p95'], rows
+    )
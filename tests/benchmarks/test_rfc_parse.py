@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 13:48:26 2026
+
+Benchmark of the RFC forecast csv parser (database/FLOW/rfc_to_db.py parse_rfc_csv) against the cell at a time
+parser it replaced (parse_rfc_legacy): the saved forecasts in tests/data/rfc, then the hourly forecast extended to
+longer horizons (its flows repeated, same header and layout).
+
+@author: buriona,tclarkin
+"""
+
+import pandas as pd
+import pytest
+from database.FLOW import rfc_to_db
+from test_rfc_to_db import read_fixture, parse_rfc_legacy
+from bench_utils import scaled, time_call, print_table
+
+pytestmark = pytest.mark.benchmark
+
+def extend_forecast(csv_str, hours):
+    """
+    The forecast csv with hours rows of data, from its first date and hour on
+    """
+    lines = csv_str.splitlines(keepends=True)
+    header = next(i for i, text in enumerate(lines) if text.startswith('DATE'))
+    data = lines[header + 1:]
+    start = pd.Timestamp(data[0].split(',')[0]) + pd.Timedelta(hours=int(data[0].split(',')[1].strip('Z')))
+    out = lines[:header + 1]
+    for i, date in enumerate(pd.date_range(start, periods=hours, freq='h')):
+        flow = data[i % len(data)].split(',', 2)[2]
+        out.append(f'{date:%Y-%m-%d},{date:%H}Z,{flow}')
+    return ''.join(out)
+
+def test_rfc_parse():
+    hourly = read_fixture('NVRN5.fflw1.csv')
+    cases = [
+        ('NVRN5.fflw24.csv', read_fixture('NVRN5.fflw24.csv')),
+        ('NVRN5.fflw1.csv', hourly),
+    ]
+    for days in [scaled(30), scaled(120)]:
+        cases.append((f'fflw1, {days} days', extend_forecast(hourly, 24 * days)))
+    rows = list()
+    for name, csv_str in cases:
+        repeat = 1 if len(csv_str) > 50000 else 3
+        legacy_times, legacy_df = time_call(parse_rfc_legacy, csv_str, repeat=repeat)
+        times, df = time_call(rfc_to_db.parse_rfc_csv, csv_str, repeat=5)
+        pd.testing.assert_frame_equal(df, legacy_df)
+        rows.append([name, len(df), min(legacy_times), min(times)])
+    print_table('RFC forecast csv parse (ms, best of runs)', ['forecast', 'rows', 'cell at a time', 'read_csv'], rows)
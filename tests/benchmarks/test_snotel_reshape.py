@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 13:31:12 2026
+
+Benchmark of the SNOTEL period of record reshape (database/SNOTEL/snotel_to_db.py reshape_por) against the loop per
+water year it replaced (reshape_por_legacy): 4 variables of a synthetic 40 water year POR csv.
+
+@author: buriona,tclarkin
+"""
+
+import hashlib
+from io import StringIO
+import pandas as pd
+import pytest
+from database.SNOTEL import snotel_to_db
+from test_snotel_to_db import make_por_csv, reshape_por_legacy
+from bench_utils import scaled, time_call, print_table
+
+pytestmark = pytest.mark.benchmark
+
+VARS = ['WTEQ', 'SNWD', 'PREC', 'TAVG']
+
+def reshape_all(reshape, fs):
+    return {var: reshape(f, var) for var, f in fs.items()}
+
+def test_snotel_reshape():
+    years = range(2022 - scaled(40), 2022)
+    fs = {var: pd.read_csv(StringIO(make_por_csv(years, seed=i)), index_col=0) for i, var in enumerate(VARS)}
+    rows = list()
+    md5s = dict()
+    for name, reshape in [('loop per water year', reshape_por_legacy), ('reshape_por', snotel_to_db.reshape_por)]:
+        times, dfs = time_call(reshape_all, reshape, fs, repeat=3)
+        md5s[name] = hashlib.md5(''.join(df.to_csv() for df in dfs.values()).encode()).hexdigest()
+        rows.append([name, min(times), md5s[name][:12]])
+    assert len(set(md5s.values())) == 1
+    print_table(
+        f'POR reshape of {len(VARS)} variables x {len(years)} water years (ms, best of 3)',
+        ['reshape', 'ms', 'csv md5'], rows
+    )
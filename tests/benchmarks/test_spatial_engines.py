@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 15:27:09 2026
+
+A/B benchmark of the engines of screen_spatial and ba_stats_all (plot_lib/utils.py SPATIAL_ENGINE) on each source
+(SPATIAL_BACKEND): SQLite and pandas or DuckDB, on the SQLite dbs or their Parquet files. Each query is checked to
+give the same frame on every engine and source. Uncached, cube off. swe.db: 2 basins x 2000 points x 365 days.
+
+@author: buriona,tclarkin
+"""
+
+from pathlib import Path
+import pandas as pd
+import pytest
+from database.SHREAD import shread_snow_to_db
+from plot_lib import utils
+from conftest import TEST_DB_DIR
+from bench_utils import scaled, time_call, print_table, write_season_csvs
+
+pytestmark = pytest.mark.benchmark
+
+SETUPS = [
+    ('sqlite', 'sqlite', 'sqlite'),
+    ('duckdb', 'duckdb', 'sqlite'),
+    ('parquet', 'sqlite', 'parquet'),
+    ('duckdb + parquet', 'duckdb', 'parquet'),
+]
+SEASON = ('2020-10-01', '2021-09-30')
+QUERIES = [
+    ('season stats, percentiles', SEASON, ([0, 360], [0, 20000], [0, 100]), {'agg': True}),
+    ('season stats, no percentiles', SEASON, ([0, 360], [0, 20000], [0, 100]), {'agg': True, 'percentiles': False}),
+    ('season points', SEASON, ([0, 360], [0, 20000], [0, 100]), {}),
+    ('one month stats, filtered', ('2021-01-01', '2021-01-31'), ([90, 270], [8000, 11000], [0, 30]), {'agg': True}),
+]
+
+@pytest.fixture(scope='module')
+def season_dbs(tmp_path_factory):
+    pytest.importorskip('duckdb')
+    pytest.importorskip('pyarrow')
+    from database.SHREAD import shread_to_parquet
+    csv_dir = write_season_csvs(
+        tmp_path_factory.mktemp('season'), pd.date_range(SEASON[0], periods=scaled(365)), scaled(2000)
+    )
+    shread_snow_to_db.write_dbs(csv_dir, Path(TEST_DB_DIR, 'SHREAD'), if_exists='replace')
+    parquet_dir = tmp_path_factory.mktemp('parquet')
+    shread_to_parquet.write_parquet(Path(TEST_DB_DIR, 'SHREAD'), parquet_dir, ['swe'])
+    yield parquet_dir
+    utils.clear_cache()
+
+def sort_points(df):
+    return df.sort_values(['Date', 'OBJECTID']).reset_index(drop=True)
+
+def test_spatial_engines(season_dbs, monkeypatch):
+    monkeypatch.setattr(utils, 'CACHE_SIZE', 0)
+    monkeypatch.setattr(utils, 'USE_CUBE', False)
+    monkeypatch.setattr(utils, 'PARQUET_DIR', str(season_dbs))
+    results = dict()
+    for setup, engine, backend in SETUPS:
+        monkeypatch.setattr(utils, 'SPATIAL_ENGINE', engine)
+        monkeypatch.setattr(utils, 'SPATIAL_BACKEND', backend)
+        utils.clear_cache()
+        assert (utils.use_parquet('swe', 'NVRN5L_F') is not None) == (backend == 'parquet')
+        for query, dates, filters, kwargs in QUERIES:
+            args = ('swe', *dates, 'NVRN5L_F', *filters)
+            utils.screen_spatial(*args, **kwargs)
+            times, df = time_call(utils.screen_spatial, *args, repeat=3, **kwargs)
+            results[(query, setup)] = (min(times), df if kwargs else sort_points(df))
+        if backend == 'sqlite':
+            df_points = results[('season points', 'sqlite')][1]
+            times, df = time_call(utils.ba_stats_all, df_points, repeat=3)
+            results[('ba_stats_all, season points', setup)] = (min(times), df)
+
+    rows = list()
+    for query in [q[0] for q in QUERIES] + ['ba_stats_all, season points']:
+        row = [query]
+        expected = results[(query, 'sqlite')][1]
+        for setup, *_ in SETUPS:
+            if (query, setup) not in results:
+                row.append('-')
+                continue
+            ms, df = results[(query, setup)]
+            pd.testing.assert_frame_equal(
+                df[expected.columns], expected, check_dtype=False, check_index_type=False
+            )
+            row.append(ms)
+        rows.append(row)
+    print_table(
+        f'screen_spatial and ba_stats_all by engine (ms, best of 3), swe.db {scaled(2000)} points x {scaled(365)} days',
+        ['query'] + [s[0] for s in SETUPS], rows
+    )
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 13:05:44 2026
+
+Benchmark of the screen_spatial (date, point) index on the SHREAD basin tables (database/db_utils.py
+create_spatial_index): uncached screen_spatial calls (points and SQL statistics, cube off) on a multi-season swe.db
+with the index and on a copy with it dropped (as written before), then the migration (migrate_db) of that copy.
+swe.db: 2 basins x 1000 points x 730 days.
+
+@author: buriona,tclarkin
+"""
+
+import shutil
+import sqlite3
+from pathlib import Path
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, event
+from database import db_engines, db_utils
+from database.SHREAD import shread_snow_to_db
+from plot_lib import utils
+from conftest import TEST_DB_DIR, BASINS
+from bench_utils import scaled, time_call, print_table, write_season_csvs
+
+pytestmark = pytest.mark.benchmark
+
+DAYS = scaled(730)
+CASES = [
+    ('21 days, all points', '2021-01-01', '2021-01-22', [0, 20000]),
+    ('21 days, elev >= 9000', '2021-01-01', '2021-01-22', [9000, 20000]),
+    ('1 season', '2021-10-01', '2022-06-30', [0, 20000]),
+]
+
+@pytest.fixture(scope='module')
+def season_db(tmp_path_factory):
+    csv_dir = write_season_csvs(
+        tmp_path_factory.mktemp('seasons'), pd.date_range('2020-10-01', periods=DAYS), scaled(1000)
+    )
+    shread_snow_to_db.write_dbs(csv_dir, Path(TEST_DB_DIR, 'SHREAD'), if_exists='replace')
+    yield Path(TEST_DB_DIR, 'SHREAD', 'swe.db')
+    utils.clear_cache()
+
+def drop_spatial_index(db_path):
+    con = sqlite3.connect(db_path)
+    try:
+        for basin_id in BASINS:
+            con.execute(f'drop index if exists "ux_{basin_id}_Date_OBJECTID"')
+        con.commit()
+    finally:
+        con.close()
+
+def make_engine(db_path):
+    engine = create_engine(f'sqlite:///{Path(db_path).as_posix()}', **db_engines.ENGINE_OPTIONS)
+    event.listen(engine, 'do_connect', db_engines.open_read_only)
+    event.listen(engine, 'connect', db_engines.set_read_pragmas)
+    return engine
+
+def test_spatial_index(season_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, 'CACHE_SIZE', 0)
+    monkeypatch.setattr(utils, 'USE_CUBE', False)
+    no_index_path = Path(tmp_path, 'swe.db')
+    shutil.copy(season_db, no_index_path)
+    drop_spatial_index(no_index_path)
+
+    results = dict()
+    for setup, db_path in [('no index', no_index_path), ('index', season_db)]:
+        engine = make_engine(db_path)
+        with monkeypatch.context() as m:
+            m.setattr(utils, 'get_engine', lambda bind: engine)
+            for case, s_date, e_date, elrange in CASES:
+                for agg in [False, True]:
+                    times, df = time_call(
+                        utils.screen_spatial, 'swe', s_date, e_date, 'NVRN5L_F',
+                        elrange=elrange, agg=agg, repeat=3
+                    )
+                    results[(setup, case, agg)] = (min(times), df)
+        engine.dispose()
+
+    rows = list()
+    for case, *_ in CASES:
+        for agg in [False, True]:
+            before, df_before = results[('no index', case, agg)]
+            after, df_after = results[('index', case, agg)]
+            pd.testing.assert_frame_equal(
+                df_before.sort_values(list(df_before.columns[:2])).reset_index(drop=True),
+                df_after.sort_values(list(df_after.columns[:2])).reset_index(drop=True)
+            )
+            rows.append([case, 'stats' if agg else 'points', len(df_after), before, after])
+
+    times, _ = time_call(db_utils.migrate_db, no_index_path, repeat=1)
+    print_table(
+        f'screen_spatial (ms, best of 3), swe.db {scaled(1000)} points x {DAYS} days per basin',
+        ['query', 'agg', 'rows', 'no index', 'index'], rows
+    )
+    print(f'  migrate_db of the copy without the index: {times[0]:.0f} ms')
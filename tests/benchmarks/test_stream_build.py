@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 15:02:37 2026
+
+Benchmark of the memory of the SHREAD builds (database/SHREAD/shread_snow_to_db.py) as the number of shread.py
+output files grows: peak RSS and time of a replace build of swe.db and sd.db with the whole archive read into one
+frame (get_dfs, then write_db per db) and streamed (write_dbs). Each build runs in its own process, so its peak RSS
+is its own. Files: 2 types x 2 basins x 5000 points each.
+
+@author: buriona,tclarkin
+"""
+
+import sys
+import json
+import subprocess
+from pathlib import Path
+import pandas as pd
+import pytest
+from bench_utils import scaled, print_table, write_season_csvs
+
+pytestmark = pytest.mark.benchmark
+
+SHREAD_DIR = Path(Path(__file__).absolute().parent.parent.parent, 'database', 'SHREAD')
+
+# Run in a new python: build the dbs of csv_dir in db_dir and print the peak RSS (MB) and seconds as json
+BUILD_SCRIPT = '''
+import sys, json, time, resource
+from pathlib import Path
+sys.path.insert(0, sys.argv[1])
+import shread_snow_to_db
+mode, csv_dir, db_dir = sys.argv[2], Path(sys.argv[3]), Path(sys.argv[4])
+start = time.perf_counter()
+if mode == 'whole archive':
+    for df in shread_snow_to_db.get_dfs(csv_dir).values():
+        shread_snow_to_db.write_db(df, db_dir, if_exists='replace')
+else:
+    shread_snow_to_db.write_dbs(csv_dir, db_dir, if_exists='replace')
+seconds = time.perf_counter() - start
+print(json.dumps([resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, seconds]))
+'''
+
+def run_build(mode, csv_dir, db_dir):
+    db_dir.mkdir(exist_ok=True)
+    out = subprocess.run(
+        [sys.executable, '-c', BUILD_SCRIPT, str(SHREAD_DIR), mode, str(csv_dir), str(db_dir)],
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def test_stream_build(tmp_path):
+    counts = [scaled(25), scaled(50), scaled(100)]
+    n_points = scaled(5000)
+    all_dir = write_season_csvs(Path(tmp_path, 'all'), pd.date_range('2021-01-01', periods=counts[-1]), n_points)
+    files = sorted(all_dir.glob('snodas*.csv'))
+    rows = list()
+    for n_files in counts:
+        csv_dir = Path(tmp_path, f'csv_{n_files}')
+        csv_dir.mkdir()
+        for f in files[:n_files]:
+            Path(csv_dir, f.name).symlink_to(f)
+        row = [n_files, n_files * 4 * n_points]
+        for mode in ['whole archive', 'streamed']:
+            rss, seconds = run_build(mode, csv_dir, Path(tmp_path, f'db_{n_files}_{mode[0]}'))
+            row.extend([rss, seconds])
+        rows.append(row)
+    print_table(
+        'Replace build of swe.db and sd.db (peak RSS in MB, s)',
+        ['files', 'rows', 'whole MB', 'whole s', 'streamed MB', 'streamed s'], rows
+    )
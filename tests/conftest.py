@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:05:12 2026
+
+Shared fixtures for the tests (python -m pytest from the repo root)
+
+Importing the dashboard package (database) opens every db of its binds, so SHREAD_DB_DIR is pointed at a temporary
+dir before anything imports it; tests that read through the dashboard write their dbs there (see shread_dbs).
+
+@author: buriona,tclarkin
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT_DIR = Path(__file__).absolute().parent.parent
+TEST_DB_DIR = Path(tempfile.mkdtemp(prefix='shread_test_'))
+for sub_dir in ['SHREAD', 'CSAS', 'SNOTEL', 'FLOW']:
+    Path(TEST_DB_DIR, sub_dir).mkdir()
+os.environ['SHREAD_DB_DIR'] = str(TEST_DB_DIR)
+# The tests rebuild dbs and read them back at once, so the dashboard checks the db files on every query
+os.environ['SHREAD_STAMP_INTERVAL'] = '0'
+sys.path.insert(0, str(ROOT_DIR))
+
+# Basins of the synthetic SHREAD data, as {LOCAL_ID: LOCAL_NAME}
+BASINS = {'NVRN5L_F': 'SAN JUAN - NAVAJO', 'DRGC2H_F': 'ANIMAS - DURANGO'}
+
+def pytest_addoption(parser):
+    parser.addoption(
+        '--benchmark', action='store_true', help='run the benchmarks (tests/benchmarks) instead of skipping them'
+    )
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'benchmark: timing run, skipped unless --benchmark is given')
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--benchmark'):
+        return
+    skip = pytest.mark.skip(reason='benchmark (run with --benchmark -s)')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip)
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(TEST_DB_DIR, ignore_errors=True)
+
+def get_points(basin_id, n_points, seed=0):
+    """
+    Static attributes of n_points synthetic grid points of a basin (point ids are unique across basins)
+    """
+    rng = np.random.default_rng(seed + list(BASINS).index(basin_id))
+    offset = list(BASINS).index(basin_id) * 100000
+    return pd.DataFrame({
+        'OBJECTID': np.arange(n_points) + offset,
+        'elev_ft': rng.integers(7000, 13000, n_points),
+        'slope_d': rng.integers(0, 60, n_points),
+        'aspct': rng.integers(-1, 361, n_points),
+        'nlcd': rng.choice([42, 52, 71], n_points),
+        'LOCAL_ID': basin_id,
+        'LOCAL_NAME': BASINS[basin_id],
+    })
+
+@pytest.fixture
+def make_shread_df():
+    """
+    Factory of synthetic SHREAD output rows (as read by the build scripts): one row per date and point of each basin
+    """
+    def make(dates, n_points=50, basins=tuple(BASINS), seed=0):
+        rng = np.random.default_rng(seed)
+        dfs = list()
+        for basin_id in basins:
+            df_points = get_points(basin_id, n_points)
+            for date in pd.to_datetime(dates):
+                df = df_points.copy()
+                df.insert(0, 'Date', date)
+                df['mean'] = rng.gamma(2.0, 5.0, n_points).round(3)
+                dfs.append(df)
+        return pd.concat(dfs, ignore_index=True)
+    return make
+
+@pytest.fixture
+def write_snodas_csvs(make_shread_df):
+    """
+    Factory writing synthetic SNODAS shread.py output files (one per date, swe and snowdepth rows) to a dir
+    """
+    def write(csv_dir, dates, n_points=50, seed=0):
+        csv_dir = Path(csv_dir)
+        csv_dir.mkdir(parents=True, exist_ok=True)
+        for i, date in enumerate(pd.to_datetime(dates)):
+            dfs = list()
+            for j, shread_type in enumerate(['swe', 'snowdepth']):
+                df = make_shread_df([date], n_points, seed=seed + 2 * i + j)
+                df.insert(1, 'Type', shread_type)
+                dfs.append(df)
+            df = pd.concat(dfs)
+            df['Date'] = df['Date'].dt.strftime('%Y-%m-%d')
+            df.to_csv(Path(csv_dir, f'snodas_{date:%Y%m%d}.csv'), index=False)
+        return csv_dir
+    return write
+
+@pytest.fixture
+def shread_dbs(tmp_path, write_snodas_csvs):
+    """
+    Build the swe and sd dbs of the dashboard (in SHREAD_DB_DIR) from synthetic SNODAS output for a month, with the
+    SNODAS build script, and return the dates. The screen_* caches are cleared so the tests read the new dbs.
+    """
+    from database.SHREAD import shread_snow_to_db
+    from plot_lib import utils
+
+    dates = pd.date_range('2021-01-01', '2021-01-31')
+    csv_dir = write_snodas_csvs(Path(tmp_path, 'data'), dates, n_points=60)
+    shread_snow_to_db.write_dbs(csv_dir, Path(TEST_DB_DIR, 'SHREAD'), if_exists='replace')
+    utils.clear_cache()
+    yield dates
+    utils.clear_cache()
+
+# USGS gages of the synthetic site data
+USGS_SITES = ['09355500', '09361500']
+
+@pytest.fixture
+def make_usgs_df():
+    """
+    Factory of synthetic USGS daily flows of USGS_SITES (as read by usgs_to_db.get_dfs, with UTC dates)
+    """
+    def make(dates, seed=0):
+        rng = np.random.default_rng(seed)
+        dates = pd.to_datetime(dates, utc=True)
+        df = pd.concat([
+            pd.DataFrame({'date': dates, 'flow': rng.gamma(2.0, 50.0, len(dates)).round(1), 'site': site})
+            for site in USGS_SITES
+        ], ignore_index=True)
+        df.name = 'usgs_dv'
+        return df
+    return make
+
+@pytest.fixture
+def usgs_dbs(make_usgs_df):
+    """
+    Build the usgs_dv db of the dashboard (in SHREAD_DB_DIR) from synthetic flows for a month, with the USGS build
+    script, and return its dataframe
+    """
+    from database.FLOW import usgs_to_db
+    from plot_lib import utils
+
+    df = make_usgs_df(pd.date_range('2021-01-01', '2021-01-31'))
+    usgs_to_db.write_db(df, Path(TEST_DB_DIR, 'FLOW'), if_exists='replace', verbose=False)
+    utils.clear_cache()
+    yield df
+    utils.clear_cache()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 11:40:27 2026
+
+Tests of the consolidated site db (database/consolidated_to_db.py) and the dashboard reads from it (plot_lib/utils.py
+read_site, read_sites)
+
+@author: buriona,tclarkin
+"""
+
+from pathlib import Path
+import pandas as pd
+import pytest
+import numpy as np
+from database import app, db, db_utils, consolidated_to_db
+from database.consolidated_config import CONSOLIDATED_BIND, CONSOLIDATED_DB
+from database.FLOW import usgs_to_db
+from database.SNOTEL import snotel_to_db
+from plot_lib import utils
+from conftest import TEST_DB_DIR, USGS_SITES
+
+# A site without data, written first: pandas declares its flow column TEXT
+EMPTY_SITE = '00000001'
+SITES = USGS_SITES + [EMPTY_SITE]
+QRY = "`date` >= :s_date and `date` <= :e_date"
+PARAMS = {'s_date': '2021-01-05', 'e_date': '2021-01-10'}
+
+@pytest.fixture
+def site_dbs(make_usgs_df):
+    """
+    Build usgs_dv (in SHREAD_DB_DIR) from a site without data and the synthetic flows of USGS_SITES, and return the
+    flows
+    """
+    db_path = Path(TEST_DB_DIR, 'FLOW', 'usgs_dv.db')
+    db_path.unlink(missing_ok=True)
+    db_utils.remove_wal_files(db_path)
+    df_empty = pd.DataFrame({'date': pd.to_datetime(['2021-01-06'], utc=True), 'flow': [None], 'site': EMPTY_SITE})
+    df_empty.name = 'usgs_dv'
+    usgs_to_db.write_db(df_empty, db_path.parent, if_exists='replace', verbose=False)
+    df = make_usgs_df(pd.date_range('2021-01-01', '2021-01-31'))
+    usgs_to_db.write_db(df, db_path.parent, if_exists='append', verbose=False)
+    utils.clear_cache()
+    yield df
+    utils.clear_cache()
+
+@pytest.fixture
+def snotel_dbs():
+    """
+    Build snotel_dv (in SHREAD_DB_DIR) from synthetic daily data of two sites with different dates, one without TAVG
+    """
+    rng = np.random.default_rng(0)
+    dfs = list()
+    for site, dates, variables in [
+        ('713_CO_SNTL', pd.date_range('2021-01-01', '2021-01-10', tz='UTC'), ['WTEQ', 'PREC', 'TAVG']),
+        ('386_CO_SNTL', pd.date_range('2021-01-04', '2021-01-15', tz='UTC'), ['WTEQ', 'PREC']),
+    ]:
+        df = pd.DataFrame({'date': dates, 'site': site})
+        for var in variables:
+            df[var] = rng.gamma(2.0, 5.0, len(dates)).round(1)
+        dfs.append(df)
+    df = pd.concat(dfs, ignore_index=True)
+    df.name = 'snotel_dv'
+    snotel_to_db.write_db(df, Path(TEST_DB_DIR, 'SNOTEL'), if_exists='replace', zip_db=False)
+    utils.clear_cache()
+    yield df
+    utils.clear_cache()
+
+@pytest.fixture
+def consolidated(site_dbs, snotel_dbs, monkeypatch):
+    """
+    Build the consolidated db from site_dbs and snotel_dbs and add its bind to the dashboard (as when it is there at
+    start up). Yields a function running func(*args) without the consolidated bind, so on the site dbs.
+    """
+    binds = app.server.config['SQLALCHEMY_BINDS']
+    consolidated_to_db.write_db(TEST_DB_DIR, TEST_DB_DIR, binds=['usgs_dv', 'snotel_dv'])
+    monkeypatch.setitem(binds, CONSOLIDATED_BIND, f'sqlite:///{Path(TEST_DB_DIR, CONSOLIDATED_DB).as_posix()}')
+    utils.clear_cache()
+
+    def on_site_dbs(func, *args):
+        with monkeypatch.context() as m:
+            m.delitem(binds, CONSOLIDATED_BIND)
+            utils.clear_cache()
+            assert not utils.use_consolidated('usgs_dv')
+            try:
+                return func(*args)
+            finally:
+                utils.clear_cache()
+
+    yield on_site_dbs
+    db.get_engine(bind=CONSOLIDATED_BIND).dispose()
+    Path(TEST_DB_DIR, CONSOLIDATED_DB).unlink()
+    db_utils.remove_wal_files(Path(TEST_DB_DIR, CONSOLIDATED_DB))
+    utils.clear_cache()
+
+def test_consolidated_reads_match_site_db(consolidated):
+    assert utils.use_consolidated('usgs_dv')
+    tbl_names = [f'site_{s}' for s in SITES]
+    for tbl_name in tbl_names:
+        expected = consolidated(utils.read_site, 'usgs_dv', tbl_name, QRY, PARAMS)
+        pd.testing.assert_frame_equal(utils.read_site('usgs_dv', tbl_name, QRY, PARAMS), expected)
+    expected = consolidated(utils.read_sites, 'usgs_dv', tbl_names, QRY, PARAMS)
+    site_dfs = utils.read_sites('usgs_dv', tbl_names, QRY, PARAMS)
+    assert list(site_dfs) == tbl_names
+    # Read with the other sites, the missing flows of the site without data are NaN rather than None
+    empty_tbl = f'site_{EMPTY_SITE}'
+    assert site_dfs[empty_tbl]['flow'].isna().all() and expected[empty_tbl]['flow'].isna().all()
+    site_dfs[empty_tbl] = site_dfs[empty_tbl].drop(columns='flow')
+    expected[empty_tbl] = expected[empty_tbl].drop(columns='flow')
+    for tbl_name in tbl_names:
+        pd.testing.assert_frame_equal(site_dfs[tbl_name], expected[tbl_name])
+    # Flows stored as in the site tables, not as text (the first site table declares flow TEXT)
+    assert site_dfs[f'site_{USGS_SITES[0]}']['flow'].dtype == float
+
+def test_newer_site_db_is_read(consolidated, make_usgs_df):
+    df = make_usgs_df(pd.date_range('2021-01-01', '2021-01-31'), seed=1)
+    usgs_to_db.write_db(df, Path(TEST_DB_DIR, 'FLOW'), if_exists='upsert', verbose=False)
+    assert not utils.use_consolidated('usgs_dv')
+    out_df = utils.read_site('usgs_dv', f'site_{USGS_SITES[0]}', QRY, PARAMS)
+    expected = df[(df['site'] == USGS_SITES[0]) & df['date'].between('2021-01-05', '2021-01-09')]
+    assert out_df['flow'].tolist() == expected['flow'].tolist()
+    consolidated_to_db.write_db(TEST_DB_DIR, TEST_DB_DIR, binds=['usgs_dv'])
+    assert utils.use_consolidated('usgs_dv')
+    pd.testing.assert_frame_equal(utils.read_site('usgs_dv', f'site_{USGS_SITES[0]}', QRY, PARAMS), out_df)
+
+def check_many(wide_df, single_dfs, sites):
+    """
+    Check a screen_*_many frame against the single site frames (by site, None for a missing site): a (variable,
+    site) column for every variable and site, on the union of the dates
+    """
+    dates = pd.DatetimeIndex([], tz='UTC')
+    for df in single_dfs.values():
+        if df is not None:
+            dates = dates.union(df.index)
+    variables = {c for df in single_dfs.values() if df is not None for c in df.columns if c != 'date'}
+    assert wide_df.index.equals(dates)
+    assert sorted(wide_df.columns) == sorted((v, s) for v in variables for s in sites)
+    for var, site in wide_df.columns:
+        df = single_dfs[site]
+        # Missing values may be None in a single site frame and NaN with the other sites
+        if (df is None) or (var not in df.columns) or df[var].isna().all():
+            assert wide_df[(var, site)].isna().all()
+        else:
+            pd.testing.assert_series_equal(
+                wide_df[(var, site)], df[var].reindex(dates), check_names=False, check_dtype=False
+            )
+
+@pytest.mark.parametrize('on_consolidated', [False, True])
+def test_screen_many_matches_single_sites(consolidated, on_consolidated):
+    def run(func, *args):
+        return func(*args) if on_consolidated else consolidated(func, *args)
+
+    snotel_sites = ['713_CO_SNTL', '999_CO_SNTL', '386_CO_SNTL']
+    dates = ('2021-01-03', '2021-01-12')
+    # screen_snotel takes the table name (as snow_plot did), screen_snotel_many the sites
+    single_dfs = {s: run(utils.screen_snotel, f'snotel_{s}', *dates) for s in snotel_sites if s != '999_CO_SNTL'}
+    with pytest.raises(ValueError):
+        run(utils.screen_snotel, 'snotel_999_CO_SNTL', *dates)
+    single_dfs['999_CO_SNTL'] = None
+    check_many(run(utils.screen_snotel_many, snotel_sites, *dates), single_dfs, snotel_sites)
+
+    usgs_sites = SITES + ['09999999']
+    single_dfs = {s: run(utils.screen_usgs, s, *dates, 'dv') for s in SITES}
+    single_dfs['09999999'] = None
+    check_many(run(utils.screen_usgs_many, usgs_sites, *dates, 'dv'), single_dfs, usgs_sites)
+    # No sites at all
+    assert run(utils.screen_usgs_many, [], *dates, 'dv').empty
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 22:41:07 2026
+
+Tests of the server-side data store of the dashboard selections (plot_lib/data_store.py)
+
+@author: buriona,tclarkin
+"""
+
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+import pandas as pd
+import pytest
+from plot_lib import data_store, utils
+from conftest import TEST_DB_DIR
+
+def get_selection(basin='NVRN5L_F', start_date='2021-01-05', end_date='2021-01-20', usgs_sel=('09355500',)):
+    return {
+        "basin": basin,
+        "stype": "swe",
+        "elrange": [8000, 11000],
+        "aspects": [0, 360],
+        "slopes": [0, 30],
+        "start_date": start_date,
+        "end_date": end_date,
+        "dtype": "dv",
+        "snotel_sel": [],
+        "csas_sel": [],
+        "usgs_sel": list(usgs_sel),
+        "forecast_sel": [],
+        "offline": True,
+    }
+
+@pytest.fixture
+def store(monkeypatch):
+    """
+    An empty store, with load_data counting its calls per selection (returned as {basin: calls})
+    """
+    monkeypatch.setattr(data_store, '_store', data_store.OrderedDict())
+    loads = dict()
+    lock = threading.Lock()
+
+    def load_data(selection, stamps=None):
+        with lock:
+            loads[selection["basin"]] = loads.get(selection["basin"], 0) + 1
+        return {"basin": selection["basin"]}
+
+    monkeypatch.setattr(data_store, 'load_data', load_data)
+    return loads
+
+def test_load_data_offline(shread_dbs, usgs_dbs, monkeypatch):
+    monkeypatch.setattr(data_store, '_datasets', data_store.OrderedDict())
+    selection = get_selection()
+    data = data_store.load_data(selection)
+    expected = utils.screen_spatial(
+        'swe', '2021-01-05', '2021-01-20', 'NVRN5L_F', [0, 360], [8000, 11000], [0, 30], agg=True
+    )
+    pd.testing.assert_frame_equal(data["snodas"], expected)
+    usgs_df = utils.screen_usgs('09355500', '2021-01-05', '2021-01-20', 'dv')
+    assert data["usgs"][('flow', '09355500')].tolist() == usgs_df['flow'].tolist()
+    assert data["ndfd"] == dict() and data["rfc"] == dict()
+
+def test_load_data_reuses_unchanged_datasets(shread_dbs, usgs_dbs, monkeypatch):
+    monkeypatch.setattr(data_store, '_datasets', data_store.OrderedDict())
+    calls = list()
+
+    def screen_spatial(*args, **kwargs):
+        calls.append(args)
+        return utils.screen_spatial(*args, **kwargs)
+
+    monkeypatch.setattr(data_store, 'screen_spatial', screen_spatial)
+    first = data_store.load_data(get_selection(usgs_sel=()))
+    # A new gage only loads the USGS data; the basin stats are the ones already loaded
+    second = data_store.load_data(get_selection(usgs_sel=('09355500',)))
+    assert len(calls) == 1
+    assert second["snodas"] is first["snodas"]
+    assert ('flow', '09355500') in second["usgs"].columns
+    data_store.load_data(get_selection(end_date='2021-01-25'))
+    assert len(calls) == 2
+
+def test_load_data_drops_rebuilt_datasets(usgs_dbs, make_usgs_df, monkeypatch):
+    from database.FLOW import usgs_to_db
+
+    monkeypatch.setattr(data_store, '_datasets', data_store.OrderedDict())
+    monkeypatch.setattr(data_store, '_store', data_store.OrderedDict())
+    selection = get_selection(basin=None)
+    key, old_data = data_store.load_selection(selection)
+    df = make_usgs_df(pd.date_range('2021-01-01', '2021-01-31'), seed=3)
+    usgs_to_db.write_db(df, Path(TEST_DB_DIR, 'FLOW'), if_exists='replace', verbose=False)
+    # The nightly rebuild of usgs_dv drops the selection and its USGS data, as it does the screen_* results
+    new_data = data_store.get_data({"key": key, "selection": selection})
+    expected = utils.screen_usgs('09355500', '2021-01-05', '2021-01-20', 'dv')['flow'].tolist()
+    assert new_data["usgs"][('flow', '09355500')].tolist() == expected
+    assert expected != old_data["usgs"][('flow', '09355500')].tolist()
+
+def test_downloads_expire_after_cache_ttl(monkeypatch):
+    monkeypatch.setattr(data_store, '_datasets', data_store.OrderedDict())
+    clock = [0.0]
+    monkeypatch.setattr(data_store, 'time', SimpleNamespace(monotonic=lambda: clock[0]))
+    monkeypatch.setattr(utils, 'CACHE_TTL', 60)
+    calls = list()
+
+    def download(site):
+        calls.append(site)
+        return len(calls)
+
+    # A download (no binds) is kept for CACHE_TTL seconds
+    assert data_store.get_dataset([], download, 'a') == 1
+    clock[0] = 59
+    assert data_store.get_dataset([], download, 'a') == 1
+    clock[0] = 60
+    assert data_store.get_dataset([], download, 'a') == 2
+    assert calls == ['a', 'a']
+
+def test_store_selection_expires_after_cache_ttl(store, monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(data_store, 'time', SimpleNamespace(monotonic=lambda: clock[0]))
+    monkeypatch.setattr(utils, 'CACHE_TTL', 60)
+    selection = get_selection()
+    key = data_store.store_selection(selection)
+    clock[0] = 59
+    data_store.get_data({"key": key, "selection": selection})
+    assert store == {"NVRN5L_F": 1}
+    clock[0] = 60
+    data_store.get_data({"key": key, "selection": selection})
+    assert store == {"NVRN5L_F": 2}
+
+def test_store_selection_loads_once(store):
+    selection = get_selection()
+    key = data_store.store_selection(selection)
+    assert data_store.store_selection(dict(selection)) == key
+    assert data_store.get_data({"key": key, "selection": selection}) == {"basin": "NVRN5L_F"}
+    assert store == {"NVRN5L_F": 1}
+
+def test_get_data_reloads_evicted_selection(store, monkeypatch):
+    monkeypatch.setattr(data_store, 'STORE_SIZE', 2)
+    selections = [get_selection(basin) for basin in ['A', 'B', 'C']]
+    keys = [data_store.store_selection(s) for s in selections]
+    assert list(data_store._store) == keys[1:]
+    assert data_store.get_data({"key": keys[0], "selection": selections[0]}) == {"basin": "A"}
+    assert store == {"A": 2, "B": 1, "C": 1}
+    assert len(data_store._store) == 2
+
+def test_store_is_thread_safe(store, monkeypatch):
+    monkeypatch.setattr(data_store, 'STORE_SIZE', 3)
+    selections = [get_selection(f'basin_{i}') for i in range(6)]
+    errors = list()
+
+    def worker(n):
+        try:
+            for i in range(200):
+                selection = selections[(n + i) % len(selections)]
+                key = data_store.store_selection(selection)
+                assert data_store.get_data({"key": key, "selection": selection}) == {"basin": selection["basin"]}
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(data_store._store) == 3
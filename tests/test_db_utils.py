@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:10:40 2026
+
+Tests of the SQLite utilities shared by the build scripts (database/db_utils.py)
+
+@author: buriona,tclarkin
+"""
+
+import os
+import sqlite3
+from pathlib import Path
+from contextlib import ExitStack
+import pandas as pd
+import pytest
+from database import db_utils
+
+@pytest.fixture
+def con():
+    con = sqlite3.connect(':memory:', isolation_level=None)
+    yield con
+    con.close()
+
+def get_indexes(con, tbl_name):
+    return {r[1]: r[2] for r in con.execute(f'pragma index_list("{tbl_name}")')}
+
+def test_create_spatial_index_is_unique(con):
+    con.execute('create table basin ("Date" TEXT, OBJECTID INTEGER, mean REAL)')
+    idx_name = db_utils.create_spatial_index(con, 'basin')
+    assert get_indexes(con, 'basin') == {idx_name: 1}
+    con.execute("insert into basin values ('2021-01-01 00:00:00', 1, 1.0)")
+    with pytest.raises(sqlite3.IntegrityError):
+        con.execute("insert into basin values ('2021-01-01 00:00:00', 1, 2.0)")
+
+def test_create_spatial_index_replaces_old_index_and_duplicates(con):
+    con.execute('create table basin ("Date" TEXT, OBJECTID INTEGER, mean REAL)')
+    con.execute('create index "ix_basin_Date_OBJECTID" on basin ("Date", OBJECTID)')
+    con.executemany('insert into basin values (?, ?, ?)', [
+        ('2021-01-01 00:00:00', 1, 1.0),
+        ('2021-01-01 00:00:00', 2, 2.0),
+        ('2021-01-01 00:00:00', 1, 3.0),
+    ])
+    idx_name = db_utils.create_spatial_index(con, 'basin')
+    assert list(get_indexes(con, 'basin')) == [idx_name]
+    # The last row written of a duplicate key is kept
+    assert con.execute('select OBJECTID, mean from basin order by OBJECTID').fetchall() == [(1, 3.0), (2, 2.0)]
+
+def test_spatial_index_serves_date_range_scans(con):
+    con.execute('create table basin ("Date" TEXT, OBJECTID INTEGER, mean REAL)')
+    idx_name = db_utils.create_spatial_index(con, 'basin')
+    plan = con.execute(
+        'explain query plan select * from basin where "Date" >= ? and "Date" <= ? and OBJECTID in (1, 2)',
+        ('2021-01-01', '2021-01-31')
+    ).fetchall()
+    assert any(idx_name in r[-1] for r in plan)
+
+def write_table(db_path, rows):
+    con = sqlite3.connect(db_path)
+    con.execute('create table if not exists t (x INTEGER)')
+    con.executemany('insert into t values (?)', [(r,) for r in rows])
+    con.commit()
+    con.close()
+
+def read_table(db_path, tbl_name='t'):
+    con = sqlite3.connect(db_path)
+    try:
+        return [r[0] for r in con.execute(f'select x from "{tbl_name}" order by x')]
+    finally:
+        con.close()
+
+def get_pragmas(con):
+    pragmas = ['journal_mode', 'synchronous', 'cache_size', 'temp_store']
+    return {p: con.execute(f'pragma {p}').fetchone()[0] for p in pragmas}
+
+def test_open_build_pragmas(tmp_path):
+    db_path = Path(tmp_path, 'a.db')
+    with db_utils.open_build(db_path) as con:
+        assert get_pragmas(con) == {'journal_mode': 'wal', 'synchronous': 0, 'cache_size': -256000, 'temp_store': 2}
+        assert con.in_transaction
+        con.execute('create table t (x INTEGER)')
+        con.execute('insert into t values (1)')
+    with db_utils.open_build(db_path, db_utils.STREAM_PRAGMAS) as con:
+        assert get_pragmas(con) == {'journal_mode': 'wal', 'synchronous': 0, 'cache_size': -32000, 'temp_store': 1}
+        con.execute('insert into t values (2)')
+    assert read_table(db_path) == [1, 2]
+
+def test_open_build_error_leaves_live_db(tmp_path):
+    db_path = Path(tmp_path, 'a.db')
+    write_table(db_path, [1])
+    with pytest.raises(ValueError):
+        with db_utils.open_build(db_path) as con:
+            con.execute('insert into t values (2)')
+            # The dashboard reads the live db until the swap
+            assert read_table(db_path) == [1]
+            raise ValueError('bad data')
+    assert read_table(db_path) == [1]
+    assert not db_utils.get_build_path(db_path).exists()
+
+def test_open_build_checks_before_swap(tmp_path, capsys):
+    db_path = Path(tmp_path, 'a.db')
+    write_table(db_path, [1])
+    with db_utils.open_build(db_path) as con:
+        con.execute('delete from t')
+    assert 'did not replace' in capsys.readouterr().out
+    assert read_table(db_path) == [1]
+    assert not db_utils.get_build_path(db_path).exists()
+
+def test_commit_build_and_savepoint(tmp_path):
+    db_path = Path(tmp_path, 'a.db')
+    write_table(db_path, [1])
+    build_path = db_utils.get_build_path(db_path)
+    with db_utils.open_build(db_path) as con:
+        con.execute('insert into t values (2)')
+        db_utils.commit_build(con)
+        assert con.in_transaction
+        # Committed to the build copy, not yet swapped in
+        assert read_table(build_path) == [1, 2]
+        assert read_table(db_path) == [1]
+        # A failed table is rolled back on its own
+        with pytest.raises(sqlite3.OperationalError):
+            with db_utils.savepoint(con):
+                con.execute('insert into t values (3)')
+                con.execute('create table t (x INTEGER)')
+        con.execute('insert into t values (4)')
+    assert read_table(db_path) == [1, 2, 4]
+
+def test_open_build_keeps_copy_when_swap_fails(tmp_path, monkeypatch):
+    db_paths = [Path(tmp_path, 'a.db'), Path(tmp_path, 'b.db')]
+    for db_path in db_paths:
+        write_table(db_path, [1])
+    real_replace_db = db_utils.replace_db
+
+    def replace_db(build_path, db_path):
+        if db_path.name == 'a.db':
+            raise PermissionError('in use')
+        real_replace_db(build_path, db_path)
+
+    monkeypatch.setattr(db_utils, 'replace_db', replace_db)
+    with ExitStack() as stack:
+        for db_path in db_paths:
+            stack.enter_context(db_utils.open_build(db_path)).execute('insert into t values (2)')
+    # a.db is left as it was, with its build kept; b.db is still rebuilt
+    assert read_table(db_paths[0]) == [1]
+    assert read_table(db_utils.get_build_path(db_paths[0])) == [1, 2]
+    assert read_table(db_paths[1]) == [1, 2]
+    assert not db_utils.get_build_path(db_paths[1]).exists()
+
+def write_legacy_db(db_path):
+    con = sqlite3.connect(db_path)
+    con.execute(
+        'create table basin ("Date" TEXT, OBJECTID INTEGER, elev_ft INTEGER, slope_d INTEGER, aspct INTEGER, '
+        'nlcd INTEGER, LOCAL_ID TEXT, LOCAL_NAME TEXT, mean REAL)'
+    )
+    con.executemany('insert into basin values (?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+        ('2021-01-01 00:00:00', 1, 8000, 10, 180, 42, 'basin', 'Basin', 1.5),
+        ('2021-01-01 00:00:00', 2, 9000, 20, 90, 42, 'basin', 'Basin', 2.5),
+    ])
+    con.commit()
+    con.close()
+
+def test_migrate_db_normalizes_tables(tmp_path):
+    db_path = Path(tmp_path, 'swe.db')
+    write_legacy_db(db_path)
+    db_utils.migrate_db(db_path)
+    con = sqlite3.connect(db_path)
+    try:
+        assert db_utils.get_columns(con, 'basin') == ['Date', 'OBJECTID', 'mean']
+        assert con.execute('select count(*) from basin_points').fetchone()[0] == 2
+        assert list(get_indexes(con, 'basin')) == ['ux_basin_Date_OBJECTID']
+        assert 'basin_cube' in db_utils.get_tables(con)
+        # ANALYZE was run
+        assert 'sqlite_stat1' in db_utils.get_tables(con)
+    finally:
+        con.close()
+    assert not db_utils.get_build_path(db_path).exists()
+
+def test_migrate_db_leaves_live_db_on_error(tmp_path, monkeypatch):
+    db_path = Path(tmp_path, 'swe.db')
+    write_legacy_db(db_path)
+
+    def write_cube(*args, **kwargs):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    monkeypatch.setattr(db_utils, 'write_cube', write_cube)
+    db_utils.migrate_db(db_path)
+    con = sqlite3.connect(db_path)
+    try:
+        assert db_utils.get_tables(con) == ['basin']
+        assert 'elev_ft' in db_utils.get_columns(con, 'basin')
+    finally:
+        con.close()
+    assert not db_utils.get_build_path(db_path).exists()
+
+def test_replace_db_while_reader_holds_db(tmp_path):
+    db_path = Path(tmp_path, 'a.db')
+    with db_utils.open_build(db_path) as con:
+        con.execute('create table t (x INTEGER)')
+        con.execute('insert into t values (1)')
+    inode = os.stat(db_path).st_ino
+    reader = sqlite3.connect(f'{db_path.as_uri()}?mode=ro', uri=True, isolation_level=None)
+    try:
+        assert reader.execute('pragma journal_mode').fetchone()[0] == 'delete'
+        reader.execute('begin')
+        assert reader.execute('select x from t').fetchall() == [(1,)]
+        with db_utils.open_build(db_path) as con:
+            con.execute('insert into t values (2)')
+        # The build is moved into place: the open connection still reads the old file, new ones read the new
+        assert reader.execute('select x from t').fetchall() == [(1,)]
+        reader.execute('commit')
+        assert reader.execute('select x from t order by x').fetchall() == [(1,)]
+    finally:
+        reader.close()
+    assert os.stat(db_path).st_ino != inode
+    assert read_table(db_path) == [1, 2]
+    assert not db_utils.has_wal_files(db_path)
+    assert not db_utils.get_build_path(db_path).exists()
+
+def test_replace_db_copies_when_db_is_locked(tmp_path, monkeypatch):
+    # Windows doesn't allow the move while the dashboard has the live db open
+    def replace(src, dst):
+        raise PermissionError('in use')
+
+    db_path = Path(tmp_path, 'a.db')
+    write_table(db_path, [1])
+    inode = os.stat(db_path).st_ino
+    monkeypatch.setattr(db_utils.os, 'replace', replace)
+    with db_utils.open_build(db_path) as con:
+        con.execute('insert into t values (2)')
+    assert os.stat(db_path).st_ino == inode
+    assert read_table(db_path) == [1, 2]
+    assert not db_utils.get_build_path(db_path).exists()
+
+def test_replace_db_over_wal_db(tmp_path, monkeypatch):
+    # The checkpoint after the copy can't finish while the reader is open, so don't wait for it
+    monkeypatch.setattr(db_utils, 'CHECKPOINT_TIMEOUT', 0.1)
+    db_path = Path(tmp_path, 'a.db')
+    write_table(db_path, [1])
+    con = sqlite3.connect(db_path)
+    con.execute('pragma journal_mode=WAL')
+    con.close()
+    inode = os.stat(db_path).st_ino
+    # A live db of an earlier build, in WAL mode and open, is copied over rather than replaced
+    reader = sqlite3.connect(f'{db_path.as_uri()}?mode=ro', uri=True)
+    try:
+        assert reader.execute('select x from t').fetchall() == [(1,)]
+        assert db_utils.has_wal_files(db_path)
+        with db_utils.open_build(db_path) as con:
+            con.execute('insert into t values (2)')
+        assert reader.execute('select x from t order by x').fetchall() == [(1,), (2,)]
+    finally:
+        reader.close()
+    assert os.stat(db_path).st_ino == inode
+    # Once closed, the next build sets it back to a rollback journal
+    with db_utils.open_build(db_path) as con:
+        con.execute('insert into t values (3)')
+    con = sqlite3.connect(db_path)
+    try:
+        assert con.execute('pragma journal_mode').fetchone()[0] == 'delete'
+    finally:
+        con.close()
+    assert read_table(db_path) == [1, 2, 3]
+
+def make_basin_df(dates, point_ids):
+    return pd.DataFrame([
+        {'Date': d, 'OBJECTID': p, 'elev_ft': 8000 + p, 'slope_d': p % 45, 'aspct': p % 360, 'nlcd': 42,
+         'LOCAL_ID': 'basin', 'LOCAL_NAME': 'Basin', 'mean': i + p / 10}
+        for i, d in enumerate(dates) for p in point_ids
+    ])
+
+def test_split_and_write_points(con):
+    df_points, df_data = db_utils.split_points(make_basin_df(['2021-01-01', '2021-01-02'], [1, 2]))
+    # One row per point with its attributes; the data keeps (date, point, value)
+    assert df_points.columns.tolist() == db_utils.POINT_COLS
+    assert df_points['OBJECTID'].tolist() == [1, 2]
+    assert df_data.columns.tolist() == ['Date', 'OBJECTID', 'mean']
+    assert len(df_data) == 4
+    assert db_utils.write_points(con, 'basin', df_points) == 'basin_points'
+    # Appending (or 'fail' on an existing table) only adds the new points
+    new_points = db_utils.split_points(make_basin_df(['2021-01-03'], [2, 3]))[0].assign(elev_ft=0)
+    db_utils.write_points(con, 'basin', new_points, 'fail')
+    rows = con.execute('select OBJECTID, elev_ft from basin_points order by OBJECTID').fetchall()
+    assert rows == [(1, 8001), (2, 8002), (3, 0)]
+    assert get_indexes(con, 'basin_points') == {'ux_basin_points_OBJECTID': 1}
+
+def test_normalize_table_keeps_values(con):
+    df = make_basin_df(['2021-01-01', '2021-01-02'], [1, 2])
+    df.to_sql('basin', con, index=False)
+    assert db_utils.normalize_table(con, 'basin')
+    assert db_utils.get_columns(con, 'basin') == ['Date', 'OBJECTID', 'mean']
+    # Joining the points back gives the wide rows
+    joined = pd.read_sql(
+        'select f."Date", f.OBJECTID, elev_ft, slope_d, aspct, nlcd, LOCAL_ID, LOCAL_NAME, mean from basin f '
+        'join basin_points p on p.OBJECTID = f.OBJECTID order by f."Date", f.OBJECTID', con
+    )
+    pd.testing.assert_frame_equal(joined[df.columns], df)
+    assert not db_utils.normalize_table(con, 'basin')
+
+def read_rows(con, tbl_name='t'):
+    return con.execute(f'select * from "{tbl_name}" order by k').fetchall()
+
+def test_write_keyed_modes(con):
+    df = pd.DataFrame({'k': [1, 2, 2], 'v': ['a', 'b', 'c']})
+    # Within df the last row of a key is kept
+    assert db_utils.write_keyed(con, 't', df, ['k'], 'append') == 2
+    assert read_rows(con) == [(1, 'a'), (2, 'c')]
+    new_df = pd.DataFrame({'k': [2, 3], 'v': ['x', 'y']})
+    db_utils.write_keyed(con, 't', new_df, ['k'], 'append')
+    assert read_rows(con) == [(1, 'a'), (2, 'c'), (3, 'y')]
+    db_utils.write_keyed(con, 't', new_df.assign(v=['u', 'w']), ['k'], 'upsert')
+    assert read_rows(con) == [(1, 'a'), (2, 'u'), (3, 'w')]
+    with pytest.raises(ValueError):
+        db_utils.write_keyed(con, 't', new_df, ['k'], 'fail')
+    db_utils.write_keyed(con, 't', new_df, ['k'], 'replace')
+    assert read_rows(con) == [(2, 'x'), (3, 'y')]
+    assert get_indexes(con, 't') == {'ux_t_k': 1}
+
+def test_write_keyed_parts_are_indexed_once(con):
+    for part in [pd.DataFrame({'k': [1, 2], 'v': ['a', 'b']}), pd.DataFrame({'k': [2], 'v': ['c']})]:
+        db_utils.write_keyed(con, 't', part, ['k'], 'append', index=False)
+    assert get_indexes(con, 't') == dict()
+    db_utils.create_key_index(con, 't', ['k'])
+    assert read_rows(con) == [(1, 'a'), (2, 'c')]
+
+@pytest.mark.parametrize('if_exists', ['append', 'upsert'])
+def test_write_keyed_keeps_latest_order_col(con, if_exists):
+    key = ['Date', 'OBJECTID']
+    old_df = pd.DataFrame({'Date': ['d1', 'd2'], 'OBJECTID': 1, 'Date_Init': 'i1', 'mean': [1.0, 2.0]})
+    new_df = pd.DataFrame({'Date': ['d2', 'd3'], 'OBJECTID': 1, 'Date_Init': 'i2', 'mean': [20.0, 30.0]})
+    # Newer forecast, then an older one: the newer values stay
+    db_utils.write_keyed(con, 't', new_df, key, if_exists, order_col='Date_Init')
+    db_utils.write_keyed(con, 't', old_df, key, if_exists, order_col='Date_Init')
+    expected = [('d1', 1, 'i1', 1.0), ('d2', 1, 'i2', 20.0), ('d3', 1, 'i2', 30.0)]
+    assert con.execute('select * from t order by "Date"').fetchall() == expected
+    # And the other way around, in one frame
+    con.execute('drop table t')
+    db_utils.write_keyed(con, 't', pd.concat([new_df, old_df]), key, if_exists, order_col='Date_Init')
+    assert con.execute('select * from t order by "Date"').fetchall() == expected
+
+def test_create_key_index_keeps_latest_order_col(con):
+    con.execute('create table t ("Date" TEXT, OBJECTID INTEGER, "Date_Init" TEXT, mean REAL)')
+    con.executemany('insert into t values (?, ?, ?, ?)', [
+        ('d1', 1, 'i2', 2.0), ('d1', 1, 'i1', 1.0), ('d1', 2, 'i1', 3.0), ('d1', 2, 'i1', 4.0),
+    ])
+    db_utils.create_spatial_index(con, 't', 'Date', 'Date_Init')
+    # The latest init, then the last row written of that init
+    assert con.execute('select * from t order by OBJECTID').fetchall() == [('d1', 1, 'i2', 2.0), ('d1', 2, 'i1', 4.0)]
+
+def test_get_part_mode():
+    # The first part of a table is written with if_exists, the later ones add to it
+    assert db_utils.get_part_mode('replace', 't', set()) == 'replace'
+    assert db_utils.get_part_mode('fail', 't', {'u'}) == 'fail'
+    assert db_utils.get_part_mode('replace', 't', {'t'}) == 'upsert'
+    assert db_utils.get_part_mode('upsert', 't', {'t'}) == 'upsert'
+    assert db_utils.get_part_mode('append', 't', {'t'}) == 'append'
+    assert db_utils.get_part_mode('fail', 't', {'t'}) == 'append'
+
+def test_batch_parts():
+    parts = [
+        ('a', pd.DataFrame({'x': [1, 2]})), ('b', pd.DataFrame({'x': [3]})), ('a', pd.DataFrame({'x': [4, 5]})),
+        ('b', pd.DataFrame({'x': [6]})), ('a', pd.DataFrame({'x': [7]})),
+    ]
+    batches = [(name, df['x'].tolist()) for name, df in db_utils.batch_parts(iter(parts), 5)]
+    # Flushed once 5 rows are waiting, in the order the names were first seen, then the rest
+    assert batches == [('a', [1, 2, 4, 5]), ('b', [3]), ('b', [6]), ('a', [7])]
+    # A batch at least as large as the data is one part per name
+    batches = [(name, df['x'].tolist()) for name, df in db_utils.batch_parts(iter(parts), 100)]
+    assert batches == [('a', [1, 2, 4, 5, 7]), ('b', [3, 6])]
+    assert list(db_utils.batch_parts(iter([]), 5)) == []
+
+def test_get_last_dates_in_utc(tmp_path):
+    db_path = Path(tmp_path, 'site.db')
+    con = sqlite3.connect(db_path)
+    with con:
+        con.execute('create table site_a (date TIMESTAMP, flow REAL)')
+        # As text '2021-02-02 01:00:00+00:00' sorts last, but '2021-02-01 23:00:00-06:00' is later in UTC
+        con.executemany('insert into site_a values (?, ?)', [
+            ('2021-02-01 00:00:00+00:00', 5.0), ('2021-02-02 01:00:00+00:00', 6.0),
+            ('2021-02-01 23:00:00-06:00', 7.0), ('2026-10-18 09:12:44-06:00', -1.0),
+        ])
+        con.execute('create table site_b (date TIMESTAMP, flow REAL)')
+        con.execute('create table other (date TIMESTAMP, flow REAL)')
+    con.close()
+    assert db_utils.get_last_dates(db_path, 'site_', where_qry='"flow" <> -1') == {
+        'a': pd.Timestamp('2021-02-02 05:00', tz='UTC')
+    }
+    assert db_utils.get_last_dates(db_path, 'site_') == {'a': pd.Timestamp('2026-10-18 15:12:44', tz='UTC')}
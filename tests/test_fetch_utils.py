@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:26:14 2026
+
+Tests of the download utilities of the database scripts (database/fetch_utils.py), against a local HTTP server
+
+@author: buriona,tclarkin
+"""
+
+import sys
+import time
+from pathlib import Path
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+import pytest
+# The scripts put database/ on sys.path and import fetch_utils by file name, as the dashboard does
+from database.FLOW import usgs_to_db
+import fetch_utils
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    /flaky/{n}/{key}: 503 for the first n requests of key, then 200. /slow/{key}: 200 after 0.1 s. /missing: 404.
+    """
+    def do_GET(self):
+        server = self.server
+        parts = self.path.strip('/').split('/')
+        with server.lock:
+            server.hits[self.path] = server.hits.get(self.path, 0) + 1
+            hits = server.hits[self.path]
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            if parts[0] == 'slow':
+                time.sleep(0.1)
+            if (parts[0] == 'flaky') and (hits <= int(parts[1])):
+                status = 503
+            elif parts[0] == 'missing':
+                status = 404
+            else:
+                status = 200
+            body = f'{self.path} {hits}'.encode()
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.lock = threading.Lock()
+    server.hits = dict()
+    server.in_flight = 0
+    server.max_in_flight = 0
+    server.url = f'http://127.0.0.1:{server.server_address[1]}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(fetch_utils, 'BACKOFF', 0.001)
+
+def test_get_backoff_is_capped():
+    for attempt in range(1, 20):
+        wait = fetch_utils.get_backoff(attempt)
+        assert 0 <= wait <= min(fetch_utils.BACKOFF_MAX, fetch_utils.BACKOFF * 2 ** (attempt - 1))
+
+def test_retry_call_retries_errors(no_backoff):
+    calls = list()
+
+    def func(x):
+        calls.append(x)
+        if len(calls) < 3:
+            raise requests.ConnectionError('refused')
+        return x * 2
+
+    assert fetch_utils.retry_call(func, 21, retries=3) == 42
+    assert len(calls) == 3
+
+def test_retry_call_gives_up(no_backoff):
+    calls = list()
+
+    def func():
+        calls.append(1)
+        raise requests.Timeout('timed out')
+
+    with pytest.raises(fetch_utils.FetchError, match='failed after 3 tries'):
+        fetch_utils.retry_call(func, retries=2)
+    assert len(calls) == 3
+
+def test_retry_call_other_errors_not_retried(no_backoff):
+    calls = list()
+
+    def func():
+        calls.append(1)
+        raise ValueError('no data')
+
+    with pytest.raises(ValueError):
+        fetch_utils.retry_call(func)
+    assert len(calls) == 1
+
+def test_retry_call_stops_at_deadline(monkeypatch):
+    # Backoff longer than the run deadline: the retry isn't waited for
+    monkeypatch.setattr(fetch_utils, 'get_backoff', lambda attempt: 60)
+
+    def func(item):
+        raise requests.ConnectionError('refused')
+
+    start = time.monotonic()
+    results = fetch_utils.fetch_all(lambda item: fetch_utils.retry_call(func, item), [1], deadline=1)
+    assert results == dict()
+    assert time.monotonic() - start < 5
+
+def test_get_text_retries_status(server, no_backoff):
+    assert fetch_utils.get_text(f'{server.url}/flaky/2/a', retries=3) == '/flaky/2/a 3'
+    with pytest.raises(fetch_utils.FetchError):
+        fetch_utils.get_text(f'{server.url}/flaky/5/b', retries=1)
+    assert server.hits['/flaky/5/b'] == 2
+    # Only RETRY_STATUS responses are retried
+    assert fetch_utils.get_text(f'{server.url}/missing') == '/missing 1'
+
+def test_fetch_all_returns_results_and_skips_failures(server, no_backoff):
+    def fetch(item):
+        if item == 'bad':
+            raise ValueError('bad site')
+        return fetch_utils.get_text(f'{server.url}/flaky/1/{item}')
+
+    items = ['a', 'bad', 'b', 'c']
+    results = fetch_utils.fetch_all(fetch, items)
+    assert results == {item: f'/flaky/1/{item} 2' for item in items if item != 'bad'}
+
+def test_fetch_all_limits_requests_per_host(server, monkeypatch):
+    monkeypatch.setattr(fetch_utils, '_host_slots', dict())
+    items = [str(i) for i in range(12)]
+    start = time.monotonic()
+    results = fetch_utils.fetch_all(
+        lambda item: fetch_utils.get_text(f'{server.url}/slow/{item}'), items, max_workers=8
+    )
+    elapsed = time.monotonic() - start
+    assert len(results) == len(items)
+    assert server.max_in_flight <= fetch_utils.HOST_CONNECTIONS
+    # Concurrent: 12 requests of 0.1 s in 3 rounds of HOST_CONNECTIONS, not 12 in a row
+    assert elapsed < 1.0
+
+def test_database_package_puts_its_dir_on_path():
+    # plot_lib.utils imports fetch_utils by file name whatever was imported before it
+    import database
+    assert str(Path(database.__file__).absolute().resolve().parent) in sys.path
+
+def test_host_slot_limits_holders_per_host(monkeypatch):
+    # The build scripts and the dashboard import fetch_utils by file name: one module, so one set of host slots
+    from plot_lib import utils
+    assert (usgs_to_db.host_slot is fetch_utils.host_slot) and (utils.get_text is fetch_utils.get_text)
+    assert 'database.fetch_utils' not in sys.modules
+
+    monkeypatch.setattr(fetch_utils, '_host_slots', dict())
+    assert fetch_utils.host_slot('http://a.test/x') is fetch_utils.host_slot('http://a.test/y?z=1')
+    lock = threading.Lock()
+    counts = {'in_slot': 0, 'max_in_slot': 0}
+    full = threading.Event()
+
+    def hold():
+        with fetch_utils.host_slot('http://a.test/x'):
+            with lock:
+                counts['in_slot'] += 1
+                counts['max_in_slot'] = max(counts['max_in_slot'], counts['in_slot'])
+                if counts['in_slot'] == fetch_utils.HOST_CONNECTIONS:
+                    full.set()
+            time.sleep(0.05)
+            with lock:
+                counts['in_slot'] -= 1
+
+    threads = [threading.Thread(target=hold) for _ in range(3 * fetch_utils.HOST_CONNECTIONS)]
+    for thread in threads:
+        thread.start()
+    assert full.wait(5)
+    # Another host isn't held up by the full one
+    other = fetch_utils.host_slot('http://b.test/x')
+    assert other.acquire(timeout=0)
+    other.release()
+    for thread in threads:
+        thread.join()
+    assert counts['max_in_slot'] == fetch_utils.HOST_CONNECTIONS
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:12:50 2026
+
+Tests of the RFC build script (database/FLOW/rfc_to_db.py)
+
+The forecast files in data/rfc are in the layout of the CBRFC .fflw1.csv/.fflw24.csv downloads (comment header,
+CRLF line endings, trailing spaces and a missing flow).
+
+@author: buriona,tclarkin
+"""
+
+import sqlite3
+import datetime as dt
+from io import StringIO
+from pathlib import Path
+import pandas as pd
+import pytest
+from database.FLOW import rfc_to_db
+from plot_lib import utils
+from conftest import TEST_DB_DIR
+
+RFC_DATA_DIR = Path(Path(__file__).absolute().parent, 'data', 'rfc')
+
+def read_fixture(name):
+    # As downloaded (requests' .text keeps the CRLFs)
+    return Path(RFC_DATA_DIR, name).read_bytes().decode()
+
+def parse_rfc_legacy(csv_str):
+    """
+    The parser of import_rfc before parse_rfc_csv (a cell at a time), for comparison
+    """
+    csv_io = StringIO(csv_str)
+    rfc_in = csv_io.readlines()
+    rfc_dat = pd.DataFrame()
+    data=False
+    i = 0
+    for line in range(0, len(rfc_in)):
+        text = str(rfc_in[line])
+        text = text.rstrip()
+        if text[:4] == "DATE":
+            columns = text.split(",")
+            data=True
+            continue
+        if data==True:
+            vals = text.split(",")
+            for col in range(0, len(columns)):
+                rfc_dat.loc[i, columns[col]] = vals[col]
+            i = i + 1
+
+    rfc_dat["DATE"] = pd.to_datetime(rfc_dat["DATE"])
+    rfc_dat["flow"] = pd.to_numeric(rfc_dat["FLOW"])
+
+    for i in rfc_dat.index:
+        rfc_dat.loc[i,"datetime"] = rfc_dat.loc[i,"DATE"]+dt.timedelta(hours=int(rfc_dat.loc[i,"TIME"].strip("Z")))
+
+    rfc_dat.index = rfc_dat.datetime
+    rfc_dat = rfc_dat.drop(columns=["DATE","TIME","datetime","FLOW"])
+    rfc_dat = rfc_dat.tz_localize("UTC")
+    return rfc_dat
+
+@pytest.mark.parametrize('name', ['NVRN5.fflw24.csv', 'NVRN5.fflw1.csv'])
+def test_parse_rfc_csv_matches_legacy(name):
+    csv_str = read_fixture(name)
+    rfc_dat = rfc_to_db.parse_rfc_csv(csv_str)
+    pd.testing.assert_frame_equal(rfc_dat, parse_rfc_legacy(csv_str))
+    assert rfc_dat['flow'].isna().sum() == 1
+
+def test_parse_rfc_csv_without_header():
+    with pytest.raises(ValueError):
+        rfc_to_db.parse_rfc_csv('# Colorado Basin River Forecast Center\r\n\r\n')
+
+def save_forecast(csv_dir, name, dtype, days=0):
+    """
+    Save a fixture the way import_rfc saves a download, as a forecast days later
+    """
+    rfc_dat = rfc_to_db.parse_rfc_csv(read_fixture(name))
+    rfc_dat.index = rfc_dat.index + pd.Timedelta(days=days)
+    fcst_dt = rfc_dat.index.min().date().strftime("%Y-%m-%d")
+    rfc_dat["site"] = "NVRN5"
+    rfc_dat["type"] = f"rfc_{dtype}"
+    rfc_dat["fcst_dt"] = fcst_dt
+    rfc_dat.to_csv(Path(csv_dir, f"NVRN5_{dtype}_{fcst_dt}.csv"), index_label="date")
+    return rfc_dat
+
+def test_write_db_keeps_one_row_per_forecast_date(tmp_path):
+    csv_dir = Path(tmp_path, 'rfc_data')
+    csv_dir.mkdir()
+    rfc_dat = save_forecast(csv_dir, 'NVRN5.fflw24.csv', 'dv')
+    save_forecast(csv_dir, 'NVRN5.fflw1.csv', 'iv')
+    # The same forecast downloaded again is written once
+    Path(csv_dir, 'NVRN5_dv_copy.csv').write_bytes(next(csv_dir.glob('NVRN5_dv_*.csv')).read_bytes())
+    df_dict = rfc_to_db.get_dfs(csv_dir)
+    df = df_dict['rfc_dv']
+    assert len(df) == 2 * len(rfc_dat)
+    rfc_to_db.write_db(df, tmp_path, if_exists='replace', verbose=False)
+    con = sqlite3.connect(Path(tmp_path, 'rfc_dv.db'))
+    try:
+        assert con.execute('select count(*) from site_NVRN5').fetchone()[0] == len(rfc_dat)
+        assert con.execute(f'select fcst_dt, rows from {rfc_to_db.RFC_META_TABLE}').fetchall() == [
+            ('2022-04-01', len(rfc_dat))
+        ]
+    finally:
+        con.close()
+
+@pytest.fixture
+def rfc_dbs(tmp_path):
+    """
+    Build the rfc_dv db of the dashboard (in SHREAD_DB_DIR) from two daily forecasts of the fixture, a day apart,
+    and return them
+    """
+    csv_dir = Path(tmp_path, 'rfc_data')
+    csv_dir.mkdir()
+    forecasts = [save_forecast(csv_dir, 'NVRN5.fflw24.csv', 'dv', days) for days in [0, 1]]
+    rfc_to_db.write_db(rfc_to_db.get_dfs(csv_dir)['rfc_dv'], Path(TEST_DB_DIR, 'FLOW'), if_exists='replace',
+                       zip_db=False, verbose=False)
+    utils.clear_cache()
+    yield forecasts
+    utils.clear_cache()
+
+def test_rfc_meta_and_fcst_dt_index(rfc_dbs):
+    con = sqlite3.connect(Path(TEST_DB_DIR, 'FLOW', 'rfc_dv.db'))
+    try:
+        assert con.execute(f'select site, dtype, fcst_dt, rows from {rfc_to_db.RFC_META_TABLE}').fetchall() == [
+            ('NVRN5', 'dv', '2022-04-02', 2 * len(rfc_dbs[0]))
+        ]
+        plan = con.execute('explain query plan select * from site_NVRN5 where fcst_dt = ?', ['2022-04-01']).fetchall()
+        assert 'ix_site_NVRN5_fcst_dt' in str(plan)
+    finally:
+        con.close()
+
+@pytest.mark.parametrize('meta_qry', [None, f'delete from {rfc_to_db.RFC_META_TABLE}',
+                                      f'drop table {rfc_to_db.RFC_META_TABLE}'])
+def test_screen_rfc_last_forecast(rfc_dbs, meta_qry):
+    if meta_qry is not None:
+        # A db without the site in rfc_meta, or built before rfc_meta: the site table is scanned
+        con = sqlite3.connect(Path(TEST_DB_DIR, 'FLOW', 'rfc_dv.db'))
+        with con:
+            con.execute(meta_qry)
+        con.close()
+    out_df, fcst_dt = utils.screen_rfc('NVRN5', 'last', 'dv')
+    assert fcst_dt == '2022-04-02'
+    assert out_df['flow'].tolist() == pytest.approx(rfc_dbs[1]['flow'].tolist(), nan_ok=True)
+    assert out_df.index.equals(rfc_dbs[1].index)
+    out_df, fcst_dt = utils.screen_rfc('NVRN5', '2022-04-01', 'dv')
+    assert out_df.index.equals(rfc_dbs[0].index)
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:14:02 2026
+
+Tests of the SHREAD build scripts (database/SHREAD/shread_snow_to_db.py and shread_ndfd_to_db.py)
+
+@author: buriona,tclarkin
+"""
+
+import sqlite3
+from pathlib import Path
+import pandas as pd
+import pytest
+from database import db_utils
+from database.SHREAD import shread_snow_to_db, shread_ndfd_to_db
+from conftest import BASINS
+
+def read_db(db_path):
+    con = sqlite3.connect(db_path)
+    try:
+        return {
+            t: pd.read_sql(f'select * from "{t}"', con) for t in db_utils.get_tables(con)
+        }, con.execute("select name from sqlite_master where type='index'").fetchall()
+    finally:
+        con.close()
+
+def test_write_dbs_indexes_basin_tables(tmp_path, write_snodas_csvs):
+    csv_dir = write_snodas_csvs(Path(tmp_path, 'data'), pd.date_range('2021-01-01', '2021-01-03'))
+    shread_snow_to_db.write_dbs(csv_dir, tmp_path, if_exists='replace')
+    for sensor in ['swe', 'sd']:
+        tables, indexes = read_db(Path(tmp_path, f'{sensor}.db'))
+        for basin_id in BASINS:
+            assert len(tables[basin_id]) == 3 * 50
+            assert (f'ux_{basin_id}_Date_OBJECTID',) in indexes
+
+def test_iter_dfs_splits_chunks_by_type(tmp_path, write_snodas_csvs):
+    csv_dir = write_snodas_csvs(Path(tmp_path, 'data'), pd.date_range('2021-01-01', '2021-01-02'))
+    # Types without a db are skipped
+    csv_path = Path(csv_dir, 'snodas_20210101.csv')
+    df = pd.read_csv(csv_path)
+    pd.concat([df, df[df['Type'] == 'swe'].assign(Type='albedo')]).to_csv(csv_path, index=False)
+    rows = dict()
+    for sensor, df in shread_snow_to_db.iter_dfs(csv_dir, chunk_rows=30):
+        assert 'Type' not in df.columns
+        assert 0 < len(df) <= 30
+        assert isinstance(df['LOCAL_ID'].dtype, pd.CategoricalDtype)
+        rows[sensor] = rows.get(sensor, 0) + len(df)
+    # 2 files x 2 basins x 50 points of each type
+    assert rows == {'swe': 200, 'sd': 200}
+
+def write_ndfd_csv(csv_path, make_shread_df, date_init, dates, seed=0, ndfd_types=('mint', 'qpf')):
+    """
+    Write a synthetic NDFD shread.py output file of a forecast (rows of ndfd_types, with every column of COL_TYPES)
+    """
+    dfs = list()
+    for j, ndfd_type in enumerate(ndfd_types):
+        df = make_shread_df(dates, n_points=20, seed=seed + j)
+        df = df.rename(columns={'Date': 'Date_Valid'})
+        df.insert(1, 'Date_Init', date_init)
+        df.insert(2, 'Type', ndfd_type)
+        for col in shread_ndfd_to_db.DROP_COLS:
+            df[col] = 0
+        dfs.append(df)
+    df = pd.concat(dfs)
+    df['Date_Valid'] = df['Date_Valid'].dt.strftime('%Y-%m-%d')
+    df.to_csv(csv_path, index=False)
+    return df
+
+@pytest.mark.parametrize('names', [('ndfd_a.csv', 'ndfd_b.csv'), ('ndfd_b.csv', 'ndfd_a.csv')])
+def test_ndfd_keeps_latest_init(tmp_path, make_shread_df, names):
+    csv_dir = Path(tmp_path, 'data')
+    csv_dir.mkdir()
+    # Two forecasts overlapping on Jan 3-4; either can be read first
+    old_df = write_ndfd_csv(
+        Path(csv_dir, names[0]), make_shread_df, '2021-01-01', pd.date_range('2021-01-02', '2021-01-04')
+    )
+    new_df = write_ndfd_csv(
+        Path(csv_dir, names[1]), make_shread_df, '2021-01-02', pd.date_range('2021-01-03', '2021-01-05'), seed=10
+    )
+    expected = pd.concat([old_df[old_df['Date_Valid'] < '2021-01-03'], new_df])
+    expected = expected[expected['Type'] == 'qpf'].sort_values(['LOCAL_ID', 'Date_Valid', 'OBJECTID'])
+
+    def check():
+        tables, _ = read_db(Path(tmp_path, 'qpf.db'))
+        for basin_id in BASINS:
+            df = tables[basin_id].sort_values(['Date', 'OBJECTID'])
+            df_basin = expected[expected['LOCAL_ID'] == basin_id]
+            assert df['Date'].str[:10].tolist() == df_basin['Date_Valid'].tolist()
+            assert df['Date_Init'].tolist() == df_basin['Date_Init'].tolist()
+            assert df['mean'].tolist() == df_basin['mean'].tolist()
+
+    shread_ndfd_to_db.write_dbs(csv_dir, tmp_path, if_exists='replace', chunk_rows=70, batch_rows=100)
+    check()
+    # Appending the older forecast again leaves the newer one
+    Path(csv_dir, names[1]).unlink()
+    shread_ndfd_to_db.write_dbs(csv_dir, tmp_path, if_exists='append')
+    check()
+
+def assert_same_dbs(db_path, other_path):
+    tables, indexes = read_db(db_path)
+    other_tables, other_indexes = read_db(other_path)
+    assert sorted(tables) == sorted(other_tables)
+    assert sorted(indexes) == sorted(other_indexes)
+    for tbl_name, df in tables.items():
+        assert len(df) > 0
+        cols = list(df.columns)
+        pd.testing.assert_frame_equal(
+            df.sort_values(cols, ignore_index=True), other_tables[tbl_name][cols].sort_values(cols, ignore_index=True)
+        )
+
+def test_snow_streaming_matches_whole_files(tmp_path, write_snodas_csvs):
+    csv_dir = write_snodas_csvs(Path(tmp_path, 'data'), pd.date_range('2021-01-01', '2021-01-06'), n_points=30)
+    stream_dir, whole_dir = Path(tmp_path, 'stream'), Path(tmp_path, 'whole')
+    stream_dir.mkdir()
+    whole_dir.mkdir()
+    # Chunks and batches smaller than a file (and than a basin of a date)
+    shread_snow_to_db.write_dbs(csv_dir, stream_dir, if_exists='replace', chunk_rows=25, batch_rows=70)
+    for df in shread_snow_to_db.get_dfs(csv_dir).values():
+        shread_snow_to_db.write_db(df, whole_dir, if_exists='replace')
+    for sensor in ['swe', 'sd']:
+        assert_same_dbs(Path(stream_dir, f'{sensor}.db'), Path(whole_dir, f'{sensor}.db'))
+
+def test_ndfd_streaming_matches_whole_files(tmp_path, make_shread_df):
+    csv_dir = Path(tmp_path, 'data')
+    csv_dir.mkdir()
+    # get_dfs reads every type
+    sensors = shread_ndfd_to_db.SENSORS
+    for name, date_init, dates, seed in [
+        ('ndfd_a.csv', '2021-01-01', pd.date_range('2021-01-02', '2021-01-04'), 0),
+        ('ndfd_b.csv', '2021-01-02', pd.date_range('2021-01-03', '2021-01-05'), 10),
+    ]:
+        write_ndfd_csv(Path(csv_dir, name), make_shread_df, date_init, dates, seed, sensors)
+    stream_dir, whole_dir = Path(tmp_path, 'stream'), Path(tmp_path, 'whole')
+    stream_dir.mkdir()
+    whole_dir.mkdir()
+    shread_ndfd_to_db.write_dbs(csv_dir, stream_dir, if_exists='replace', chunk_rows=100, batch_rows=150)
+    for df in shread_ndfd_to_db.get_dfs(csv_dir).values():
+        shread_ndfd_to_db.write_db(df, whole_dir, if_exists='replace')
+    for sensor in sensors:
+        assert_same_dbs(Path(stream_dir, f'{sensor}.db'), Path(whole_dir, f'{sensor}.db'))
+
+def get_basin_dates(basin_dates):
+    return {basin_id: sorted(d.strftime('%Y-%m-%d') for d in dates) for basin_id, dates in basin_dates.items()}
+
+def test_write_basins_records_written_dates(tmp_path, make_shread_df):
+    con = sqlite3.connect(Path(tmp_path, 'swe.db'))
+
+    def write(dates, if_exists, n_points=50):
+        basin_dates = dict()
+        df = make_shread_df(pd.to_datetime(dates), n_points)
+        shread_snow_to_db.write_basins(con, df, 'swe.db', if_exists, basin_dates=basin_dates)
+        return get_basin_dates(basin_dates)
+
+    try:
+        assert write(['2021-01-01', '2021-01-02', '2021-01-03'], 'replace') == {
+            basin_id: ['2021-01-01', '2021-01-02', '2021-01-03'] for basin_id in BASINS
+        }
+        # Appending only writes the dates not in the table, or the points not in a date
+        assert write(['2021-01-02', '2021-01-03', '2021-01-04'], 'append') == {
+            basin_id: ['2021-01-04'] for basin_id in BASINS
+        }
+        assert write(['2021-01-01', '2021-01-03'], 'append', n_points=60) == {
+            basin_id: ['2021-01-01', '2021-01-03'] for basin_id in BASINS
+        }
+        assert write(['2021-01-02'], 'append') == {basin_id: [] for basin_id in BASINS}
+        # Upserting rewrites every date
+        assert write(['2021-01-02'], 'upsert') == {basin_id: ['2021-01-02'] for basin_id in BASINS}
+    finally:
+        con.close()
+
+def test_ndfd_write_basins_records_later_forecasts(tmp_path, make_shread_df):
+    con = sqlite3.connect(Path(tmp_path, 'qpf.db'))
+
+    def write(date_init, dates, if_exists):
+        basin_dates = dict()
+        df = make_shread_df(pd.to_datetime(dates), 20)
+        df.insert(1, db_utils.INIT_FIELD, date_init)
+        shread_ndfd_to_db.write_basins(con, df, 'qpf.db', if_exists, basin_dates=basin_dates)
+        return get_basin_dates(basin_dates)
+
+    try:
+        write('2021-01-02', ['2021-01-03', '2021-01-04'], 'replace')
+        # An older forecast only adds the dates not in the table, a newer one replaces the stored rows
+        assert write('2021-01-01', ['2021-01-02', '2021-01-03'], 'append') == {
+            basin_id: ['2021-01-02'] for basin_id in BASINS
+        }
+        assert write('2021-01-03', ['2021-01-04', '2021-01-05'], 'append') == {
+            basin_id: ['2021-01-04', '2021-01-05'] for basin_id in BASINS
+        }
+    finally:
+        con.close()
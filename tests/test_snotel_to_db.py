@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 22:58:36 2026
+
+Tests of the SNOTEL build script (database/SNOTEL/snotel_to_db.py)
+
+@author: buriona,tclarkin
+"""
+
+import threading
+import datetime as dt
+from io import StringIO
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import pandas as pd
+import pytest
+from database.SNOTEL import snotel_to_db
+
+SNOTEL_SITES = pd.DataFrame({
+    'triplet': ['713_CO_SNTL', '386_CO_SNTL'],
+    'name': ['RED MOUNTAIN PASS', 'EAST WILLOW CREEK'],
+    'state': ['CO', 'CO'],
+})
+
+def make_por_csv(years, seed=0):
+    """
+    Synthetic NRCS period of record csv: a row per month-day of a leap water year (Oct 1 to Sep 30), a column per
+    water year (Feb 29 only has data in leap years, and random gaps), then the statistics columns
+    """
+    rng = np.random.default_rng(seed)
+    mds = pd.date_range('2019-10-01', '2020-09-30').strftime('%m-%d')
+    df = pd.DataFrame(index=pd.Index(mds, name='date'))
+    for year in years:
+        values = rng.gamma(2.0, 5.0, len(mds)).round(1)
+        values[rng.random(len(mds)) < 0.1] = np.nan
+        if year % 4:
+            values[list(mds).index('02-29')] = np.nan
+        df[str(year)] = values
+    df['Min'] = df.min(axis=1)
+    df["Median ('91-'20)"] = df[[str(year) for year in years]].median(axis=1)
+    return df.to_csv()
+
+def reshape_por_legacy(f, var):
+    """
+    The period of record reshape of import_snotel before reshape_por (a loop per water year), for comparison
+    """
+    df_index = pd.date_range(dt.datetime.strptime(f"{f.index[0]}-{int(f.columns[0])-1}","%m-%d-%Y"),
+                               dt.datetime.today(),
+                               freq="D",
+                               tz='UTC')
+    snotel_in = pd.DataFrame(index=df_index)
+    for year in f.columns:
+        try:
+            int(year)
+        except ValueError:
+            continue
+        year_data = f.loc[:,year].dropna()
+        year_index = list()
+        for i in year_data.index:
+            if int(i[:2])>=10:
+                year_index.append(dt.datetime.strptime(f"{i}-{int(year)-1}","%m-%d-%Y"))
+            else:
+                year_index.append(dt.datetime.strptime(f"{i}-{int(year)}", "%m-%d-%Y"))
+        year_data.index = pd.DatetimeIndex(year_index,tz="utc")
+        snotel_in.loc[year_data.index,var] = year_data
+    return snotel_in
+
+def test_reshape_por_matches_legacy():
+    f = pd.read_csv(StringIO(make_por_csv(range(2012, 2022))), index_col=0)
+    for var in ['WTEQ', 'PREC']:
+        df = snotel_to_db.reshape_por(f, var)
+        pd.testing.assert_frame_equal(df, reshape_por_legacy(f, var))
+
+def test_reshape_por_dates():
+    f = pd.read_csv(StringIO(make_por_csv([2019, 2020])), index_col=0)
+    df = snotel_to_db.reshape_por(f, 'WTEQ')
+    assert df.index[0] == pd.Timestamp('2018-10-01', tz='UTC')
+    assert df['WTEQ'].dropna().size == f[['2019', '2020']].notna().sum().sum()
+    # Oct-Dec are in the previous calendar year; Feb 29 only exists in the leap water year (2020)
+    for md, year, date in [('10-01', '2019', '2018-10-01'), ('12-31', '2020', '2019-12-31'),
+                           ('02-29', '2020', '2020-02-29'), ('09-30', '2020', '2020-09-30')]:
+        value = f.loc[md, year]
+        assert (df.loc[pd.Timestamp(date, tz='UTC'), 'WTEQ'] == value) or (np.isnan(value))
+    assert not df.index.duplicated().any()
+
+class ReportHandler(BaseHTTPRequestHandler):
+    """
+    Serves the daily report (server.report) of the NRCS report generator for any request
+    """
+    def do_GET(self):
+        body = self.server.report.encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def report_server():
+    """
+    Local stand-in for SNOTEL_REPORT_URL, with a report from 6 days ago to today (WTEQ, SNWD, PREC, TAVG)
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ReportHandler)
+    dates = pd.date_range(pd.Timestamp.today().normalize() - pd.Timedelta(days=6), periods=7)
+    report = pd.DataFrame({
+        'Date': dates.strftime('%Y-%m-%d'),
+        'Snow Water Equivalent (in) Start of Day Values': np.arange(7) + 10.0,
+        'Snow Depth (in) Start of Day Values': np.arange(7) + 30.0,
+        'Precipitation Accumulation (in) Start of Day Values': [20.0, 20.5, 20.5, 21.0, 21.2, 21.2, 21.9],
+        'Air Temperature Average (degF)': np.arange(7) + 20.0,
+    })
+    server.report = '#Red Mountain Pass (713)\n#Daily values\n' + report.to_csv(index=False)
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/report'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_incremental_update_reads_only_this_run(tmp_path, report_server, monkeypatch):
+    monkeypatch.setattr(snotel_to_db, 'SNOTEL_REPORT_URL', report_server.url)
+    csv_dir = Path(tmp_path, 'data')
+    csv_dir.mkdir()
+    # The csv of a site from an earlier run, which isn't downloaded this time
+    pd.DataFrame({
+        'date': pd.date_range('2020-01-01', periods=3, tz='UTC'), 'site': '386_CO_SNTL',
+        'WTEQ': 1.0, 'SNWD': 2.0, 'PREC': 0.0, 'TAVG': 30.0,
+    }).to_csv(Path(csv_dir, '386_CO_SNTL.csv'), index=False)
+    start_date = pd.Timestamp.today().normalize() - pd.Timedelta(days=4)
+    csv_paths = snotel_to_db.fetch_all(
+        lambda site_triplet: snotel_to_db.import_snotel(
+            site_triplet, SNOTEL_SITES, out_dir=csv_dir, start_date=start_date
+        ),
+        ['713_CO_SNTL']
+    )
+    assert csv_paths == {'713_CO_SNTL': Path(csv_dir, '713_CO_SNTL.csv')}
+    df = snotel_to_db.get_dfs(csv_dir, data_files=list(csv_paths.values()))['snotel_dv']
+    assert set(df['site']) == {'713_CO_SNTL'}
+    # From the start date on, with the precip accumulation as daily increments
+    assert df['date'].min() == start_date.tz_localize('UTC')
+    assert df['WTEQ'].tolist() == [12.0, 13.0, 14.0, 15.0, 16.0]
+    assert df['PREC'].tolist() == pytest.approx([0.0, 0.5, 0.2, 0.0, 0.7])
+    # Without data_files every csv in the dir is read
+    df = snotel_to_db.get_dfs(csv_dir)['snotel_dv']
+    assert set(df['site']) == {'713_CO_SNTL', '386_CO_SNTL'}
+
+def test_incremental_update_without_new_data(tmp_path, report_server, monkeypatch, capsys):
+    monkeypatch.setattr(snotel_to_db, 'SNOTEL_REPORT_URL', report_server.url)
+    # A window after the last day of the report: the csv has no rows
+    start_date = pd.Timestamp.today().normalize() + pd.Timedelta(days=1)
+    csv_path = snotel_to_db.import_snotel('713_CO_SNTL', SNOTEL_SITES, out_dir=tmp_path, start_date=start_date)
+    assert report_server.url not in capsys.readouterr().out
+    df = snotel_to_db.get_dfs(tmp_path, data_files=[csv_path])['snotel_dv']
+    assert df.empty and (df.name == 'snotel_dv')
+    assert list(df.columns) == list(snotel_to_db.COL_TYPES)
+
+def test_get_start_dates(tmp_path):
+    df = pd.DataFrame({
+        'date': pd.date_range('2021-01-01', periods=5, tz='UTC'), 'site': '713_CO_SNTL',
+        'WTEQ': 1.0, 'SNWD': 2.0, 'PREC': 0.0, 'TAVG': 30.0,
+    })
+    df.name = 'snotel_dv'
+    snotel_to_db.write_db(df, tmp_path, if_exists='replace', zip_db=False)
+    assert snotel_to_db.get_start_dates(tmp_path, lookback=2) == {'713_CO_SNTL': pd.Timestamp('2021-01-03', tz='UTC')}
+    assert snotel_to_db.get_start_dates(Path(tmp_path, 'missing')) == dict()
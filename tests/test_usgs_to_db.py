@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:49:21 2026
+
+Tests of the USGS build script (database/FLOW/usgs_to_db.py)
+
+@author: buriona,tclarkin
+"""
+
+import sqlite3
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import requests
+import pytest
+from database.FLOW import usgs_to_db
+import fetch_utils
+from conftest import USGS_SITES
+
+def read_site(db_path, site):
+    con = sqlite3.connect(db_path)
+    try:
+        df = pd.read_sql(f'select * from "site_{site}" order by "date"', con)
+    finally:
+        con.close()
+    df['date'] = pd.to_datetime(df['date'], utc=True)
+    return df
+
+def test_get_start_dates(tmp_path, make_usgs_df):
+    assert usgs_to_db.get_start_dates('dv', tmp_path) == dict()
+    df = make_usgs_df(pd.date_range('2021-01-01', '2021-01-31'))
+    usgs_to_db.write_db(df, tmp_path, if_exists='replace', verbose=False)
+    # The last stored date, less USGS_LOOKBACK days
+    assert usgs_to_db.get_start_dates('dv', tmp_path) == {site: '2021-01-29' for site in USGS_SITES}
+
+def test_get_start_dates_skips_no_data_rows(tmp_path, make_usgs_df):
+    df = make_usgs_df(pd.date_range('2021-01-01', '2021-01-31'))
+    usgs_to_db.write_db(df, tmp_path, if_exists='replace', verbose=False)
+    # A later run where the first gage had no data: import_nwis writes a row at the time of the request
+    no_data = pd.DataFrame({
+        'date': [pd.Timestamp.now(tz='UTC')], 'flow': [usgs_to_db.NO_DATA_FLOW], 'site': [USGS_SITES[0]]
+    })
+    no_data.name = 'usgs_dv'
+    usgs_to_db.write_db(no_data, tmp_path, if_exists='upsert', verbose=False)
+    assert usgs_to_db.get_start_dates('dv', tmp_path) == {site: '2021-01-29' for site in USGS_SITES}
+
+def test_incremental_upsert_resumes(tmp_path, make_usgs_df):
+    df = make_usgs_df(pd.date_range('2021-01-01', '2021-01-31'))
+    usgs_to_db.write_db(df, tmp_path, if_exists='replace', verbose=False)
+    start_date = usgs_to_db.get_start_dates('dv', tmp_path)[USGS_SITES[0]]
+    # Revised provisional flows of the lookback days, and the days since
+    new_df = make_usgs_df(pd.date_range(start_date, '2021-02-05'), seed=1)
+    usgs_to_db.write_db(new_df, tmp_path, if_exists='upsert', verbose=False)
+    for site in USGS_SITES:
+        out_df = read_site(Path(tmp_path, 'usgs_dv.db'), site)
+        expected = pd.concat([df[df['date'] < start_date], new_df]).query('site == @site')
+        assert out_df['date'].tolist() == expected['date'].tolist()
+        assert out_df['flow'].tolist() == expected['flow'].tolist()
+
+def test_get_dfs_reads_data_files(tmp_path, make_usgs_df):
+    df = make_usgs_df(pd.date_range('2021-01-01', '2021-01-10'))
+    df['type'] = 'usgs_dv'
+    csv_paths = list()
+    for site, df_site in df.groupby('site'):
+        csv_path = Path(tmp_path, f'{site}_dv.csv')
+        df_site.to_csv(csv_path, index=False)
+        csv_paths.append(csv_path)
+    df_dict = usgs_to_db.get_dfs(tmp_path, data_files=csv_paths[:1])
+    assert set(df_dict['usgs_dv']['site']) == {USGS_SITES[0]}
+    assert df_dict['usgs_iv'].empty
+    df_dict = usgs_to_db.get_dfs(tmp_path)
+    assert set(df_dict['usgs_dv']['site']) == set(USGS_SITES)
+
+class FakeNwis:
+    """
+    Stand-in for dataretrieval.nwis.get_record: records the requests and answers them with flows of the requested
+    window (or raises the queued errors first)
+    """
+    def __init__(self, errors=None, empty=False):
+        self.calls = list()
+        self.errors = list(errors or [])
+        self.empty = empty
+
+    def get_record(self, sites=None, start=None, end=None, service=None, parameterCd=None):
+        self.calls.append({'sites': sites, 'start': start, 'end': end, 'service': service, 'parameterCd': parameterCd})
+        if self.errors:
+            raise self.errors.pop(0)
+        if self.empty:
+            return pd.DataFrame()
+        if service == 'dv':
+            index = pd.date_range(start, end, freq='D', tz='UTC')
+            flows = [float(i) for i in range(len(index))]
+            # A missing and a negative (e.g. equipment) value, both stored as -1
+            flows[1] = np.nan
+            flows[2] = -999.0
+            return pd.DataFrame({'00060_Mean': flows}, index=index)
+        index = pd.date_range(start, end, freq='15min', tz='America/Denver')
+        return pd.DataFrame({'00060': [float(i) for i in range(len(index))]}, index=index)
+
+@pytest.fixture
+def fake_nwis(monkeypatch):
+    """
+    Patches usgs_to_db.nwis.get_record with a FakeNwis (the requests go through usgs_to_db.get_nwis_record)
+    """
+    def patch(**kwargs):
+        fake = FakeNwis(**kwargs)
+        monkeypatch.setattr(usgs_to_db.nwis, 'get_record', fake.get_record)
+        monkeypatch.setattr(fetch_utils, 'BACKOFF', 0.001)
+        return fake
+    return patch
+
+def test_import_nwis_dv_upserts_window(tmp_path, make_usgs_df, fake_nwis):
+    df = make_usgs_df(pd.date_range('2021-01-01', '2021-01-31'))
+    usgs_to_db.write_db(df, tmp_path, if_exists='replace', verbose=False)
+    start_dates = usgs_to_db.get_start_dates('dv', tmp_path)
+    fake = fake_nwis()
+    site = USGS_SITES[0]
+    csv_path = usgs_to_db.import_nwis(site, start_dates[site], '2021-02-05', 'dv', tmp_path, no_data_row=False)
+    assert fake.calls == [{
+        'sites': site, 'start': '2021-01-29', 'end': '2021-02-05', 'service': 'dv', 'parameterCd': '00060'
+    }]
+    new_df = usgs_to_db.get_dfs(tmp_path, data_files=[csv_path])['usgs_dv']
+    new_df['date'] = pd.to_datetime(new_df['date'], utc=True)
+    usgs_to_db.write_db(new_df, tmp_path, if_exists='upsert', verbose=False)
+    out_df = read_site(Path(tmp_path, 'usgs_dv.db'), site)
+    assert out_df['date'].tolist() == pd.date_range('2021-01-01', '2021-02-05', tz='UTC').tolist()
+    old_flows = df[(df['site'] == site) & (df['date'] < '2021-01-29')]['flow'].tolist()
+    assert out_df['flow'].tolist() == old_flows + [0.0, -1.0, -1.0, 3.0, 4.0, 5.0, 6.0, 7.0]
+    # The other gage is left alone
+    other = USGS_SITES[1]
+    out_other = read_site(Path(tmp_path, 'usgs_dv.db'), other)
+    assert out_other['flow'].tolist() == df[df['site'] == other]['flow'].tolist()
+
+def test_import_nwis_iv_window(tmp_path, fake_nwis):
+    fake = fake_nwis()
+    site = USGS_SITES[0]
+    csv_path = usgs_to_db.import_nwis(site, '2021-02-01', '2021-02-02', 'iv', tmp_path, no_data_row=False)
+    assert fake.calls[0]['start'] == '2021-02-01'
+    assert fake.calls[0]['service'] == 'iv'
+    df_dict = usgs_to_db.get_dfs(tmp_path, data_files=[csv_path])
+    assert df_dict['usgs_dv'].empty
+    new_df = df_dict['usgs_iv']
+    new_df['date'] = pd.to_datetime(new_df['date'], utc=True)
+    # 15 minute flows from local midnight, stored in UTC
+    assert new_df['date'].iloc[0] == pd.Timestamp('2021-02-01 07:00', tz='UTC')
+    assert (new_df['date'].diff().dropna() == pd.Timedelta(minutes=15)).all()
+    usgs_to_db.write_db(new_df, tmp_path, if_exists='upsert', verbose=False)
+    out_df = read_site(Path(tmp_path, 'usgs_iv.db'), site)
+    assert out_df['flow'].tolist() == new_df['flow'].tolist()
+
+def test_import_nwis_retries_io_errors(fake_nwis):
+    fake = fake_nwis(errors=[requests.ConnectionError('refused')])
+    out = usgs_to_db.import_nwis(USGS_SITES[0], '2021-01-01', '2021-01-05', 'dv')
+    assert len(fake.calls) == 2
+    assert len(out) == 5
+
+def test_import_nwis_without_data(tmp_path, fake_nwis):
+    # ValueError (bad request or no data) is not retried
+    fake = fake_nwis(errors=[ValueError('no sites/data found')])
+    out = usgs_to_db.import_nwis(USGS_SITES[0], '2021-01-01', '2021-01-05', 'dv')
+    assert len(fake.calls) == 1
+    assert out['flow'].tolist() == [usgs_to_db.NO_DATA_FLOW]
+    assert out['site'].tolist() == [USGS_SITES[0]]
+    fake_nwis(empty=True)
+    out = usgs_to_db.import_nwis(USGS_SITES[0], '2021-01-01', '2021-01-05', 'dv')
+    assert out['flow'].tolist() == [usgs_to_db.NO_DATA_FLOW]
+    # Incremental updates write no row (see get_start_dates)
+    out = usgs_to_db.import_nwis(USGS_SITES[0], '2021-01-01', '2021-01-05', 'dv', no_data_row=False)
+    assert out.empty
+
+def test_get_dfs_without_new_data(tmp_path, fake_nwis):
+    fake_nwis(errors=[ValueError('no sites/data found'), ValueError('no sites/data found')])
+    csv_paths = [
+        usgs_to_db.import_nwis(USGS_SITES[0], '2021-01-01', '2021-01-05', dtype, tmp_path, no_data_row=False)
+        for dtype in ['dv', 'iv']
+    ]
+    df_dict = usgs_to_db.get_dfs(tmp_path, data_files=csv_paths)
+    for name, df in df_dict.items():
+        assert df.empty
+        assert df.name == name
+        assert list(df.columns) == ['date', 'flow', 'site']
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:18:31 2026
+
+Tests of the dashboard data utilities (plot_lib/utils.py), reading dbs built in SHREAD_DB_DIR (see conftest.py)
+
+@author: buriona,tclarkin
+"""
+
+import sqlite3
+from pathlib import Path
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import OperationalError
+from plot_lib import utils
+from database import db_engines
+from database.SHREAD import shread_snow_to_db
+from conftest import TEST_DB_DIR
+
+def read_basin(sensor, basin):
+    """
+    Rows of a basin table joined with its points table, read directly from the db
+    """
+    con = sqlite3.connect(Path(TEST_DB_DIR, 'SHREAD', f'{sensor}.db'))
+    try:
+        df = pd.read_sql(
+            f'select f.*, p.elev_ft, p.slope_d, p.aspct from "{basin}" f '
+            f'join "{basin}_points" p on p.OBJECTID = f.OBJECTID', con
+        )
+    finally:
+        con.close()
+    df['Date'] = pd.to_datetime(df['Date'])
+    return df
+
+def test_screen_spatial_filters_points(shread_dbs):
+    df = read_basin('swe', 'NVRN5L_F')
+    # The rows are compared as text in the query, so an end date without a time excludes that day
+    expected = df[
+        (df['Date'] >= '2021-01-05') & (df['Date'] < '2021-01-20')
+        & df['elev_ft'].between(8000, 11000) & df['slope_d'].between(0, 30) & df['aspct'].between(90, 270)
+    ]
+    out_df = utils.screen_spatial('swe', '2021-01-05', '2021-01-20', 'NVRN5L_F', [90, 270], [8000, 11000], [0, 30])
+    assert len(out_df) == len(expected) > 0
+    assert sorted(zip(out_df['OBJECTID'], out_df['mean'])) == sorted(zip(expected['OBJECTID'], expected['mean']))
+    assert str(out_df.index.tz) == 'UTC'
+
+def test_screen_spatial_reads_rebuilt_db(shread_dbs, tmp_path, write_snodas_csvs):
+    args = ('swe', '2021-01-05', '2021-01-20', 'NVRN5L_F', [90, 270], [8000, 11000], [0, 30])
+    old_df = utils.screen_spatial(*args)
+    # The rebuild is swapped in while the dashboard's pooled connections are open, and the pool and cached results
+    # are dropped for the new db (no clear_cache)
+    engine = utils.get_engine('swe')
+    pool = engine.pool
+    assert pool.checkedin() > 0
+    csv_dir = write_snodas_csvs(Path(tmp_path, 'rebuild'), shread_dbs, n_points=60, seed=1)
+    shread_snow_to_db.write_dbs(csv_dir, Path(TEST_DB_DIR, 'SHREAD'), if_exists='replace')
+    new_df = utils.screen_spatial(*args)
+    assert engine.pool is not pool
+    df = read_basin('swe', 'NVRN5L_F').set_index(['Date', 'OBJECTID'])['mean']
+    assert not new_df['mean'].equals(old_df['mean'])
+    assert new_df['mean'].tolist() == df.loc[list(zip(new_df.index.tz_localize(None), new_df['OBJECTID']))].tolist()
+
+def test_engines_are_pooled_with_read_pragmas(shread_dbs):
+    engine = utils.get_engine('swe')
+    assert isinstance(engine.pool, QueuePool)
+    utils.read_bind('swe', 'select count(*) from "NVRN5L_F_points"', {})
+    with engine.connect() as con:
+        pragmas = {p: con.exec_driver_sql(f'pragma {p}').scalar() for p in db_engines.READ_PRAGMAS}
+        # Read-only
+        with pytest.raises(OperationalError):
+            con.exec_driver_sql('create table t (x INTEGER)')
+    assert pragmas == {'mmap_size': 268435456, 'cache_size': -32000, 'temp_store': 2}
+    # The connection is kept for the next query
+    assert engine.pool.checkedin() == 1
+
+def test_check_table_rejects_unknown_names(usgs_dbs):
+    assert utils.check_table('usgs_dv', 'site_09355500') == 'site_09355500'
+    with pytest.raises(ValueError):
+        utils.check_table('usgs_dv', 'site_09355500" where 1=1 --')
+    with pytest.raises(ValueError):
+        utils.screen_usgs('09355500"; drop table "site_09361500', '2021-01-01', '2021-01-31', 'dv')
+    assert len(utils.screen_usgs('09361500', '2021-01-01', '2021-02-01', 'dv')) == 31
+
+def test_screen_usgs_binds_dates(usgs_dbs):
+    df = usgs_dbs[usgs_dbs['site'] == '09355500']
+    out_df = utils.screen_usgs('09355500', '2021-01-05', '2021-01-10', 'dv')
+    expected = df[(df['date'] >= '2021-01-05') & (df['date'] < '2021-01-10')]
+    assert out_df['flow'].tolist() == expected['flow'].tolist()
+    assert (out_df.index == expected['date']).all()
+    # A quote in a date is compared as text (so the 10th, '2021-01-10 00:00...' < "2021-01-10'", is in range), not
+    # run as SQL (which would return every date)
+    out_df = utils.screen_usgs('09355500', '2021-01-05', "2021-01-10' or '1'='1", 'dv')
+    expected = df[(df['date'] >= '2021-01-05') & (df['date'] <= '2021-01-10')]
+    assert out_df['flow'].tolist() == expected['flow'].tolist()
+
+def get_cache_counts():
+    info = utils.cache_info()['screen_usgs']
+    return info['hits'], info['misses']
+
+def test_cache_result_hits_and_copies(usgs_dbs):
+    hits, misses = get_cache_counts()
+    args = ('09355500', '2021-01-05', '2021-01-10', 'dv')
+    out_df = utils.screen_usgs(*args)
+    assert get_cache_counts() == (hits, misses + 1)
+    # Keyword arguments are the same call; callers get a copy of the cached frame
+    out_df['flow'] = -1.0
+    cached_df = utils.screen_usgs(site='09355500', s_date='2021-01-05', e_date='2021-01-10', dtype='dv')
+    assert get_cache_counts() == (hits + 1, misses + 1)
+    assert (cached_df['flow'] >= 0).all()
+    utils.screen_usgs('09355500', '2021-01-05', '2021-01-11', 'dv')
+    assert get_cache_counts() == (hits + 1, misses + 2)
+    assert utils.cache_info()['total']['size'] == 2
+
+def test_cache_result_expires_and_evicts(usgs_dbs, monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(utils, 'time', SimpleNamespace(monotonic=lambda: clock[0]))
+    monkeypatch.setattr(utils, 'CACHE_TTL', 60)
+    monkeypatch.setattr(utils, 'CACHE_SIZE', 2)
+    calls = [('09355500', '2021-01-05', e_date, 'dv') for e_date in ['2021-01-10', '2021-01-11', '2021-01-12']]
+    hits, misses = get_cache_counts()
+    utils.screen_usgs(*calls[0])
+    clock[0] = 59
+    utils.screen_usgs(*calls[0])
+    assert get_cache_counts() == (hits + 1, misses + 1)
+    clock[0] = 60
+    utils.screen_usgs(*calls[0])
+    assert get_cache_counts() == (hits + 1, misses + 2)
+    # The least recently used entry is dropped over CACHE_SIZE
+    utils.screen_usgs(*calls[1])
+    utils.screen_usgs(*calls[0])
+    utils.screen_usgs(*calls[2])
+    assert utils.cache_info()['total']['size'] == 2
+    utils.screen_usgs(*calls[0])
+    assert get_cache_counts() == (hits + 3, misses + 4)
+    utils.screen_usgs(*calls[1])
+    assert get_cache_counts() == (hits + 3, misses + 5)
+
+def test_cache_result_dropped_on_rebuild(usgs_dbs, make_usgs_df):
+    from database.FLOW import usgs_to_db
+
+    args = ('09355500', '2021-01-05', '2021-01-10', 'dv')
+    old_df = utils.screen_usgs(*args)
+    # No clear_cache: the new stamp of the db file misses the cached result
+    df = make_usgs_df(pd.date_range('2021-01-01', '2021-01-31'), seed=1)
+    usgs_to_db.write_db(df, Path(TEST_DB_DIR, 'FLOW'), if_exists='replace', verbose=False)
+    hits, misses = get_cache_counts()
+    new_df = utils.screen_usgs(*args)
+    assert get_cache_counts() == (hits, misses + 1)
+    expected = df[(df['site'] == '09355500') & df['date'].between('2021-01-05', '2021-01-09')]
+    assert new_df['flow'].tolist() == expected['flow'].tolist() != old_df['flow'].tolist()
+
+def test_db_stamp_checked_once_per_interval(usgs_dbs, make_usgs_df, monkeypatch):
+    from database.FLOW import usgs_to_db
+
+    clock = [0.0]
+    monkeypatch.setattr(utils, 'time', SimpleNamespace(monotonic=lambda: clock[0]))
+    monkeypatch.setattr(utils, 'STAMP_INTERVAL', 2)
+    monkeypatch.setattr(utils, '_db_stamps', dict())
+    args = ('09355500', '2021-01-05', '2021-01-10', 'dv')
+    old_df = utils.screen_usgs(*args)
+    df = make_usgs_df(pd.date_range('2021-01-01', '2021-01-31'), seed=2)
+    usgs_to_db.write_db(df, Path(TEST_DB_DIR, 'FLOW'), if_exists='replace', verbose=False)
+    # Within the interval the old stamp (and so the cached result) is used, after it the rebuilt db is read
+    clock[0] = 1.9
+    assert utils.screen_usgs(*args)['flow'].tolist() == old_df['flow'].tolist()
+    clock[0] = 2.0
+    expected = df[(df['site'] == '09355500') & df['date'].between('2021-01-05', '2021-01-09')]
+    assert utils.screen_usgs(*args)['flow'].tolist() == expected['flow'].tolist() != old_df['flow'].tolist()
+
+def make_site_dfs(dates, sites, variables, seed=0):
+    """
+    Date indexed site dataframes (dict by site) with random gaps, and a date column as screen_snotel returns
+    """
+    rng = np.random.default_rng(seed)
+    site_dfs = dict()
+    for s in sites:
+        site_dates = dates[rng.random(len(dates)) > 0.2]
+        df = pd.DataFrame({v: rng.gamma(2.0, 5.0, len(site_dates)) for v in variables}, index=site_dates)
+        df.insert(0, 'date', site_dates)
+        site_dfs[s] = df
+    return site_dfs
+
+def align_sites_legacy(site_dfs, var, sites, dates):
+    """
+    The per-site merge of the plot builders before align_sites, for comparison
+    """
+    var_df = pd.DataFrame(index=dates)
+    for s in sites:
+        merged = var_df.merge(site_dfs[s][var], left_index=True, right_index=True, how='left')
+        var_df[s] = merged[var]
+    return var_df
+
+def test_align_sites_matches_merge():
+    dates = pd.date_range('2021-01-01', '2021-03-01', freq='6H', tz='UTC')
+    sites = ['713_CO_SNTL', '386_CO_SNTL', '1060_CO_SNTL']
+    site_dfs = make_site_dfs(dates, sites, ['WTEQ', 'PREC'])
+    # The plot axis is wider than the data
+    plot_dates = pd.date_range('2020-12-25', '2021-03-05', freq='6H', tz='UTC')
+    wide_df = utils.sites_to_wide(site_dfs, sites)
+    for var in ['WTEQ', 'PREC']:
+        expected = align_sites_legacy(site_dfs, var, sites, plot_dates)
+        pd.testing.assert_frame_equal(utils.align_sites(site_dfs, var, sites, plot_dates), expected, check_freq=False)
+        pd.testing.assert_frame_equal(utils.align_sites(wide_df, var, sites, plot_dates), expected, check_freq=False)
+
+def test_align_sites_missing_data():
+    dates = pd.date_range('2021-01-01', '2021-01-10', tz='UTC')
+    site_dfs = make_site_dfs(dates, ['a', 'b'], ['WTEQ'])
+    site_dfs['b'] = site_dfs['b'].drop(columns='WTEQ')
+    # The last row of a duplicated date is kept
+    site_dfs['a'] = pd.concat([site_dfs['a'], site_dfs['a'].iloc[[-1]].assign(WTEQ=-1.0)])
+    var_df = utils.align_sites(site_dfs, 'WTEQ', ['a', 'b', 'c'])
+    assert var_df.columns.tolist() == ['a', 'b', 'c']
+    assert var_df.index.is_unique and (var_df['a'].iloc[-1] == -1.0)
+    assert var_df[['b', 'c']].isna().all().all()
+    # No data at all: an all NaN frame on the plot axis
+    var_df = utils.align_sites(dict(), 'WTEQ', ['a'], dates)
+    assert var_df.index.equals(dates) and var_df['a'].isna().all()
+
+def test_sites_to_wide_columns():
+    dates = pd.date_range('2021-01-01', '2021-01-10', tz='UTC')
+    site_dfs = make_site_dfs(dates, ['a', 'b'], ['WTEQ', 'PREC'])
+    wide_df = utils.sites_to_wide(site_dfs, ['a', 'b'])
+    assert wide_df.columns.tolist() == [('WTEQ', 'a'), ('WTEQ', 'b'), ('PREC', 'a'), ('PREC', 'b')]
+    assert wide_df.index.equals(site_dfs['a'].index.union(site_dfs['b'].index))
+    wide_df = utils.sites_to_wide(site_dfs, ['a', 'b'], ['PREC', 'TAVG'])
+    assert wide_df.columns.tolist() == [('PREC', 'a'), ('PREC', 'b'), ('TAVG', 'a'), ('TAVG', 'b')]
+    assert wide_df['TAVG'].isna().all().all()
+
+@pytest.fixture
+def spatial_engine(monkeypatch):
+    """
+    Switch the engine of screen_spatial and ba_stats_all (SPATIAL_ENGINE), clearing the cached results. The cubes
+    aren't used, so the points are read by each engine, and the results screen_spatial_duckdb returns are counted
+    (switch.duckdb_rows), so a fall back to SQLite doesn't pass unseen.
+    """
+    pytest.importorskip('duckdb')
+    monkeypatch.setattr(utils, 'USE_CUBE', False)
+    real_screen_spatial_duckdb = utils.screen_spatial_duckdb
+
+    def screen_spatial_duckdb(*args, **kwargs):
+        out_df = real_screen_spatial_duckdb(*args, **kwargs)
+        if out_df is not None:
+            switch.duckdb_rows += len(out_df)
+        return out_df
+
+    def switch(engine):
+        monkeypatch.setattr(utils, 'SPATIAL_ENGINE', engine)
+        utils.clear_cache()
+    switch.duckdb_rows = 0
+    monkeypatch.setattr(utils, 'screen_spatial_duckdb', screen_spatial_duckdb)
+    yield switch
+    utils.clear_cache()
+
+def test_ba_stats_all_duckdb_matches_pandas(spatial_engine):
+    rng = np.random.default_rng(0)
+    dates = pd.date_range('2021-01-01', periods=6)
+    values = [rng.gamma(2.0, 5.0, 40) for _ in range(4)] + [[1.5], [np.nan, np.nan]]
+    df = pd.concat([pd.DataFrame({'Date': date, 'mean': v}) for date, v in zip(dates, values)], ignore_index=True)
+    # Missing values, a date with one value (no std) and a date without values
+    df.loc[df.index[:160][rng.random(160) < 0.2], 'mean'] = np.nan
+    spatial_engine('sqlite')
+    expected = utils.ba_stats_all(df)
+    spatial_engine('duckdb')
+    pd.testing.assert_frame_equal(utils.ba_stats_all(df), expected, check_index_type=False)
+
+SPATIAL_FILTERS = [
+    ([0, 360], [0, 20000], [0, 100]),
+    ([90, 270], [8000, 11000], [0, 30]),
+    ([-45, 45], [9000, 13000], [10, 60]),
+]
+
+@pytest.mark.parametrize('filters', SPATIAL_FILTERS)
+def test_screen_spatial_stats_match_ba_stats_all(shread_dbs, spatial_engine, filters):
+    args = ('swe', '2021-01-05', '2021-01-20', 'NVRN5L_F', *filters)
+    spatial_engine('sqlite')
+    # One point of the filters left on a date, no values on a date and no rows on a date
+    point_id = int(utils.screen_spatial(*args)['OBJECTID'].min())
+    con = sqlite3.connect(Path(TEST_DB_DIR, 'SHREAD', 'swe.db'))
+    with con:
+        con.execute("delete from NVRN5L_F where Date like '2021-01-10%' and OBJECTID != ?", [point_id])
+        con.execute("update NVRN5L_F set mean = null where Date like '2021-01-12%'")
+        con.execute("delete from NVRN5L_F where Date like '2021-01-14%'")
+    con.close()
+    utils.clear_cache()
+    out_df = utils.screen_spatial(*args, agg=True)
+    expected = utils.ba_stats_all(utils.screen_spatial(*args))
+    expected.index = pd.to_datetime(expected.index, utc=True)
+    pd.testing.assert_frame_equal(
+        out_df[expected.columns], expected, check_dtype=False, check_index_type=False, check_names=False
+    )
+    counts = out_df['count'].to_dict()
+    assert counts[pd.Timestamp('2021-01-10', tz='UTC')] == 1
+    assert counts[pd.Timestamp('2021-01-12', tz='UTC')] == 0
+    assert pd.Timestamp('2021-01-14', tz='UTC') not in counts
+
+@pytest.mark.parametrize('filters', SPATIAL_FILTERS)
+def test_screen_spatial_duckdb_matches_sqlite(shread_dbs, spatial_engine, filters):
+    args = ('swe', '2021-01-05', '2021-01-20', 'NVRN5L_F', *filters)
+    spatial_engine('sqlite')
+    expected = utils.screen_spatial(*args, agg=True)
+    # The live dbs are read by DuckDB through its sqlite extension
+    spatial_engine('duckdb')
+    if utils.attach_duckdb('swe') is None:
+        pytest.skip('DuckDB sqlite extension not installed')
+    pd.testing.assert_frame_equal(utils.screen_spatial(*args, agg=True), expected, check_dtype=False)
+    assert spatial_engine.duckdb_rows == len(expected) > 0
+
+def test_screen_spatial_duckdb_without_sqlite_extension(shread_dbs, spatial_engine, monkeypatch, capsys):
+    args = ('swe', '2021-01-05', '2021-01-20', 'NVRN5L_F')
+    spatial_engine('sqlite')
+    expected = utils.screen_spatial(*args, agg=True)
+    # The extension isn't downloaded, so a DuckDB without it falls back to SQLite with a warning
+    spatial_engine('duckdb')
+    con = utils.duckdb.connect(config={
+        'autoinstall_known_extensions': False,
+        'extension_directory': Path(TEST_DB_DIR, 'no_extensions').as_posix(),
+    })
+    monkeypatch.setattr(utils, '_duckdb', {'con': con})
+    monkeypatch.setattr(utils, '_duckdb_attached', dict())
+    if utils.attach_duckdb('swe') is not None:
+        pytest.skip('DuckDB sqlite extension is built in')
+    assert 'Warning: DuckDB sqlite extension not installed' in capsys.readouterr().out
+    pd.testing.assert_frame_equal(utils.screen_spatial(*args, agg=True), expected, check_dtype=False)
+    assert spatial_engine.duckdb_rows == 0
+
+@pytest.mark.parametrize('filters', SPATIAL_FILTERS)
+def test_screen_spatial_parquet_engines_match(shread_dbs, spatial_engine, monkeypatch, tmp_path, filters):
+    pytest.importorskip('pyarrow')
+    from database.SHREAD import shread_to_parquet
+    shread_to_parquet.write_parquet(Path(TEST_DB_DIR, 'SHREAD'), tmp_path, ['swe'])
+    monkeypatch.setattr(utils, 'SPATIAL_BACKEND', 'parquet')
+    monkeypatch.setattr(utils, 'PARQUET_DIR', str(tmp_path))
+    args = ('swe', '2021-01-05', '2021-01-20', 'NVRN5L_F', *filters)
+    spatial_engine('sqlite')
+    assert utils.use_parquet('swe', 'NVRN5L_F') is not None
+    expected_stats = utils.screen_spatial(*args, agg=True)
+    expected = utils.screen_spatial(*args).sort_values(['Date', 'OBJECTID'])
+    spatial_engine('duckdb')
+    pd.testing.assert_frame_equal(utils.screen_spatial(*args, agg=True), expected_stats, check_dtype=False)
+    out_df = utils.screen_spatial(*args).sort_values(['Date', 'OBJECTID'])
+    pd.testing.assert_frame_equal(out_df[expected.columns], expected, check_dtype=False)
+    assert spatial_engine.duckdb_rows == len(expected_stats) + len(expected) > 0
+
+# Filters and percentiles of screen_spatial(agg=True), and whether the cube answers them: whole cells above an
+# elevation band (the rollup), whole cells without percentiles, cells split by the filters (slopes to 50 split the
+# class above 45), and percentiles of cells that aren't a rollup
+CUBE_CASES = [
+    (([0, 360], [9000, 20000], [0, 100]), True, True),
+    (SPATIAL_FILTERS[1], False, True),
+    (SPATIAL_FILTERS[2], False, True),
+    (([0, 360], [0, 20000], [0, 50]), False, False),
+    (([0, 360], [9000, 20000], [0, 50]), True, False),
+    (SPATIAL_FILTERS[1], True, False),
+]
+
+@pytest.mark.parametrize('build', ['replace', 'upsert'])
+@pytest.mark.parametrize('filters, percentiles, in_cube', CUBE_CASES)
+def test_screen_spatial_cube_matches_points(shread_dbs, write_snodas_csvs, tmp_path, monkeypatch, build, filters,
+                                            percentiles, in_cube):
+    s_date, e_date = '2021-01-05', '2021-01-20'
+    if build == 'upsert':
+        # Dates overlapping the db (updated) and after it (added); cube_basins updates the cube of those dates only
+        csv_dir = write_snodas_csvs(Path(tmp_path, 'upsert'), pd.date_range('2021-01-18', '2021-02-05'), 60, seed=1)
+        shread_snow_to_db.write_dbs(csv_dir, Path(TEST_DB_DIR, 'SHREAD'), if_exists='upsert')
+        s_date, e_date = '2021-01-10', '2021-02-06'
+    args = ('swe', s_date, e_date, 'NVRN5L_F', *filters)
+    utils.clear_cache()
+    cube_df = utils.screen_spatial_cube('swe', 'NVRN5L_F', s_date, e_date, *filters, percentiles=percentiles)
+    assert (cube_df is not None) == in_cube
+    monkeypatch.setattr(utils, 'USE_CUBE', True)
+    out_df = utils.screen_spatial(*args, agg=True, percentiles=percentiles)
+    monkeypatch.setattr(utils, 'USE_CUBE', False)
+    utils.clear_cache()
+    expected = utils.screen_spatial(*args, agg=True, percentiles=percentiles)
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(out_df, expected, check_dtype=False, check_index_type=False)
+    if in_cube:
+        pd.testing.assert_frame_equal(cube_df, expected, check_dtype=False, check_index_type=False)